@@ -81,6 +81,10 @@ def main():
             if base_url_template:
                 cmd.extend(['--base-url-template', base_url_template])
 
+            mirrors = repo.get('mirrors', [])
+            for m in mirrors:
+                cmd.extend(['--mirror', m])
+
             snapshot_id_suffix = repo.get('snapshot_id_suffix')
             if snapshot_id_suffix:
                 cmd.extend(['--snapshot-id-suffix', snapshot_id_suffix])
@@ -23,7 +23,7 @@ class BaseRepoConfigGenerator(abc.ABC):
 
     # pylint: disable=too-many-arguments
     def __init__(self, release, arch, repo_name=None, singleton=None, storage=None, base_url=None,
-                 base_url_template=None, snapshot_id_suffix=None):
+                 base_url_template=None, snapshot_id_suffix=None, mirrors=None):
         """
         :param release: The release to generate the repository file for (e.g. 8.3)
         :param arch: The architecture to generate the repository file for (e.g. x86_64)
@@ -33,6 +33,7 @@ class BaseRepoConfigGenerator(abc.ABC):
         :param base_url: The base URL to use (if not provided, it will be generated based on the generator class rules)
         :param snapshot_id_suffix: The snapshot ID suffix to use (if not provided, it will be generated based on the
                                    generator class rules)
+        :param mirrors: List of mirror base URL templates to use in addition to the base URL (defaults to None)
         """
         self.release = release
         self.arch = arch
@@ -42,6 +43,7 @@ class BaseRepoConfigGenerator(abc.ABC):
         self.base_url = base_url
         self.base_url_template = base_url_template
         self.snapshot_id_suffix = snapshot_id_suffix
+        self.mirrors = mirrors
 
     @staticmethod
     @abc.abstractmethod
@@ -75,6 +77,17 @@ class BaseRepoConfigGenerator(abc.ABC):
         Return the snapshot ID to use
         """
 
+    def get_mirrors(self):
+        """
+        Return the list of mirror base URLs to use
+
+        Mirrors are templates, which can refer to the release, the architecture and the repository name.
+        """
+        return [
+            template.format(release=self.release, arch=self.arch, repo_name=self.repo_name)
+            for template in self.mirrors or []
+        ]
+
     def generate(self, target_dir):
         """
         Generate the repository file
@@ -87,6 +100,8 @@ class BaseRepoConfigGenerator(abc.ABC):
         }
         if self.singleton is not None:
             repo_config['singleton'] = self.singleton
+        if self.mirrors:
+            repo_config['mirrors'] = self.get_mirrors()
 
         filename = f"{self.get_snapshot_id()}.json"
         path = os.path.join(target_dir, filename)
@@ -113,8 +128,9 @@ class RHELRepoConfigGenerator(BaseRepoConfigGenerator):
 
     # pylint: disable=too-many-arguments
     def __init__(self, release, arch, repo_name=None, singleton=None, storage=None, base_url=None,
-                 base_url_template=None, snapshot_id_suffix=None, released=False, eus=False, e4s=False):
-        super().__init__(release, arch, repo_name, singleton, storage, base_url, base_url_template, snapshot_id_suffix)
+                 base_url_template=None, snapshot_id_suffix=None, released=False, eus=False, e4s=False, mirrors=None):
+        super().__init__(release, arch, repo_name, singleton, storage, base_url, base_url_template, snapshot_id_suffix,
+                         mirrors)
         self.released = released
         self.eus = eus
         self.e4s = e4s
@@ -248,8 +264,9 @@ class FedoraRepoConfigGenerator(BaseRepoConfigGenerator):
 
     # pylint: disable=too-many-arguments
     def __init__(self, release, arch, repo_name=None, singleton=None, storage=None, base_url=None,
-                 base_url_template=None, snapshot_id_suffix=None, stream='releases'):
-        super().__init__(release, arch, repo_name, singleton, storage, base_url, base_url_template, snapshot_id_suffix)
+                 base_url_template=None, snapshot_id_suffix=None, stream='releases', mirrors=None):
+        super().__init__(release, arch, repo_name, singleton, storage, base_url, base_url_template, snapshot_id_suffix,
+                         mirrors)
         self.stream = stream
         if self.stream not in self.RELEASE_STREAM:
             raise ValueError(f'Invalid release status: {self.stream}')
@@ -322,8 +339,8 @@ class ELNRepoConfigGenerator(BaseRepoConfigGenerator):
                                "{repo_name}/{arch}/os/"
 
     # pylint: disable=too-many-arguments
-    def __init__(self, arch, repo_name):
-        super().__init__(None, arch, repo_name=repo_name)
+    def __init__(self, arch, repo_name, mirrors=None):
+        super().__init__(None, arch, repo_name=repo_name, mirrors=mirrors)
 
     @staticmethod
     def default_arches(release):
@@ -382,6 +399,14 @@ def get_parser():
         metavar='TMPL',
         help='URL template to use for the repository base URL'
     )
+    parser.add_argument(
+        '--mirror',
+        action='append',
+        default=[],
+        metavar='TMPL',
+        help='Mirror base URL template to use in addition to the base URL (may refer to {release}, {arch} and ' +
+             '{repo_name})'
+    )
     parser.add_argument(
         '--snapshot-id-suffix',
         action='store',
@@ -528,15 +553,17 @@ def main():
         for repo_name in repo_names:
             if args.distro == 'rhel':
                 generator = args.generator(args.release, arch, repo_name, args.singleton, args.storage, args.base_url,
-                                           args.base_url_template, args.snapshot_id_suffix, args.released, args.eus, args.e4s)
+                                           args.base_url_template, args.snapshot_id_suffix, args.released, args.eus, args.e4s,
+                                           mirrors=args.mirror)
             elif args.distro == 'fedora':
                 generator = args.generator(args.release, arch, repo_name, args.singleton, args.storage, args.base_url,
-                                           args.base_url_template, args.snapshot_id_suffix, args.stream)
+                                           args.base_url_template, args.snapshot_id_suffix, args.stream,
+                                           mirrors=args.mirror)
             elif args.distro == 'eln':
-                generator = args.generator(arch, repo_name)
+                generator = args.generator(arch, repo_name, mirrors=args.mirror)
             else:
                 generator = args.generator(args.release, arch, repo_name, args.singleton, args.storage, args.base_url,
-                                           args.base_url_template, args.snapshot_id_suffix)
+                                           args.base_url_template, args.snapshot_id_suffix, mirrors=args.mirror)
             generator.generate(args.target_dir)
 
 
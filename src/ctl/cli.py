@@ -8,11 +8,12 @@ provides the most basic way to execute and interact with the rpmrepo functions.
 
 import argparse
 import contextlib
+import json
 import os
 import sys
 import uuid
 
-from . import index, pull, push, enumerate_cache
+from . import flatten, index, metrics, pull, push, reuse, snapshot, transfer, enumerate_cache
 
 
 class CliIndex:
@@ -24,7 +25,14 @@ class CliIndex:
     def run(self):
         """Run index command"""
 
-        with index.Index(self._ctx.cache) as cmd:
+        with index.Index(
+                self._ctx.cache,
+                jobs=self._ctx.args.jobs,
+                trust_metadata=self._ctx.args.trust_metadata,
+                store=self._ctx.store,
+                platform_id=self._ctx.args.platform_id,
+                metrics=self._ctx.metrics,
+            ) as cmd:
             cmd.index()
 
         return 0
@@ -36,13 +44,26 @@ class CliPull:
     def __init__(self, ctx):
         self._ctx = ctx
 
+    def _parse_args(self):
+        if self._ctx.args.skip_stored is not None or self._ctx.args.mirror:
+            assert self._ctx.args.backend == "native"
+
     def run(self):
         """Run pull command"""
 
+        self._parse_args()
+
         with pull.Pull(
                 self._ctx.cache,
                 self._ctx.args.platform_id,
                 self._ctx.args.base_url,
+                backend=self._ctx.args.backend,
+                jobs=self._ctx.args.jobs,
+                skip_stored=self._ctx.args.skip_stored,
+                store=self._ctx.store,
+                list_remote=not self._ctx.args.no_list_remote,
+                mirrors=self._ctx.args.mirror,
+                metrics=self._ctx.metrics,
             ) as cmd:
             cmd.pull()
 
@@ -62,17 +83,111 @@ class CliPush:
             if entry[0] == "data":
                 assert entry[1] in ["public", "rhvpn"]
 
+    def _profile(self):
+        if self._ctx.args.transfer_profile == "auto":
+            return None
+        return transfer.Profile.parse(self._ctx.args.transfer_profile)
+
     def run(self):
         """Run push command"""
 
         self._parse_args()
 
-        with push.Push(self._ctx.cache) as cmd:
-            for entry in self._ctx.args.to:
-                if entry[0] == "data":
-                    cmd.push_data_s3(entry[1], entry[2])
-                elif entry[0] == "snapshot":
-                    cmd.push_snapshot_s3(entry[1], entry[2])
+        # The push journal is scoped to the snapshots that are pushed, so a
+        # failed push of the same snapshots resumes where it stopped.
+        snapshots = [v[1] + v[2] for v in self._ctx.args.to if v[0] == "snapshot"]
+
+        with push.Push(
+                self._ctx.cache,
+                store=self._ctx.store,
+                jobs=self._ctx.args.jobs,
+                list_remote=not self._ctx.args.no_list_remote,
+                profile=self._profile(),
+                max_bandwidth=self._ctx.args.max_bandwidth,
+                max_requests=self._ctx.args.max_requests,
+                run=",".join(snapshots) or None,
+                reset_journal=self._ctx.args.reset_journal,
+                metrics=self._ctx.metrics,
+            ) as cmd:
+            targets = [tuple(entry) for entry in self._ctx.args.to]
+            if self._ctx.args.delta_base is not None:
+                targets = [v + (self._ctx.args.delta_base,) if v[0] == "snapshot" else v for v in targets]
+            push_plan = cmd.plan(targets)
+
+            if self._ctx.args.plan == "json":
+                print(json.dumps(push_plan.to_dict(), indent=2))
+            elif self._ctx.args.plan == "text":
+                print(push_plan.to_text(), end="")
+            else:
+                cmd.execute(push_plan)
+
+        return 0
+
+class CliSnapshot:
+    """Snapshot Command"""
+
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    def run(self):
+        """Run snapshot command"""
+
+        with snapshot.Snapshot(
+                self._ctx.cache,
+                self._ctx.args.platform_id,
+                self._ctx.args.base_url,
+                storage=self._ctx.args.storage,
+                snapshot_id=self._ctx.args.snapshot_id,
+                snapshot_suffix=self._ctx.args.snapshot_suffix,
+                store=self._ctx.store,
+                jobs=self._ctx.args.jobs,
+                list_remote=not self._ctx.args.no_list_remote,
+                disk_budget=self._ctx.args.disk_budget,
+                skip_unchanged=self._ctx.args.skip_unchanged,
+                delta=self._ctx.args.delta,
+                mirrors=self._ctx.args.mirror,
+                reset_journal=self._ctx.args.reset_journal,
+                metrics=self._ctx.metrics,
+            ) as cmd:
+            cmd.snapshot()
+
+        return 0
+
+class CliReuse:
+    """Reuse Command"""
+
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    def run(self):
+        """Run reuse command"""
+
+        with reuse.Reuse(
+                self._ctx.cache,
+                self._ctx.args.base_url,
+                snapshot_id=self._ctx.args.snapshot_id,
+                snapshot_suffix=self._ctx.args.snapshot_suffix,
+                store=self._ctx.store,
+                delta=self._ctx.args.delta,
+                metrics=self._ctx.metrics,
+            ) as cmd:
+            if not cmd.reuse():
+                return Cli.EXITCODE_CHANGED
+
+        return 0
+
+class CliFlatten:
+    """Flatten Command"""
+
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    def run(self):
+        """Run flatten command"""
+
+        with flatten.Flatten(jobs=self._ctx.args.jobs, metrics=self._ctx.metrics) as cmd:
+            snapshots = self._ctx.args.snapshot or cmd.find(self._ctx.args.min_depth)
+            cmd.flatten(snapshots)
 
         return 0
 
@@ -85,24 +200,30 @@ class CliEnumerateCache:
     def run(self):
         """Run EnumerateCache command"""
 
-        with enumerate_cache.EnumerateCache() as cmd:
+        with enumerate_cache.EnumerateCache(metrics=self._ctx.metrics) as cmd:
             cmd.build()
 
         return 0
 
+# pylint: disable=too-many-instance-attributes
 class Cli(contextlib.AbstractContextManager):
     """RPMrepo Command Line Interface"""
 
     EXITCODE_INVALID_COMMAND = 1
+    # argparse exits with 2 on usage errors, so it is not used here.
+    EXITCODE_CHANGED = 3
 
     def __init__(self, argv):
         self.args = None
         self.cache = None
         self.local = None
+        self.metrics = None
+        self.store = None
         self._argv = argv
         self._exitstack = None
         self._parser = None
 
+    # pylint: disable=too-many-statements
     def _parse_args(self):
         self._parser = argparse.ArgumentParser(
             add_help=True,
@@ -124,13 +245,19 @@ class Cli(contextlib.AbstractContextManager):
             metavar="NAME",
             type=str,
         )
+        self._parser.add_argument(
+            "--metrics-prometheus",
+            help="Additionally write metrics as Prometheus textfile to PATH",
+            metavar="PATH",
+            type=os.path.abspath,
+        )
 
         cmd = self._parser.add_subparsers(
             dest="cmd",
             title="RPMrepo Commands",
         )
 
-        _cmd_index = cmd.add_parser(
+        cmd_index = cmd.add_parser(
             "index",
             add_help=True,
             allow_abbrev=False,
@@ -139,6 +266,24 @@ class Cli(contextlib.AbstractContextManager):
             help="Create RPM repository index",
             prog=f"{self._parser.prog} index",
         )
+        cmd_index.add_argument(
+            "--jobs",
+            help="Number of files to hash in parallel (defaults to the number of CPUs)",
+            metavar="N",
+            type=int,
+        )
+        cmd_index.add_argument(
+            "--trust-metadata",
+            action="store_true",
+            default=False,
+            help="Use package checksums from the repository metadata rather than hashing packages",
+        )
+        cmd_index.add_argument(
+            "--platform-id",
+            help="Share data via the content store of this RPM platform ID",
+            metavar="ID",
+            type=str,
+        )
 
         cmd_pull = cmd.add_parser(
             "pull",
@@ -149,6 +294,12 @@ class Cli(contextlib.AbstractContextManager):
             help="Fetch a full RPM Repository",
             prog=f"{self._parser.prog} pull",
         )
+        cmd_pull.add_argument(
+            "--backend",
+            choices=pull.BACKENDS,
+            default="native",
+            help="Backend to download the repository with (defaults to 'native')",
+        )
         cmd_pull.add_argument(
             "--base-url",
             help="RPM repository base URL to fetch from",
@@ -156,6 +307,14 @@ class Cli(contextlib.AbstractContextManager):
             required=True,
             type=str,
         )
+        cmd_pull.add_argument(
+            "--mirror",
+            action="append",
+            default=[],
+            help="Further base URL to download packages from, verified against the base URL (native backend only)",
+            metavar="URL",
+            type=str,
+        )
         cmd_pull.add_argument(
             "--platform-id",
             help="RPM platform ID to use",
@@ -163,6 +322,23 @@ class Cli(contextlib.AbstractContextManager):
             required=True,
             type=str,
         )
+        cmd_pull.add_argument(
+            "--jobs",
+            help=f"Number of concurrent downloads of the native backend (defaults to {pull.JOBS})",
+            metavar="N",
+            type=int,
+        )
+        cmd_pull.add_argument(
+            "--skip-stored",
+            choices=push.STORAGES,
+            help="Do not download packages already stored in this storage (native backend only)",
+        )
+        cmd_pull.add_argument(
+            "--no-list-remote",
+            action="store_true",
+            default=False,
+            help="Do not list remote storage for stored packages, only rely on the local content store",
+        )
 
         cmd_push = cmd.add_parser(
             "push",
@@ -173,6 +349,56 @@ class Cli(contextlib.AbstractContextManager):
             help="Push a full RPM Repository",
             prog=f"{self._parser.prog} push",
         )
+        cmd_push.add_argument(
+            "--jobs",
+            help=f"Number of concurrent uploads (defaults to {push.JOBS})",
+            metavar="N",
+            type=int,
+        )
+        cmd_push.add_argument(
+            "--max-bandwidth",
+            help="Cap the upload bandwidth of the push to SIZE bytes per second (e.g., 50M)",
+            metavar="SIZE",
+            type=transfer.parse_size,
+        )
+        cmd_push.add_argument(
+            "--max-requests",
+            help="Cap the requests of the push to N per second",
+            metavar="N",
+            type=float,
+        )
+        cmd_push.add_argument(
+            "--no-list-remote",
+            action="store_true",
+            default=False,
+            help="Do not list remote storage for existing data, only rely on the local content store",
+        )
+        cmd_push.add_argument(
+            "--reset-journal",
+            action="store_true",
+            default=False,
+            help="Discard the push journal, rather than resuming a previous push of the same snapshots",
+        )
+        cmd_push.add_argument(
+            "--transfer-profile",
+            default="auto",
+            help="Upload profile as 'threshold=SIZE,part-size=SIZE,part-jobs=N', or 'auto' (default)",
+            metavar="PROFILE",
+            type=str,
+        )
+        cmd_push.add_argument(
+            "--plan",
+            choices=["text", "json"],
+            const="text",
+            help="Only print the plan of the push, as text (default) or JSON",
+            nargs="?",
+        )
+        cmd_push.add_argument(
+            "--delta-base",
+            help="Push snapshot targets as delta of the snapshot NAME",
+            metavar="NAME",
+            type=str,
+        )
         cmd_push.add_argument(
             "--to",
             action="append",
@@ -183,6 +409,167 @@ class Cli(contextlib.AbstractContextManager):
             type=str,
         )
 
+        cmd_snapshot = cmd.add_parser(
+            "snapshot",
+            add_help=True,
+            allow_abbrev=False,
+            argument_default=None,
+            description="Stream an RPM repository into remote storage and snapshot it",
+            help="Pull, index, and push an RPM repository in a single pass",
+            prog=f"{self._parser.prog} snapshot",
+        )
+        cmd_snapshot.add_argument(
+            "--base-url",
+            help="RPM repository base URL to fetch from",
+            metavar="URL",
+            required=True,
+            type=str,
+        )
+        cmd_snapshot.add_argument(
+            "--mirror",
+            action="append",
+            default=[],
+            help="Further base URL to download packages from, verified against the base URL",
+            metavar="URL",
+            type=str,
+        )
+        cmd_snapshot.add_argument(
+            "--platform-id",
+            help="RPM platform ID to use",
+            metavar="ID",
+            required=True,
+            type=str,
+        )
+        cmd_snapshot.add_argument(
+            "--storage",
+            choices=push.STORAGES,
+            help="Storage to push the data to",
+            required=True,
+        )
+        cmd_snapshot.add_argument(
+            "--snapshot-id",
+            help="ID of the snapshot to create",
+            metavar="ID",
+            required=True,
+            type=str,
+        )
+        cmd_snapshot.add_argument(
+            "--snapshot-suffix",
+            default="",
+            help="Suffix of the snapshot to create",
+            metavar="SUFFIX",
+            type=str,
+        )
+        cmd_snapshot.add_argument(
+            "--disk-budget",
+            help="Stage at most SIZE bytes of packages on local disk at a time (e.g., 10G)",
+            metavar="SIZE",
+            type=transfer.parse_size,
+        )
+        cmd_snapshot.add_argument(
+            "--jobs",
+            help=f"Number of concurrent transfers (defaults to {push.JOBS})",
+            metavar="N",
+            type=int,
+        )
+        cmd_snapshot.add_argument(
+            "--no-list-remote",
+            action="store_true",
+            default=False,
+            help="Do not list remote storage for existing data, only rely on the local content store",
+        )
+        cmd_snapshot.add_argument(
+            "--reset-journal",
+            action="store_true",
+            default=False,
+            help="Discard the push journal, rather than resuming a previous push of the snapshot",
+        )
+        cmd_snapshot.add_argument(
+            "--skip-unchanged",
+            action="store_true",
+            default=False,
+            help="Reuse the last snapshot of the snapshot ID if the repository did not change since",
+        )
+        cmd_snapshot.add_argument(
+            "--delta",
+            action="store_true",
+            default=False,
+            help="Push the snapshot as delta of the last snapshot of the snapshot ID",
+        )
+
+        cmd_reuse = cmd.add_parser(
+            "reuse",
+            add_help=True,
+            allow_abbrev=False,
+            argument_default=None,
+            description=(
+                "Create a snapshot from the last snapshot of the same snapshot ID, if the repository "
+                f"did not change since. Exits with {Cli.EXITCODE_CHANGED} if the repository changed, "
+                "and with 2 on usage errors."
+            ),
+            help=f"Reuse the last snapshot of an unchanged RPM repository (exit {Cli.EXITCODE_CHANGED} if changed)",
+            prog=f"{self._parser.prog} reuse",
+        )
+        cmd_reuse.add_argument(
+            "--base-url",
+            help="RPM repository base URL to check",
+            metavar="URL",
+            required=True,
+            type=str,
+        )
+        cmd_reuse.add_argument(
+            "--snapshot-id",
+            help="ID of the snapshot to create",
+            metavar="ID",
+            required=True,
+            type=str,
+        )
+        cmd_reuse.add_argument(
+            "--snapshot-suffix",
+            default="",
+            help="Suffix of the snapshot to create",
+            metavar="SUFFIX",
+            type=str,
+        )
+
+        cmd_reuse.add_argument(
+            "--delta",
+            action="store_true",
+            default=False,
+            help="Push the snapshot as delta of the last snapshot of the snapshot ID",
+        )
+
+        cmd_flatten = cmd.add_parser(
+            "flatten",
+            add_help=True,
+            allow_abbrev=False,
+            argument_default=None,
+            description="Turn delta snapshots into full snapshots",
+            help="Flatten delta snapshots",
+            prog=f"{self._parser.prog} flatten",
+        )
+        cmd_flatten.add_argument(
+            "--jobs",
+            help=f"Number of concurrent requests (defaults to {flatten.JOBS})",
+            metavar="N",
+            type=int,
+        )
+        cmd_flatten.add_argument(
+            "--min-depth",
+            default=1,
+            help="Flatten all delta snapshots of at least this depth (defaults to 1)",
+            metavar="N",
+            type=int,
+        )
+        cmd_flatten.add_argument(
+            "--snapshot",
+            action="append",
+            default=[],
+            help="Flatten the snapshot NAME rather than searching for delta snapshots",
+            metavar="NAME",
+            type=str,
+        )
+
         cmd_push = cmd.add_parser(
             "enumerate-cache",
             add_help=True,
@@ -221,6 +608,15 @@ class Cli(contextlib.AbstractContextManager):
 
             print("LocalCache:", self.cache, file=sys.stdout)
 
+            # The content store is shared by all local caches. It is only
+            # populated if requested via `index --platform-id`.
+            self.store = os.path.join(self.args.cache, "store")
+
+            # Metrics of the command are collected in phases by the
+            # individual commands, and written to the local cache once the
+            # command finished (see `_write_metrics()`).
+            self.metrics = metrics.Metrics(self.args.cmd, labels={"local": self.local})
+
             # Setup succeeded, make sure to retain the exitstack for __exit__.
             self._exitstack = self._exitstack.pop_all()
 
@@ -230,18 +626,43 @@ class Cli(contextlib.AbstractContextManager):
         self._exitstack.close()
         self._exitstack = None
 
+    def _write_metrics(self):
+        # Metrics are stored next to `repo.ok` and `index.ok`, one document
+        # per command, so a later command does not clobber the metrics of an
+        # earlier one of the same run. Commands that did no work (e.g., a
+        # push that only printed its plan) keep the previous metrics.
+        if not self.metrics.phases:
+            return
+
+        path_conf = os.path.join(self.cache, "conf")
+        os.makedirs(path_conf, exist_ok=True)
+
+        self.metrics.write(
+            os.path.join(path_conf, f"metrics-{self.args.cmd}.json"),
+            prometheus=self.args.metrics_prometheus,
+        )
+
     def run(self):
         """Execute selected commands"""
 
-        if self.args.cmd == "index":
-            ret = CliIndex(self).run()
-        elif self.args.cmd == "pull":
-            ret = CliPull(self).run()
-        elif self.args.cmd == "push":
-            ret = CliPush(self).run()
-        elif self.args.cmd == "enumerate-cache":
-            ret = CliEnumerateCache(self).run()
-        else:
-            raise RuntimeError("Command mismatch")
+        try:
+            if self.args.cmd == "index":
+                ret = CliIndex(self).run()
+            elif self.args.cmd == "pull":
+                ret = CliPull(self).run()
+            elif self.args.cmd == "push":
+                ret = CliPush(self).run()
+            elif self.args.cmd == "reuse":
+                ret = CliReuse(self).run()
+            elif self.args.cmd == "snapshot":
+                ret = CliSnapshot(self).run()
+            elif self.args.cmd == "flatten":
+                ret = CliFlatten(self).run()
+            elif self.args.cmd == "enumerate-cache":
+                ret = CliEnumerateCache(self).run()
+            else:
+                raise RuntimeError("Command mismatch")
+        finally:
+            self._write_metrics()
 
         return ret
@@ -0,0 +1,103 @@
+"""rpmrepo - Delta Snapshots
+
+This module implements delta snapshots. A delta snapshot only stores the refs
+of paths that were added or changed since its base snapshot, plus a tombstone
+ref for every path that was removed since. All other paths are resolved
+through the base snapshot, which can be a delta snapshot itself.
+
+The base of a delta snapshot is recorded in `data/delta/<snapshot>.json`,
+along with the depth of the chain of deltas down to the first full snapshot.
+Tombstones are empty refs with the `rpmrepo-removed` metadata property rather
+than a checksum. The manifest of a delta snapshot still lists every file of
+the snapshot, so it can be flattened into a full snapshot at any time.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import json
+
+import botocore.exceptions
+
+
+# The gateway follows at most this many deltas to resolve a path, so deeper
+# chains are never published. This must not exceed the limit of the gateway.
+MAX_DEPTH = 8
+
+# Checksum recorded in plans and the push journal for tombstones.
+REMOVED = "removed"
+
+
+def key_s3(snapshot):
+    """Return the S3 key of the delta record of a snapshot
+
+    Parameters
+    ----------
+    snapshot
+        Snapshot name, i.e., the snapshot ID with its suffix.
+    """
+
+    return f"data/delta/{snapshot}.json"
+
+
+def load_s3(s3c, snapshot):
+    """Load the delta record of a snapshot
+
+    Return the delta record of a snapshot as dictionary with the keys `base`
+    (the name of its base snapshot) and `depth` (the number of deltas down to
+    the first full snapshot), or `None` if it is a full snapshot.
+
+    Parameters
+    ----------
+    s3c
+        S3 client to use.
+    snapshot
+        Snapshot name, i.e., the snapshot ID with its suffix.
+    """
+
+    try:
+        reply = s3c.get_object(Bucket="rpmrepo-storage", Key=key_s3(snapshot))
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+            return None
+        raise
+
+    return json.loads(reply["Body"].read())
+
+
+def store_s3(s3c, snapshot, base, depth):
+    """Store the delta record of a snapshot
+
+    Parameters
+    ----------
+    s3c
+        S3 client to use.
+    snapshot
+        Snapshot name, i.e., the snapshot ID with its suffix.
+    base
+        Name of the base snapshot.
+    depth
+        Number of deltas down to the first full snapshot, including this one.
+    """
+
+    s3c.put_object(
+        Body=json.dumps({"base": base, "depth": depth}, sort_keys=True).encode(),
+        Bucket="rpmrepo-storage",
+        Key=key_s3(snapshot),
+    )
+
+
+def delete_s3(s3c, snapshot):
+    """Delete the delta record of a snapshot
+
+    This turns the snapshot into a full snapshot, so all its refs must be in
+    place. Deleting the record of a full snapshot has no effect.
+
+    Parameters
+    ----------
+    s3c
+        S3 client to use.
+    snapshot
+        Snapshot name, i.e., the snapshot ID with its suffix.
+    """
+
+    s3c.delete_object(Bucket="rpmrepo-storage", Key=key_s3(snapshot))
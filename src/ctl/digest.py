@@ -0,0 +1,142 @@
+"""rpmrepo - File Digests
+
+This module implements the file-digest engine used to index repositories. It
+reads files sequentially into a reused per-thread buffer and feeds it to the
+hash functions without intermediate copies. Since indexing touches every byte
+of a repository exactly once, the engine advises the kernel to read ahead and
+to drop the file from the page-cache once it was hashed, so indexing does not
+evict data other operations still need.
+
+Apart from the checksum that identifies a file, the engine also calculates the
+digests of each part of a multipart upload in the same pass, so uploads do not
+need to read a file once more just to checksum it.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import base64
+import hashlib
+import io
+import os
+import threading
+
+
+BUFFER_SIZE = 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+
+_local = threading.local()
+
+
+def _buffer():
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        buffer = memoryview(bytearray(BUFFER_SIZE))
+        _local.buffer = buffer
+    return buffer
+
+
+def _fadvise(fd, advice):
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, advice)
+
+
+class Digest:
+    """Incremental file digest
+
+    Calculate the digests of a file from its content, fed in consecutive
+    blocks of any size via `update()`. Once all content was fed, `finish()`
+    returns the same result as `digest_path()`, so files can be hashed while
+    they are written rather than read back afterwards.
+    """
+
+    def __init__(self, part_size=None):
+        self._hashproc = hashlib.sha256()
+        self._part_size = part_size
+        self._parts = None if part_size is None else []
+        self._part = hashlib.sha256()
+        self._n_part = 0
+
+    def update(self, data):
+        """Feed the next block of the file"""
+
+        self._hashproc.update(data)
+
+        i = 0
+        n = len(data)
+        while self._parts is not None and i < n:
+            k = min(n - i, self._part_size - self._n_part)
+            self._part.update(data[i:i + k])
+            self._n_part += k
+            i += k
+            if self._n_part == self._part_size:
+                self._parts.append(base64.b64encode(self._part.digest()).decode())
+                self._part = hashlib.sha256()
+                self._n_part = 0
+
+    def finish(self):
+        """Return the checksum and part digests of the file"""
+
+        if self._n_part > 0:
+            self._parts.append(base64.b64encode(self._part.digest()).decode())
+            self._n_part = 0
+
+        return "sha256-" + self._hashproc.hexdigest(), self._parts
+
+
+def digest_path(path, part_size=None, drop_cache=True):
+    """Calculate all digests of a file
+
+    Read the file at `path` once and return a tuple of its sha256 checksum
+    in the form `sha256-<hex>`, and a list of the base64 encoded sha256
+    digests of each consecutive part of `part_size` bytes. These part
+    digests match what S3 expects for a multipart upload with the same part
+    size. If `part_size` is `None`, no part digests are calculated and `None`
+    is returned in their place.
+
+    Parameters
+    ----------
+    path
+        Path to the file to hash.
+    part_size
+        Size of each part in bytes, or `None`.
+    drop_cache
+        Whether to drop the file from the page-cache once it was read.
+    """
+
+    digest = Digest(part_size)
+    buffer = _buffer()
+
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        if hasattr(os, "POSIX_FADV_SEQUENTIAL"):
+            _fadvise(fd, os.POSIX_FADV_SEQUENTIAL)
+
+        with io.FileIO(fd, "rb", closefd=False) as filp:
+            n = filp.readinto(buffer)
+            while n:
+                digest.update(buffer[:n])
+                n = filp.readinto(buffer)
+
+        if drop_cache and hasattr(os, "POSIX_FADV_DONTNEED"):
+            _fadvise(fd, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+    return digest.finish()
+
+
+def checksum_path(path, drop_cache=True):
+    """Calculate the checksum of a file
+
+    Read the file at `path` and return its sha256 checksum in the form
+    `sha256-<hex>`.
+
+    Parameters
+    ----------
+    path
+        Path to the file to hash.
+    drop_cache
+        Whether to drop the file from the page-cache once it was read.
+    """
+
+    return digest_path(path, drop_cache=drop_cache)[0]
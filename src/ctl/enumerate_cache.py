@@ -12,11 +12,14 @@ import json
 
 import boto3
 
+from . import metrics as ctl_metrics
+
+
 class EnumerateCache(contextlib.AbstractContextManager):
     """Create a cache of all the thread indices"""
 
-    def __init__(self):
-        pass
+    def __init__(self, metrics=None):
+        self._metrics = metrics or ctl_metrics.Metrics("enumerate-cache")
 
     def __exit__(self, exc_type, exc_value, exc_tb):
         pass
@@ -26,20 +29,22 @@ class EnumerateCache(contextlib.AbstractContextManager):
 
         s3c = boto3.client("s3")
 
-        results = []
-        paginator = s3c.get_paginator("list_objects_v2")
-        pages = paginator.paginate(
-            Bucket="rpmrepo-storage",
-            Prefix="data/thread/",
-            PaginationConfig={'PageSize': 16384},
-        )
-        for page in pages:
-            for entry in page.get("Contents", []):
-                # get everything past the last slash
-                key = entry.get("Key").rsplit("/", 1)[1]
-                if len(key) > 0:
-                    results.append(key)
-        results.sort()
+        with self._metrics.phase("list") as phase:
+            results = []
+            paginator = s3c.get_paginator("list_objects_v2")
+            pages = paginator.paginate(
+                Bucket="rpmrepo-storage",
+                Prefix="data/thread/",
+                PaginationConfig={'PageSize': 16384},
+            )
+            for page in pages:
+                for entry in page.get("Contents", []):
+                    # get everything past the last slash
+                    key = entry.get("Key").rsplit("/", 1)[1]
+                    if len(key) > 0:
+                        results.append(key)
+            phase.add(files=len(results))
+            results.sort()
 
         s3c.put_object(
             Bucket="rpmrepo-storage",
@@ -0,0 +1,101 @@
+"""rpmrepo - Repository Fingerprints
+
+This module implements repository fingerprints. A fingerprint identifies the
+upstream state of a repository by the checksum and revision of its
+`repomd.xml`, which changes whenever any file of the repository changes.
+
+Whenever a snapshot is pushed, the fingerprint of its repository is stored in
+remote storage as the fingerprint of its snapshot ID, alongside the name of
+the snapshot. A later run can fetch just `repomd.xml` and compare it against
+this record to tell whether the repository changed at all since the last
+snapshot of the same ID.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import hashlib
+import io
+import json
+
+import botocore.exceptions
+
+from . import repodata
+
+
+def key_s3(snapshot_id):
+    """Return the S3 key of the fingerprint of a snapshot ID
+
+    Parameters
+    ----------
+    snapshot_id
+        Snapshot ID, i.e., the snapshot name without its suffix.
+    """
+
+    return f"data/fingerprint/{snapshot_id}.json"
+
+
+def compute(content):
+    """Compute the fingerprint of a repository
+
+    Return the fingerprint of a repository as a dictionary with the keys
+    `repomd` (the checksum of `repomd.xml` in the form `sha256-<hex>`) and
+    `revision` (the revision it declares, or `None`).
+
+    Parameters
+    ----------
+    content
+        Content of the `repomd.xml` file of the repository.
+    """
+
+    revision, _ = repodata.parse_repomd(io.BytesIO(content))
+    return {"repomd": "sha256-" + hashlib.sha256(content).hexdigest(), "revision": revision}
+
+
+def load_s3(s3c, snapshot_id):
+    """Load the fingerprint of the last snapshot of a snapshot ID
+
+    Return the stored fingerprint with the additional key `snapshot`, the
+    name of the snapshot it was recorded for, or `None` if no fingerprint was
+    recorded for this snapshot ID.
+
+    Parameters
+    ----------
+    s3c
+        S3 client to use.
+    snapshot_id
+        Snapshot ID to look up.
+    """
+
+    try:
+        reply = s3c.get_object(Bucket="rpmrepo-storage", Key=key_s3(snapshot_id))
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+            return None
+        raise
+
+    return json.loads(reply["Body"].read())
+
+
+def store_s3(s3c, snapshot_id, snapshot, fingerprint):
+    """Store the fingerprint of a snapshot
+
+    Record `fingerprint` as the fingerprint of the last snapshot of
+    `snapshot_id`, which is named `snapshot`.
+
+    Parameters
+    ----------
+    s3c
+        S3 client to use.
+    snapshot_id
+        Snapshot ID of the snapshot.
+    snapshot
+        Snapshot name, i.e., the snapshot ID with its suffix.
+    fingerprint
+        Fingerprint as returned by `compute()`.
+    """
+
+    s3c.put_object(
+        Body=json.dumps(dict(fingerprint, snapshot=snapshot), sort_keys=True).encode(),
+        Bucket="rpmrepo-storage",
+        Key=key_s3(snapshot_id),
+    )
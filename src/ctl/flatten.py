@@ -0,0 +1,125 @@
+"""rpmrepo - Flatten Delta Snapshots
+
+This module turns delta snapshots into full snapshots. Every path a delta
+snapshot resolves through its base gets its own ref, as listed by the
+manifest of the snapshot, before the delta record is dropped and the
+tombstones are deleted. Hence, the snapshot resolves to the same files at any
+time, and no longer depends on its base once flattened.
+
+Delta snapshots based on a flattened snapshot stay valid, but resolve with
+fewer requests. Flattening old deltas periodically keeps the chains the
+gateway has to follow short.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import contextlib
+
+import boto3
+import botocore.config
+
+from . import delta, manifest, util
+from . import metrics as ctl_metrics
+
+
+JOBS = 16
+
+
+class Flatten(contextlib.AbstractContextManager):
+    """Flatten delta snapshots"""
+
+    def __init__(self, *, jobs=None, metrics=None):
+        self._jobs = jobs or JOBS
+        self._metrics = metrics or ctl_metrics.Metrics("flatten")
+        self._s3c = boto3.client(
+            "s3",
+            config=botocore.config.Config(max_pool_connections=max(self._jobs, 10)),
+        )
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        pass
+
+    def _list(self, prefix):
+        paginator = self._s3c.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket="rpmrepo-storage",
+            Prefix=prefix,
+            PaginationConfig={'PageSize': 1000},
+        )
+        for page in pages:
+            for entry in page.get("Contents", []):
+                yield entry["Key"][len(prefix):]
+
+    def find(self, min_depth=1):
+        """Find delta snapshots
+
+        Return the names of all delta snapshots with a delta depth of at
+        least `min_depth`, sorted by name.
+
+        Parameters
+        ----------
+        min_depth
+            Minimum delta depth of the snapshots to return.
+        """
+
+        snapshots = []
+        for name in self._list("data/delta/"):
+            if not name.endswith(".json"):
+                continue
+            snapshot = name[:-len(".json")]
+            record = delta.load_s3(self._s3c, snapshot)
+            if record is not None and record["depth"] >= min_depth:
+                snapshots.append(snapshot)
+        return sorted(snapshots)
+
+    def _flatten(self, snapshot, phase):
+        record = delta.load_s3(self._s3c, snapshot)
+        if record is None:
+            print(f"Snapshot '{snapshot}' is a full snapshot already")
+            return
+
+        print(f"Flatten snapshot '{snapshot}' (delta of '{record['base']}', depth {record['depth']})")
+
+        prefix = f"data/ref/{snapshot}/"
+        overlay = set(self._list(prefix))
+        with manifest.open_s3(self._s3c, snapshot) as reader:
+            entries = list(reader)
+        inherited = [v for v in entries if v["path"] not in overlay]
+        tombstones = sorted(overlay - {v["path"] for v in entries})
+
+        def _put(entry):
+            self._s3c.put_object(
+                Body=b"",
+                Bucket="rpmrepo-storage",
+                Key=prefix + entry["path"],
+                Metadata={"rpmrepo-checksum": entry["checksum"]},
+            )
+
+        n_total = len(inherited)
+        for i_total, (entry, _) in enumerate(util.map_ordered(_put, inherited, self._jobs), start=1):
+            print(f"[{i_total}/{n_total}] '{snapshot}/{entry['path']}' -> {entry['checksum']}")
+            phase.add(files=1)
+
+        # All refs are in place, so the snapshot resolves identically without
+        # its base. Only then drop the record and the tombstones it needed.
+        delta.delete_s3(self._s3c, snapshot)
+        for i in range(0, len(tombstones), 1000):
+            self._s3c.delete_objects(
+                Bucket="rpmrepo-storage",
+                Delete={"Objects": [{"Key": prefix + v} for v in tombstones[i:i + 1000]], "Quiet": True},
+            )
+
+        print(f"Flattened '{snapshot}': {n_total} refs added, {len(tombstones)} tombstones removed")
+
+    def flatten(self, snapshots):
+        """Flatten delta snapshots
+
+        Parameters
+        ----------
+        snapshots
+            Names of the snapshots to flatten. Full snapshots are skipped.
+        """
+
+        with self._metrics.phase("flatten") as phase:
+            for snapshot in snapshots:
+                self._flatten(snapshot, phase)
@@ -6,35 +6,280 @@ a content-addressable storage alongside a symlink collection.
 
 # pylint: disable=duplicate-code,invalid-name,too-few-public-methods
 
+import concurrent.futures
 import contextlib
 import errno
-import hashlib
+import glob
+import itertools
 import os
-import shutil
+import sys
+import time
 
-from . import util
+from . import digest, manifest, repodata, util
+from . import metrics as ctl_metrics
 
 
+# pylint: disable=too-many-instance-attributes
 class Index(contextlib.AbstractContextManager):
-    """Create RPM repository Index"""
+    """Create RPM repository Index
 
-    def __init__(self, cache):
+    If `store` and `platform_id` are given, all data is shared via the
+    content store of the platform at the store root `store`.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, cache, *, jobs=None, trust_metadata=False, store=None, platform_id=None, metrics=None):
         self._cache = cache
+        self._jobs = jobs or os.cpu_count() or 1
+        self._metrics = metrics or ctl_metrics.Metrics("index")
+        self._trust_metadata = trust_metadata
+        self._path_store = None
+        if store is not None and platform_id is not None:
+            self._path_store = os.path.join(store, platform_id, "data")
+        self._path_checksums = os.path.join(cache, "conf/checksums.json")
         self._path_conf = os.path.join(cache, "conf")
         self._path_data = os.path.join(cache, "index/data")
+        self._path_digests = os.path.join(cache, "index/digests.json")
         self._path_index = os.path.join(cache, "index")
+        self._path_manifest = os.path.join(cache, "index/manifest.jsonl.gz")
         self._path_repo = os.path.join(cache, "repo")
         self._path_snapshot = os.path.join(cache, "index/snapshot")
+        self._path_stored = os.path.join(cache, "conf/stored.json")
 
     def __exit__(self, exc_type, exc_value, exc_tb):
         pass
 
-    @staticmethod
-    def _checksum(filp):
-        hashproc = hashlib.sha256()
-        for block in iter(lambda ctx=filp: ctx.read(4096), b''):
-            hashproc.update(block)
-        return "sha256-" + hashproc.hexdigest()
+    def _load_trusted(self):
+        # Collect the sha256 checksums of all packages declared in the primary
+        # metadata of the repository. Only those entries can be trusted,
+        # since they were verified by the tool that pulled the repository.
+        path = os.path.join(self._path_repo, "repodata/repomd.xml")
+        if not os.path.exists(path):
+            raise RuntimeError(f"Cannot trust metadata of '{self._path_repo}', it has no 'repodata/repomd.xml'")
+        with open(path, "rb") as filp:
+            _, entries = repodata.parse_repomd(filp)
+
+        trusted = {}
+        for entry in entries:
+            if entry["type"] != "primary":
+                continue
+
+            try:
+                filp = repodata.open_compressed(os.path.join(self._path_repo, entry["href"]))
+            except ImportError as e:
+                print(f"Cannot read '{entry['href']}', ignoring metadata: {e}", file=sys.stderr)
+                return {}
+
+            with filp:
+                for package in repodata.iter_packages(filp):
+                    if package["checksum"].startswith("sha256-"):
+                        trusted[os.path.normpath(package["href"])] = (package["checksum"], package["size"])
+
+        return trusted
+
+    def _schedule(self, executor, files, checksums, cached, trusted):
+        # Resolve the checksums of all files that are known either from the
+        # checksum cache or the trusted metadata, and submit all other files
+        # for hashing.
+        # Files are submitted in inode order, which roughly follows their
+        # placement on disk.
+        pending = {}
+        for level, levelpath, entry, key, st in files:
+            declared = trusted.get(os.path.normpath(os.path.join(levelpath, entry)))
+            if key in cached:
+                checksums[key] = cached[key]
+            elif declared is not None and declared[1] == st.st_size:
+                checksums[key] = declared[0]
+            elif key not in pending:
+                pending[key] = (os.path.join(level, entry), st)
+
+        # Files that exceed a single upload part get their part digests
+        # calculated in the same pass.
+        futures = {}
+        for key, (path, st) in sorted(pending.items(), key=lambda v: v[1][1].st_ino):
+            part_size = digest.PART_SIZE if st.st_size > digest.PART_SIZE else None
+            futures[key] = executor.submit(digest.digest_path, path, part_size)
+        return futures
+
+    def _write_entry(self, relpath, checksum):
+        with open(os.path.join(self._path_snapshot, relpath), "ab+") as filp:
+            filp.seek(0)
+            if filp.read() != checksum.encode():
+                filp.truncate(0)
+                filp.write(checksum.encode())
+
+    def _link_store(self, path, checksum):
+        # Deduplicate a file with the shared content store. If the store has
+        # no entry for this checksum, the file becomes the entry. Otherwise,
+        # the file is replaced with a link to the existing entry, and its new
+        # status is returned.
+        entry = os.path.join(self._path_store, checksum)
+
+        try:
+            os.link(path, entry, follow_symlinks=False)
+            return None
+        except FileExistsError:
+            if os.path.samefile(path, entry):
+                return None
+
+        tmp = path + ".rpmrepo-store"
+        with util.suppress_oserror(errno.ENOENT):
+            os.unlink(tmp)
+        os.link(entry, tmp, follow_symlinks=False)
+        os.replace(tmp, path)
+
+        return os.stat(path)
+
+    def _prune_store(self):
+        # Drop all entries of the content store that no manifest of any
+        # local cache references anymore, along with their records in the
+        # lists of pushed checksums. Local caches live next to each other,
+        # so this cache is one of them. Entries linked into the store by a
+        # concurrent index are merely linked again by its next run.
+        # The lists are only rewritten if no push holds them open to append
+        # to, since appended records would be lost otherwise. Stale records
+        # are harmless, they are merely pruned by a later run.
+        referenced = set()
+        for path in glob.glob(os.path.join(os.path.dirname(self._cache), "*", "index", "manifest.jsonl.gz")):
+            with util.suppress_oserror(errno.ENOENT), manifest.Reader(path) as reader:
+                referenced.update(v["checksum"] for v in reader)
+
+        n_pruned = 0
+        for entry in os.listdir(self._path_store):
+            if entry not in referenced:
+                with util.suppress_oserror(errno.ENOENT):
+                    os.unlink(os.path.join(self._path_store, entry))
+                n_pruned += 1
+
+        path_lock = os.path.join(os.path.dirname(self._path_store), "pushed.lock")
+        with util.lock_file(path_lock, exclusive=True, blocking=False) as locked:
+            if not locked:
+                print("Content store in use by a push, not pruning its records", file=sys.stderr)
+                return n_pruned
+
+            for path in glob.glob(os.path.join(os.path.dirname(self._path_store), "pushed-*")):
+                with open(path, "r", encoding="utf-8") as filp:
+                    pushed = [v.strip() for v in filp]
+                retained = sorted({v for v in pushed if v in referenced})
+                if len(retained) < len(pushed):
+                    with util.open_tmpfile(os.path.dirname(path), mode=0o644) as ctx:
+                        ctx["stream"].write("".join(v + "\n" for v in retained).encode())
+                        ctx["name"] = os.path.basename(path)
+                        ctx["replace"] = True
+
+        return n_pruned
+
+    def _update_data(self, path, checksum, known, replaced):
+        # A data entry of a previous index is only retained if it is still
+        # known to carry this checksum, and the file was not replaced by an
+        # entry of the content store. Otherwise, it is replaced with the
+        # current file.
+        with util.suppress_oserror(errno.ENOENT):
+            key_data = util.checksum_key(os.lstat(os.path.join(self._path_data, checksum)))
+            if replaced is not None or checksum not in (known[0].get(key_data), known[1].get(key_data)):
+                os.unlink(os.path.join(self._path_data, checksum))
+
+        with util.suppress_oserror(errno.EEXIST):
+            os.link(
+                path,
+                os.path.join(self._path_data, checksum),
+                follow_symlinks=False,
+            )
+
+    def _prune_snapshot(self, dirs, files):
+        for level, subdirs, entries in os.walk(self._path_snapshot, topdown=False):
+            levelpath = os.path.relpath(level, self._path_snapshot)
+
+            for entry in entries:
+                if os.path.normpath(os.path.join(levelpath, entry)) not in files:
+                    os.unlink(os.path.join(level, entry))
+
+            for entry in subdirs:
+                if os.path.normpath(os.path.join(levelpath, entry)) not in dirs:
+                    os.rmdir(os.path.join(level, entry))
+
+    def _scan(self, stored):
+        # Collect all files of the repository in walk-order, and bring the
+        # directory structure of the snapshot in sync with the repository.
+        # Packages that were not pulled, since they are stored remotely, are
+        # part of the snapshot even though they are not part of the
+        # repository.
+        dirs = []
+        files = []
+        for level, subdirs, entries in os.walk(self._path_repo):
+            levelpath = os.path.relpath(level, self._path_repo)
+
+            for entry in subdirs:
+                dirs.append(os.path.normpath(os.path.join(levelpath, entry)))
+
+            for entry in entries:
+                st = os.stat(os.path.join(level, entry))
+                files.append((level, levelpath, entry, util.checksum_key(st), st))
+
+        for entry in stored:
+            level = os.path.dirname(entry)
+            while level:
+                dirs.append(level)
+                level = os.path.dirname(level)
+
+        self._prune_snapshot(
+            set(dirs),
+            {os.path.normpath(os.path.join(v[1], v[2])) for v in files} | set(stored),
+        )
+
+        for entry in dirs:
+            os.makedirs(os.path.join(self._path_snapshot, entry), exist_ok=True)
+
+        for entry, info in stored.items():
+            self._write_entry(entry, info["checksum"])
+
+        return files
+
+    def _load_stored(self):
+        # Packages that were skipped by the pull. Anything that exists in the
+        # repository anyway is indexed from the repository instead.
+        stored = util.load_json(self._path_stored).get("files", {})
+        return {
+            k: v for k, v in stored.items()
+            if not os.path.lexists(os.path.join(self._path_repo, k))
+        }
+
+    def _hash(self, files, phase):
+        cached = util.load_json(self._path_checksums)
+        digests = util.load_json(self._path_digests)
+        trusted = self._load_trusted() if self._trust_metadata else {}
+        checksums = {}
+        t_start = time.monotonic()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            futures = self._schedule(executor, files, checksums, cached, trusted)
+
+            for level, levelpath, entry, key, st in files:
+                if key not in checksums:
+                    checksums[key], parts = futures[key].result()
+                    if parts is not None:
+                        digests[checksums[key]] = {"part-size": digest.PART_SIZE, "parts": parts}
+                    phase.add(files=1, n_bytes=st.st_size)
+                checksum = checksums[key]
+
+                self._write_entry(os.path.join(levelpath, entry), checksum)
+
+                replaced = None
+                if self._path_store is not None:
+                    replaced = self._link_store(os.path.join(level, entry), checksum)
+                    if replaced is not None:
+                        checksums[util.checksum_key(replaced)] = checksum
+
+                self._update_data(os.path.join(level, entry), checksum, (checksums, cached), replaced)
+
+        t_total = max(time.monotonic() - t_start, 1e-6)
+        print(
+            f"Indexed {len(files)} files, hashed {phase.files} ({phase.bytes / 2**20:.1f} MiB) "
+            f"in {t_total:.1f}s with {self._jobs} jobs: {phase.bytes / 2**20 / t_total:.1f} MB/s",
+            file=sys.stdout,
+        )
+
+        return checksums, digests
 
     def index(self):
         """Create index of the RPM repository files"""
@@ -47,19 +292,23 @@ class Index(contextlib.AbstractContextManager):
         assert os.access(os.path.join(self._path_conf, "repo.ok"), os.R_OK)
 
         #
-        # Delete a possible previous index and prepare the scaffolding of the
-        # index directory.
+        # Invalidate a possible previous index and prepare the scaffolding of
+        # the index directory. A previous index is retained and updated in
+        # place, since the cache directory might be reused across pulls.
         #
 
         with util.suppress_oserror(errno.ENOENT):
             os.unlink(os.path.join(self._path_conf, "index.ok"))
 
-        if os.path.isdir(self._path_index):
-            shutil.rmtree(self._path_index)
+        os.makedirs(self._path_data, exist_ok=True)
+        os.makedirs(self._path_snapshot, exist_ok=True)
+        if self._path_store is not None:
+            os.makedirs(self._path_store, exist_ok=True)
 
-        os.mkdir(self._path_index)
-        os.mkdir(self._path_data)
-        os.mkdir(self._path_snapshot)
+        with self._metrics.phase("scan") as phase:
+            stored = self._load_stored()
+            files = self._scan(stored)
+            phase.add(files=len(files), n_bytes=sum(v[4].st_size for v in files))
 
         #
         # Create a content-addressed data directory with all files hardlinked
@@ -68,27 +317,68 @@ class Index(contextlib.AbstractContextManager):
         # Additionally, create a second snapshot directly that mirrors the
         # repository directory structure but only stores the checksum of each
         # file rather than its contents.
+        # Files are looked up in the persistent checksum cache via their
+        # device, inode, size and modification time, and only files without a
+        # match are hashed. The native pull records every file it downloads in
+        # this cache, so for pulled repositories this is metadata-only.
+        # Files are hashed concurrently by a worker pool, but the results are
+        # consumed in walk-order, so the produced index is identical to a
+        # serial run.
+        # If the repository metadata is trusted, package checksums are taken
+        # from the primary metadata rather than hashing the packages.
+        # If a shared content store is used, all files are deduplicated with
+        # it, so multiple local caches of the same platform share their data.
         #
 
-        for level, subdirs, entries in os.walk(self._path_repo):
-            levelpath = os.path.relpath(level, self._path_repo)
+        with self._metrics.phase("hash") as phase:
+            checksums, digests = self._hash(files, phase)
 
-            for entry in subdirs:
-                os.mkdir(os.path.join(self._path_snapshot, levelpath, entry))
+        #
+        # Drop all data entries that are no longer part of the repository, and
+        # remember all checksums and upload digests for the next run.
+        # Then write the manifest of the snapshot. It lists the same
+        # information as the snapshot directory, but as a single compact file
+        # that can be consumed without walking the snapshot directory.
+        # Packages stored remotely have no data entry, but are listed in the
+        # snapshot and manifest like any other file.
+        #
 
-            for entry in entries:
-                with open(os.path.join(level, entry), "rb") as filp:
-                    checksum = self._checksum(filp)
-
-                with open(os.path.join(self._path_snapshot, levelpath, entry), "wb") as filp:
-                    filp.write(checksum.encode())
-
-                with util.suppress_oserror(errno.EEXIST):
-                    os.link(
-                        os.path.join(level, entry),
-                        os.path.join(self._path_data, checksum),
-                        follow_symlinks=False,
-                    )
+        with self._metrics.phase("manifest") as phase:
+            valid = set(checksums.values())
+            for entry in os.listdir(self._path_data):
+                if entry not in valid:
+                    os.unlink(os.path.join(self._path_data, entry))
+
+            util.store_json(self._path_checksums, checksums)
+            util.store_json(self._path_digests, {k: v for k, v in digests.items() if k in valid})
+
+            manifest.write(
+                self._path_manifest,
+                itertools.chain(
+                    (
+                        {
+                            "path": os.path.normpath(os.path.join(levelpath, entry)),
+                            "size": st.st_size,
+                            "checksum": checksums[key],
+                        }
+                        for _, levelpath, entry, key, st in files
+                    ),
+                    (
+                        {"path": k, "size": v["size"], "checksum": v["checksum"]}
+                        for k, v in stored.items()
+                    ),
+                ),
+            )
+            phase.add(files=len(files) + len(stored))
+
+        #
+        # Once the manifest is in place, prune the content store, so it only
+        # retains data some local cache still references.
+        #
+
+        if self._path_store is not None:
+            with self._metrics.phase("prune") as phase:
+                phase.add(files=self._prune_store())
 
         with open(os.path.join(self._path_conf, "index.ok"), "wb"):
             pass
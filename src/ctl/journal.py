@@ -0,0 +1,180 @@
+"""rpmrepo - Push Journal
+
+This module implements the push journal, which records all objects that were
+confirmed uploaded to remote storage, so an interrupted push can be resumed
+without uploading everything again.
+
+The journal is a directory of segments. Each segment is a JSON Lines file with
+one object per line, and is written atomically once a checkpoint is reached.
+Segments are never modified once written, so a crash can at most lose the
+entries recorded since the last checkpoint. Once enough segments piled up, a
+checkpoint compacts them into a single segment.
+
+The journal only serves to resume a push, so it is scoped to a single run.
+Entries are keyed by the object key, which names the storage and platform of
+data, and the snapshot of refs. The run identifier, usually the name of the
+snapshot that is pushed, is recorded along with the segments, and a journal
+opened for another run starts out empty. Journals are only modified once an
+entry is recorded, which is when the segments of other runs are dropped, so
+merely planning a push never discards the journal of an interrupted one.
+Entries older than `MAX_AGE` are dropped as well, so objects deleted from
+remote storage since are not taken for pushed forever.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import contextlib
+import errno
+import json
+import os
+import time
+
+from . import util
+
+
+CHECKPOINT_ENTRIES = 1024
+CHECKPOINT_SECONDS = 10
+COMPACT_SEGMENTS = 16
+MAX_AGE = 7 * 24 * 60 * 60
+
+
+# pylint: disable=too-many-instance-attributes
+class Journal(contextlib.AbstractContextManager):
+    """Push journal
+
+    Open the journal at the given directory for the run `run`, and load all
+    its segments, unless they were written by another run or `reset` is set.
+    Journals opened without run use the segments of whatever run wrote them.
+    Record uploaded objects via `add()`, and check for them via `contains()`.
+    Pending entries are written as new segment once enough entries were
+    recorded or enough time passed, and when the journal is closed.
+
+    Opening a journal never modifies it. The segments of other runs, or all
+    segments if `reset` is set, are only dropped by `start()`, which the
+    first `add()` calls implicitly.
+    """
+
+    def __init__(self, path, *, run=None, reset=False):
+        self._path = path
+        self._path_run = os.path.join(path, "run.json")
+        self._entries = {}
+        self._pending = []
+        self._reset = reset
+        self._run = run
+        self._segments = []
+        self._started = False
+        self._t_checkpoint = time.monotonic()
+
+        if self._foreign():
+            return
+
+        segments = []
+        with util.suppress_oserror(errno.ENOENT):
+            segments = sorted(v for v in os.listdir(self._path) if v.endswith(".jsonl"))
+
+        t_min = time.time() - MAX_AGE
+        for entry in segments:
+            self._segments.append(entry)
+            with open(os.path.join(self._path, entry), "r", encoding="utf-8") as filp:
+                for line in filp:
+                    record = json.loads(line)
+                    if record.get("time", 0) >= t_min:
+                        self._entries[record["key"]] = (record["size"], record["checksum"], record["time"])
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.checkpoint()
+
+    def _foreign(self):
+        # Whether the segments on disk are not ours to use.
+        if self._reset:
+            return True
+        return self._run is not None and util.load_json(self._path_run).get("run") != self._run
+
+    def start(self):
+        """Start recording entries
+
+        Drop all segments of other runs, or all segments if `reset` is set,
+        and record the run of the journal. Only the first call has any
+        effect.
+        """
+
+        if self._started:
+            return
+        self._started = True
+
+        os.makedirs(self._path, exist_ok=True)
+        if not self._foreign():
+            return
+
+        for entry in os.listdir(self._path):
+            if entry.endswith(".jsonl"):
+                with util.suppress_oserror(errno.ENOENT):
+                    os.unlink(os.path.join(self._path, entry))
+        util.store_json(self._path_run, {"run": self._run})
+        self._segments = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def contains(self, key, size, checksum):
+        """Check whether an object was uploaded
+
+        Return whether the object with the given key was recorded with the
+        same size and checksum.
+        """
+
+        return self._entries.get(key, (None, None))[:2] == (size, checksum)
+
+    def add(self, key, size, checksum):
+        """Record an uploaded object"""
+
+        self.start()
+
+        t = time.time()
+        self._entries[key] = (size, checksum, t)
+        self._pending.append({"key": key, "size": size, "checksum": checksum, "time": t})
+
+        if (
+                len(self._pending) >= CHECKPOINT_ENTRIES
+                or time.monotonic() - self._t_checkpoint >= CHECKPOINT_SECONDS
+        ):
+            self.checkpoint()
+
+    def _write(self, records):
+        # Write a new segment after all existing ones, so it takes
+        # precedence when the journal is loaded.
+        index = int(self._segments[-1][:-len(".jsonl")]) + 1 if self._segments else 0
+        with util.open_tmpfile(self._path, mode=0o644) as ctx:
+            for record in records:
+                ctx["stream"].write(json.dumps(record).encode() + b"\n")
+            ctx["name"] = f"{index:08d}.jsonl"
+        self._segments.append(f"{index:08d}.jsonl")
+
+    def checkpoint(self):
+        """Write all pending entries as new segment
+
+        Once `COMPACT_SEGMENTS` segments were written, all current entries
+        are written as a single segment instead, which replaces all others.
+        """
+
+        self._t_checkpoint = time.monotonic()
+        if not self._pending:
+            return
+
+        if len(self._segments) + 1 < COMPACT_SEGMENTS:
+            self._write(self._pending)
+            self._pending = []
+            return
+
+        # The compacted segment is complete before any segment it replaces
+        # is dropped, so a crash in between only leaves duplicates behind.
+        replaced = list(self._segments)
+        self._write(
+            {"key": key, "size": size, "checksum": checksum, "time": t}
+            for key, (size, checksum, t) in self._entries.items()
+        )
+        self._segments = self._segments[-1:]
+        for entry in replaced:
+            with util.suppress_oserror(errno.ENOENT):
+                os.unlink(os.path.join(self._path, entry))
+        self._pending = []
@@ -0,0 +1,133 @@
+"""rpmrepo - Snapshot Manifest
+
+This module implements the snapshot manifest, a single compact file that
+lists every file of a repository snapshot with its size and checksum. The
+manifest uses JSON Lines: a header line followed by one line per file, sorted
+by path. If the file-name ends in `.gz`, the manifest is gzip compressed.
+
+The manifest of each pushed snapshot is also stored in remote storage, so a
+whole snapshot can be resolved with a single request.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import contextlib
+import gzip
+import json
+import os
+
+from . import util
+
+
+VERSION = 1
+
+
+def key_s3(snapshot):
+    """Return the S3 key of the manifest of a snapshot
+
+    Parameters
+    ----------
+    snapshot
+        Snapshot name, i.e., the snapshot ID with its suffix.
+    """
+
+    return f"data/manifest/{snapshot}.jsonl.gz"
+
+
+def open_s3(s3c, snapshot):
+    """Open the manifest of a snapshot in S3
+
+    Fetch the manifest of the given snapshot from S3 with a single request
+    and return a `Reader` that streams it.
+
+    Parameters
+    ----------
+    s3c
+        S3 client to use.
+    snapshot
+        Snapshot name, i.e., the snapshot ID with its suffix.
+    """
+
+    key = key_s3(snapshot)
+    reply = s3c.get_object(Bucket="rpmrepo-storage", Key=key)
+    return Reader(key, fileobj=reply["Body"])
+
+
+def write(path, entries):
+    """Write a manifest
+
+    Atomically write a manifest with the given entries to `path`. Each entry
+    must be a dictionary with the keys `path`, `size`, and `checksum`. The
+    entries are sorted by path before they are written.
+
+    Parameters
+    ----------
+    path
+        Path to write the manifest to.
+    entries
+        Iterable of manifest entries.
+    """
+
+    entries = sorted(entries, key=lambda v: v["path"])
+
+    with util.open_tmpfile(os.path.dirname(path), mode=0o644) as ctx:
+        if path.endswith(".gz"):
+            stream = gzip.GzipFile(fileobj=ctx["stream"], mode="wb", mtime=0)
+        else:
+            stream = contextlib.nullcontext(ctx["stream"])
+
+        with stream as filp:
+            header = {"rpmrepo-manifest": VERSION, "count": len(entries)}
+            filp.write(json.dumps(header).encode() + b"\n")
+            for entry in entries:
+                line = {"path": entry["path"], "size": entry["size"], "checksum": entry["checksum"]}
+                filp.write(json.dumps(line).encode() + b"\n")
+
+        ctx["name"] = os.path.basename(path)
+        ctx["replace"] = True
+
+
+class Reader(contextlib.AbstractContextManager):
+    """Read a manifest
+
+    Open the manifest at the given path and parse its header. The number of
+    entries is available as `count`. Iterating the reader streams all entries
+    as dictionaries with the keys `path`, `size`, and `checksum`, sorted by
+    path.
+
+    If `fileobj` is given, the manifest is read from this binary stream
+    rather than opened, and `path` is only used as its name. The stream is
+    closed with the reader.
+    """
+
+    def __init__(self, path, fileobj=None):
+        if fileobj is None:
+            fileobj = open(path, "rb") # pylint: disable=consider-using-with
+
+        self._stream = fileobj
+        if path.endswith(".gz"):
+            self._filp = gzip.GzipFile(fileobj=self._stream, mode="rb")
+        else:
+            self._filp = self._stream
+
+        try:
+            header = json.loads(self._filp.readline())
+            if header.get("rpmrepo-manifest") != VERSION:
+                raise ValueError(f"Unsupported manifest format in '{path}'")
+            self.count = header["count"]
+        except BaseException:
+            self.close()
+            raise
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the manifest"""
+
+        self._filp.close()
+        self._stream.close()
+
+    def __iter__(self):
+        for line in self._filp:
+            yield json.loads(line)
@@ -0,0 +1,166 @@
+"""rpmrepo - Runtime Metrics
+
+This module collects runtime metrics of `rpmrepoctl` commands. Each command
+records its work in named phases, which track wall-time, CPU-time, the number
+of files and bytes processed, retries, and the peak RSS of the process. The
+metrics can be serialized as JSON and as a Prometheus textfile.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+from . import util
+
+
+def _escape(value):
+    # Escape a label value as the Prometheus text format requires.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# pylint: disable=too-many-instance-attributes
+class Phase:
+    """Metrics of a single phase
+
+    Counters of a phase can be updated concurrently from multiple threads via
+    `add()`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.files = 0
+        self.bytes = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._t_wall = time.monotonic()
+        self._t_cpu = time.process_time()
+        self._wall = None
+        self._cpu = None
+        self._rss = None
+
+    def add(self, files=0, n_bytes=0, retries=0):
+        """Account processed files, bytes, and retries"""
+
+        with self._lock:
+            self.files += files
+            self.bytes += n_bytes
+            self.retries += retries
+
+    def stop(self):
+        """Stop the clocks of this phase"""
+
+        self._wall = time.monotonic() - self._t_wall
+        self._cpu = time.process_time() - self._t_cpu
+        self._rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def to_dict(self):
+        """Serialize the phase as dictionary"""
+
+        wall = max(self._wall, 1e-6)
+
+        return {
+            "name": self.name,
+            "wall-seconds": self._wall,
+            "cpu-seconds": self._cpu,
+            "files": self.files,
+            "bytes": self.bytes,
+            "files-per-second": self.files / wall,
+            "mb-per-second": self.bytes / 2**20 / wall,
+            "retries": self.retries,
+            "peak-rss-bytes": self._rss,
+        }
+
+
+class Metrics:
+    """Metrics of a command
+
+    Collects the phases of a single command invocation. Use `phase()` as a
+    context-manager around each phase of work, and `write()` to store the
+    metrics once the command finished.
+    """
+
+    def __init__(self, command, labels=None):
+        self.command = command
+        self.labels = labels or {}
+        self.phases = []
+        self._t_start = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Record a phase
+
+        Start a new phase with the given name and yield its `Phase` object
+        for the caller to account processed files and bytes. The phase is
+        stopped and recorded when the context is exited, even on failure.
+        """
+
+        phase = Phase(name)
+        try:
+            yield phase
+        finally:
+            phase.stop()
+            self.phases.append(phase)
+
+    def to_dict(self):
+        """Serialize the metrics as dictionary"""
+
+        return {
+            "command": self.command,
+            "labels": self.labels,
+            "start": self._t_start,
+            "phases": [v.to_dict() for v in self.phases],
+        }
+
+    def to_prometheus(self):
+        """Serialize the metrics in the Prometheus text format
+
+        Phases of the same name, like the data phases of multiple targets,
+        are reported as a single series. Their counters and times are summed
+        up, and the highest peak RSS is reported.
+        """
+
+        metrics = [
+            ("wall_seconds", "wall-seconds", sum),
+            ("cpu_seconds", "cpu-seconds", sum),
+            ("files", "files", sum),
+            ("bytes", "bytes", sum),
+            ("retries", "retries", sum),
+            ("peak_rss_bytes", "peak-rss-bytes", max),
+        ]
+        labels = dict(self.labels, command=self.command)
+
+        phases = {}
+        for phase in self.phases:
+            phases.setdefault(phase.name, []).append(phase.to_dict())
+
+        lines = []
+        for name, key, fn in metrics:
+            lines.append(f"# TYPE rpmrepo_phase_{name} gauge")
+            for phase, entries in phases.items():
+                values = dict(labels, phase=phase)
+                values = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(values.items()))
+                lines.append(f"rpmrepo_phase_{name}{{{values}}} {fn(v[key] for v in entries)}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, prometheus=None):
+        """Write metrics
+
+        Atomically write the metrics as JSON to `path`, and, if `prometheus`
+        is given, as Prometheus textfile to that path.
+        """
+
+        targets = [(path, json.dumps(self.to_dict(), indent=2) + "\n")]
+        if prometheus is not None:
+            targets.append((prometheus, self.to_prometheus()))
+
+        for target, content in targets:
+            with util.open_tmpfile(os.path.dirname(target), mode=0o644) as ctx:
+                ctx["stream"].write(content.encode())
+                ctx["name"] = os.path.basename(target)
+                ctx["replace"] = True
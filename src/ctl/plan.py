@@ -0,0 +1,137 @@
+"""rpmrepo - Push Plans
+
+This module implements push plans. A plan lists all work of a push, grouped
+by its targets, before anything is pushed. Every item of a target is
+classified as either new (it must be uploaded), copy (it can be copied
+server-side from another storage target), or present (it already exists in
+remote storage). Plans can be reported and used to estimate the duration of a
+push, and are then executed as-is.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+NEW = "new"
+COPY = "copy"
+PRESENT = "present"
+
+CLASSES = [NEW, COPY, PRESENT]
+
+
+class Target:
+    """Target of a push plan
+
+    A target is either a `data` target with the arguments `(storage,
+    platform_id)`, or a `snapshot` target with the arguments `(snapshot_id,
+    snapshot_suffix)`. Its items are tuples of the local path, the remote key,
+    the checksum, the size, the class, and a note. For copies the note is the
+    key to copy from, for present items it describes why the item is present.
+    Data targets carry the transfer profile used for their uploads. Snapshot
+    targets pushed as delta carry their base snapshot and delta depth as
+    `delta`, and list the paths they share with their base as present.
+    """
+
+    def __init__(self, kind, args, profile=None):
+        assert kind in ["data", "snapshot"]
+
+        self.kind = kind
+        self.args = args
+        self.profile = profile
+        self.delta = None
+        self.items = []
+
+    def __str__(self):
+        if self.kind == "data":
+            return f"data {self.args[0]}/{self.args[1]}"
+        return f"snapshot {self.args[0]}{self.args[1]}"
+
+    def summary(self):
+        """Count files and bytes of each class"""
+
+        summary = {v: {"files": 0, "bytes": 0} for v in CLASSES}
+        for item in self.items:
+            summary[item[4]]["files"] += 1
+            summary[item[4]]["bytes"] += item[3]
+        return summary
+
+
+class Plan:
+    """Push plan
+
+    A plan is a list of targets, which are pushed in order. For estimates,
+    `throughput` is the upload throughput in bytes per second, and
+    `request_rate` the number of requests per second, both as measured
+    during a previous push, or `None` if unknown.
+    """
+
+    def __init__(self, throughput=None, request_rate=None):
+        self.targets = []
+        self.throughput = throughput
+        self.request_rate = request_rate
+
+    def estimate(self):
+        """Estimate the duration of the push in seconds
+
+        New data is assumed to be limited by the upload throughput, while
+        copies, refs, manifests, and thread markers are limited by the
+        request rate.
+        Returns `None` if a required measurement is not available.
+        """
+
+        n_bytes = 0
+        n_requests = 0
+        for target in self.targets:
+            summary = target.summary()
+            if target.kind == "data":
+                n_bytes += summary[NEW]["bytes"]
+                n_requests += summary[COPY]["files"]
+            else:
+                n_requests += summary[NEW]["files"] + 2
+
+        if (n_bytes and not self.throughput) or (n_requests and not self.request_rate):
+            return None
+
+        return (n_bytes / self.throughput if n_bytes else 0) + (n_requests / self.request_rate if n_requests else 0)
+
+    def to_dict(self):
+        """Serialize the plan as dictionary"""
+
+        return {
+            "targets": [
+                {
+                    "type": target.kind,
+                    "target": str(target).split(" ", 1)[1],
+                    "profile": None if target.profile is None else str(target.profile),
+                    "delta-base": None if target.delta is None else target.delta[0],
+                    "classes": target.summary(),
+                }
+                for target in self.targets
+            ],
+            "throughput": self.throughput,
+            "request-rate": self.request_rate,
+            "estimate-seconds": self.estimate(),
+        }
+
+    def to_text(self):
+        """Serialize the plan as human-readable text"""
+
+        lines = []
+        for target in self.targets:
+            if target.profile is not None:
+                lines.append(f"Target: {target} (profile {target.profile})")
+            elif target.delta is not None:
+                lines.append(f"Target: {target} (delta of {target.delta[0]}, depth {target.delta[1]})")
+            else:
+                lines.append(f"Target: {target}")
+            for name, summary in target.summary().items():
+                lines.append(f"  {name:<8} {summary['files']:>8} files {summary['bytes'] / 2**20:>12.1f} MiB")
+
+        estimate = self.estimate()
+        if estimate is None:
+            lines.append("Estimate: unknown (no previous push of this cache was measured)")
+        else:
+            lines.append(
+                f"Estimate: {estimate:.1f}s "
+                f"(at {(self.throughput or 0) / 2**20:.1f} MB/s and {self.request_rate or 0:.1f} requests/s)"
+            )
+
+        return "\n".join(lines) + "\n"
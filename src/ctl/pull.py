@@ -2,34 +2,225 @@
 
 This module implements the functions that pull an entire RPM repository to
 local storage.
+
+Two backends are available. The native backend fetches the repository
+metadata, stream-parses the package list, and downloads all files through a
+bounded pool of workers that share keep-alive connections, verifying the
+checksum of every file while it is downloaded. The `reposync` backend runs
+`dnf reposync` instead. Both produce the same layout.
+
+The native backend can download packages from mirrors in addition to the
+base URL. The metadata is always fetched from the base URL, and every package
+is verified against it, so mirrors are never trusted. Packages are spread
+across all sources according to their measured throughput.
+
+Downloads of the native backend are retried with exponential backoff, and
+resume from the partial file left by a previous attempt via HTTP range
+requests. Partial files are kept in the `tmp` directory of the cache, so a
+failed pull can be resumed by running it again on the same cache. Every
+failed attempt is recorded per file in `conf/pull-failures.json`.
+
+The native backend can skip all packages that are already stored in remote
+storage. Those packages are recorded in `conf/stored.json` rather than being
+downloaded, and are treated as stored by the index and push. Similarly, it
+can pass each package to a sink right after it was downloaded and evict it
+from local disk afterwards, so a repository can be streamed into remote
+storage within a bounded disk budget.
 """
 
 # pylint: disable=duplicate-code,invalid-name,too-few-public-methods
 
 import contextlib
 import errno
+import hashlib
+import io
 import os
+import random
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import urllib.parse
+
+import boto3
+import urllib3
+
+from . import digest, push, repodata, util
+from . import metrics as ctl_metrics
+
+
+BACKENDS = ["native", "reposync"]
+JOBS = 16
+
+# Downloads are attempted `RETRIES + 1` times in total. The delay before the
+# n-th retry is `BACKOFF * 2**n` seconds, capped at `BACKOFF_MAX`, minus up
+# to half of it as jitter. Only replies with a status in `RETRY_STATUS` are
+# retried, other errors are reported right away.
+RETRIES = 5
+BACKOFF = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUS = [408, 429, 500, 502, 503, 504]
+
+
+class TransientError(RuntimeError):
+    """Transient download failure, which is worth retrying"""
+
+
+class Budget:
+    """Disk budget
+
+    Track the number of bytes staged on local disk. `acquire()` waits until
+    the given number of bytes fits into the budget, and `release()` returns
+    them once they were evicted. A file larger than the entire budget is
+    admitted once nothing else is staged, so it cannot block forever.
+    """
+
+    def __init__(self, size):
+        assert size > 0
+
+        self._size = size
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n):
+        """Stage bytes, waiting until they fit into the budget"""
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._used == 0 or self._used + n <= self._size)
+            self._used += n
+
+    def release(self, n):
+        """Return evicted bytes to the budget"""
+
+        with self._cond:
+            self._used -= n
+            self._cond.notify_all()
+
+
+class Mirrors:
+    """Mirror selection
+
+    Track the throughput of each source, measured over all downloads from it
+    so far, and the number of bytes currently being downloaded from it.
+    `acquire()` picks the source that is expected to finish a download of the
+    given size first, given what it still has to download, and `release()`
+    accounts the download once it finished or failed. Failed downloads thus
+    lower the throughput of their source. Sources that were not measured yet
+    are assumed to be as fast as the fastest measured one, so every source is
+    tried early on.
+    """
+
+    def __init__(self, urls):
+        assert urls
+
+        self._urls = list(urls)
+        self._bytes = {v: 0 for v in self._urls}
+        self._seconds = {v: 0.0 for v in self._urls}
+        self._pending = {v: 0 for v in self._urls}
+        self._lock = threading.Lock()
 
-from . import util
+    def __len__(self):
+        return len(self._urls)
+
+    def acquire(self, size, exclude=()):
+        """Pick the source to download `size` bytes from
+
+        Sources in `exclude` are only picked if all sources are excluded.
+        """
+
+        with self._lock:
+            urls = [v for v in self._urls if v not in exclude] or self._urls
+            rates = {v: self._bytes[v] / self._seconds[v] for v in urls if self._seconds[v] > 0}
+            default = max(rates.values(), default=1.0)
+            url = min(urls, key=lambda v: (self._pending[v] + size) / max(rates.get(v, default), 1.0))
+            self._pending[url] += size
+            return url
+
+    def release(self, url, size, n_bytes, seconds):
+        """Account a download of `n_bytes` bytes within `seconds`"""
+
+        with self._lock:
+            self._pending[url] -= size
+            self._bytes[url] += n_bytes
+            self._seconds[url] += seconds
+
+    def stats(self):
+        """Return the bytes downloaded and seconds spent per source"""
+
+        with self._lock:
+            return [(v, self._bytes[v], self._seconds[v]) for v in self._urls]
 
 
 # pylint: disable=too-many-instance-attributes
 class Pull(contextlib.AbstractContextManager):
-    """Pull RPM repository"""
+    """Pull RPM repository
 
-    def __init__(self, cache, platform_id, baseurl):
+    If `sink` is given, the native backend passes every package to it right
+    after it was downloaded and verified, as `sink(path, checksum, parts)`
+    with the sha256 checksum and part digests of the file. The package is
+    then evicted from local disk and recorded as stored, which requires
+    `skip_stored` to name the storage the sink pushes to. Downloads are
+    paused while more than `disk_budget` bytes of packages are staged.
+
+    If `mirrors` lists further base URLs of the repository, packages are
+    downloaded from those as well as from `baseurl` (see `Mirrors`).
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+            self,
+            cache,
+            platform_id,
+            baseurl,
+            *,
+            backend="native",
+            jobs=None,
+            skip_stored=None,
+            store=None,
+            list_remote=True,
+            sink=None,
+            disk_budget=None,
+            mirrors=None,
+            metrics=None,
+    ):
+        assert backend in BACKENDS
+        assert not mirrors or backend == "native"
+        assert skip_stored is None or backend == "native"
+        assert sink is None or skip_stored is not None
+
+        self._backend = backend
         self._baseurl = baseurl
+        self._budget = None if disk_budget is None else Budget(disk_budget)
         self._cache = cache
         self._exitstack = None
+        self._jobs = jobs or JOBS
+        self._list_remote = list_remote
+        self._mirrors = Mirrors([baseurl] + mirrors) if mirrors else None
+        self._skip_stored = skip_stored
+        self._metrics = metrics or ctl_metrics.Metrics("pull")
+        self._lock = threading.Lock()
         self._path_dnfconf = None
+        self._path_checksums = os.path.join(cache, "conf/checksums.json")
         self._path_conf = os.path.join(cache, "conf")
+        self._path_data = os.path.join(cache, "index/data")
+        self._path_digests = os.path.join(cache, "index/digests.json")
+        self._path_failures = os.path.join(cache, "conf/pull-failures.json")
+        self._path_partial = os.path.join(cache, "tmp/partial")
         self._path_repo = os.path.join(cache, "repo")
         self._path_root = None
+        self._path_store = store
+        self._path_stored = os.path.join(cache, "conf/stored.json")
         self._path_tmp = os.path.join(cache, "tmp")
+        self._path_upstream = os.path.join(cache, "conf/checksums-upstream.json")
         self._platform_id = platform_id
+        self._sink = sink
+        self._stored = None
+        self._cached = {}
+        self._checksums = {}
+        self._digests = {}
+        self._failures = {}
+        self._upstream = {}
 
     def __enter__(self):
         self._exitstack = contextlib.ExitStack()
@@ -41,25 +232,27 @@ class Pull(contextlib.AbstractContextManager):
             os.makedirs(self._path_repo, exist_ok=True)
             os.makedirs(self._path_tmp, exist_ok=True)
 
-            # Create a temporary `root` directory which we then provide to dnf
-            # to store any of its state files (they are not really necessary,
-            # but `dnf` requires us to provide it).
-            path = tempfile.TemporaryDirectory(prefix="root-", dir=self._path_tmp)
-            self._path_root = self._exitstack.enter_context(path)
-
-            # Write a `dnf.conf` with just a single repository configuration
-            # which we then use for the `dnf reposync` operation.
-            with open(os.path.join(self._path_conf, "dnf.conf"), "wb") as filp:
-                content = (
-                    "[main]\n"
-                    f"module_platform_id=platform:{self._platform_id}\n"
-                    "[repo0]\n"
-                    "name=repo0\n"
-                    f"baseurl={self._baseurl}\n"
-                )
-                filp.write(content.encode())
-                filp.flush()
-            self._path_dnfconf = os.path.join(self._path_conf, "dnf.conf")
+            if self._backend == "reposync":
+                # Create a temporary `root` directory which we then provide to
+                # dnf to store any of its state files (they are not really
+                # necessary, but `dnf` requires us to provide it).
+                path = tempfile.TemporaryDirectory(prefix="root-", dir=self._path_tmp)
+                self._path_root = self._exitstack.enter_context(path)
+
+                # Write a `dnf.conf` with just a single repository
+                # configuration which we then use for the `dnf reposync`
+                # operation.
+                with open(os.path.join(self._path_conf, "dnf.conf"), "wb") as filp:
+                    content = (
+                        "[main]\n"
+                        f"module_platform_id=platform:{self._platform_id}\n"
+                        "[repo0]\n"
+                        "name=repo0\n"
+                        f"baseurl={self._baseurl}\n"
+                    )
+                    filp.write(content.encode())
+                    filp.flush()
+                self._path_dnfconf = os.path.join(self._path_conf, "dnf.conf")
 
             # Setup succeeded, make sure to retain the exitstack for __exit__.
             self._exitstack = self._exitstack.pop_all()
@@ -88,15 +281,467 @@ class Pull(contextlib.AbstractContextManager):
         with subprocess.Popen(cmd) as proc:
             return proc.wait()
 
+    def _path(self, href):
+        # Map a location of the repository to its local path, refusing any
+        # location that would escape the repository directory.
+        path = os.path.normpath(os.path.join(self._path_repo, href))
+        if not path.startswith(self._path_repo + "/"):
+            raise RuntimeError(f"Invalid repository location '{href}'")
+        return path
+
+    @staticmethod
+    def _hashproc(checksum):
+        # Old repositories use `sha` as name for `sha1`.
+        algorithm = checksum.split("-", 1)[0]
+        return hashlib.new("sha1" if algorithm == "sha" else algorithm)
+
+    def _verify(self, path, checksum):
+        # Verify a file against its checksum from the repository metadata,
+        # and return its sha256 checksum and part digests, or `None` if it
+        # does not match. The file is read once for all of them.
+        hashproc = None if checksum.startswith("sha256-") else self._hashproc(checksum)
+        size = os.stat(path).st_size
+        digestproc = digest.Digest(digest.PART_SIZE if size > digest.PART_SIZE else None)
+        with open(path, "rb") as filp:
+            for block in iter(lambda: filp.read(digest.BUFFER_SIZE), b""):
+                if hashproc is not None:
+                    hashproc.update(block)
+                digestproc.update(block)
+        checksum_data, parts = digestproc.finish()
+        if hashproc is None and checksum_data != checksum:
+            return None
+        if hashproc is not None and hashproc.hexdigest() != checksum.split("-", 1)[1]:
+            return None
+        return checksum_data, parts
+
+    def _fetch(self, http, href, offset=0, baseurl=None):
+        # Request a file, starting at `offset`. Returns the reply, or `None`
+        # if the server reports that nothing is left after `offset`, which
+        # happens if a partial file of unknown size is complete already.
+        url = urllib.parse.urljoin((baseurl or self._baseurl).rstrip("/") + "/", href)
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else None
+        reply = http.request("GET", url, headers=headers, preload_content=False)
+        if reply.status == 200:
+            return reply
+        if reply.status == 206 and offset > 0:
+            if not reply.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                reply.release_conn()
+                raise TransientError(f"Invalid range of '{href}'")
+            return reply
+        if reply.status == 416 and offset > 0:
+            reply.release_conn()
+            return None
+
+        reply.release_conn()
+        if reply.status in RETRY_STATUS:
+            raise TransientError(f"Failed to fetch '{href}' with status '{reply.status}'")
+        raise RuntimeError(f"Failed to fetch '{href}' with status '{reply.status}'")
+
+    def _retry(self, href, fn):
+        # Call `fn` until it succeeds, retrying transient failures with
+        # exponential backoff. Every failure is recorded for `href`.
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except (TransientError, urllib3.exceptions.HTTPError) as e:
+                self._fail(href, e)
+                if attempt == RETRIES:
+                    raise RuntimeError(f"{e} (gave up after {attempt + 1} attempts)") from e
+                delay = min(BACKOFF * 2**attempt, BACKOFF_MAX)
+                time.sleep(delay - random.uniform(0, delay / 2))
+                attempt += 1
+            except RuntimeError as e:
+                self._fail(href, e)
+                raise
+
+    def _fail(self, href, error):
+        with self._lock:
+            record = self._failures.setdefault(href, {"failures": 0, "error": None})
+            record["failures"] += 1
+            record["error"] = str(error)
+
+    def _retries(self, href, failed=False):
+        # Number of retries of `href` by now, i.e., all its recorded failures
+        # but the last, if it failed for good.
+        with self._lock:
+            failures = self._failures.get(href, {"failures": 0})["failures"]
+        return max(failures - 1, 0) if failed else failures
+
+    def _transfer(self, http, href, checksum, size, baseurl=None):
+        # Download a file into its partial file, resuming a previous attempt
+        # if its partial file was left behind, and move it into place once
+        # its checksum was verified. The sha256 digests the index needs are
+        # calculated in the same pass, including the resumed part. Partial
+        # files are named after the location and checksum of the file, so a
+        # stale partial file is never resumed for different content.
+        # Returns the number of bytes downloaded, the sha256 checksum, and
+        # the part digests of the file. Partial files the server has nothing
+        # left for are verified like any other download.
+        path = self._path(href)
+        path_partial = os.path.join(
+            self._path_partial,
+            hashlib.sha256(f"{href}\0{checksum}".encode()).hexdigest(),
+        )
+        hashproc = None if checksum.startswith("sha256-") else self._hashproc(checksum)
+        n_bytes = 0
+
+        offset = 0
+        with util.suppress_oserror(errno.ENOENT):
+            offset = os.stat(path_partial).st_size
+        if size and offset > size:
+            offset = 0
+
+        reply = None
+        if not size or offset < size:
+            reply = self._fetch(http, href, offset, baseurl)
+            if reply is not None and reply.status == 200:
+                offset = 0
+
+        try:
+            if not size:
+                size = offset
+                if reply is not None:
+                    size += int(reply.headers.get("Content-Length") or 0)
+            digestproc = digest.Digest(digest.PART_SIZE if size > digest.PART_SIZE else None)
+
+            def _update(block):
+                if hashproc is not None:
+                    hashproc.update(block)
+                digestproc.update(block)
+
+            with open(path_partial, "a+b") as filp:
+                filp.truncate(offset)
+                filp.seek(0)
+                for block in iter(lambda: filp.read(digest.BUFFER_SIZE), b""):
+                    _update(block)
+
+                # Use `read1()` rather than `stream()`, so everything received
+                # before a connection breaks ends up in the partial file.
+                if reply is not None:
+                    for block in iter(lambda: reply.read1(digest.BUFFER_SIZE), b""):
+                        _update(block)
+                        filp.write(block)
+                        n_bytes += len(block)
+        finally:
+            if reply is not None:
+                reply.release_conn()
+
+        # A mismatch might stem from a corrupted partial file as much as from
+        # a broken transfer, so the next attempt starts from scratch.
+        checksum_data, parts = digestproc.finish()
+        if (hashproc is None and checksum_data != checksum) or (
+                hashproc is not None and hashproc.hexdigest() != checksum.split("-", 1)[1]
+        ):
+            os.unlink(path_partial)
+            raise TransientError(f"Checksum mismatch of '{href}'")
+
+        os.chmod(path_partial, 0o644)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(path_partial, path)
+
+        if offset + n_bytes <= digest.PART_SIZE:
+            parts = None
+
+        return n_bytes, checksum_data, parts
+
+    def _transfer_mirrored(self, http, href, checksum, size, failed):
+        # Download a file from the source picked by the mirror selection,
+        # avoiding the sources that failed for this file already. Any error
+        # of a source is transient as long as other sources are left, since
+        # mirrors can lag behind or serve broken files. Partial files are
+        # resumed from whichever source is picked next.
+        baseurl = self._mirrors.acquire(size or 0, exclude=failed)
+        t_start = time.monotonic()
+        n_bytes = 0
+        try:
+            result = self._transfer(http, href, checksum, size, baseurl)
+            n_bytes = result[0]
+            return result
+        except (RuntimeError, urllib3.exceptions.HTTPError) as e:
+            failed.add(baseurl)
+            if not isinstance(e, (TransientError, urllib3.exceptions.HTTPError)) and len(failed) < len(self._mirrors):
+                raise TransientError(f"{e} from '{baseurl}'") from e
+            raise
+        finally:
+            self._mirrors.release(baseurl, size or 0, n_bytes, time.monotonic() - t_start)
+
+    def _download(self, http, href, checksum, size, mirrored=False):
+        # Download a file unless it is already present with the correct
+        # checksum, and link it into the data directory of the index right
+        # away, so the index does not have to read it again. If `mirrored` is
+        # set, the file can be downloaded from any mirror.
+        # Files recorded in the checksum cache were verified when they were
+        # downloaded, and are unchanged since, so they are not read again.
+        # The cache only holds sha256 checksums, so other checksums are
+        # compared against the upstream checksum recorded along with them.
+        # Other files already present are verified, and recorded and linked
+        # like downloaded files.
+        # Returns the number of bytes downloaded, or `None` if the file was
+        # already present, and the checksum-cache key, checksum, and part
+        # digests of the file, or `None` if it is in the checksum cache.
+        path = self._path(href)
+        with util.suppress_oserror(errno.ENOENT):
+            key = util.checksum_key(os.stat(path))
+            if self._cached.get(key) == checksum or self._upstream.get(key) == checksum:
+                return None, None
+            verified = self._verify(path, checksum)
+            if verified is not None:
+                return None, (self._link_data(path, verified[0]), *verified)
+
+        if mirrored and self._mirrors is not None:
+            failed = set()
+            n_bytes, checksum_data, parts = self._retry(
+                href,
+                lambda: self._transfer_mirrored(http, href, checksum, size, failed),
+            )
+        else:
+            n_bytes, checksum_data, parts = self._retry(href, lambda: self._transfer(http, href, checksum, size))
+
+        return n_bytes, (self._link_data(path, checksum_data), checksum_data, parts)
+
+    def _link_data(self, path, checksum):
+        # Link a downloaded file into the data directory of the index and
+        # return its checksum-cache key.
+        with util.suppress_oserror(errno.EEXIST):
+            os.link(path, os.path.join(self._path_data, checksum), follow_symlinks=False)
+        return util.checksum_key(os.stat(path))
+
+    def _stream(self, http, entry):
+        # Download a package, pass it to the sink, and evict it again, along
+        # with its link in the data directory of the index. Packages found in
+        # the checksum cache are hashed once more, since the sink needs their
+        # part digests.
+        n_bytes, record = self._download(http, entry["href"], entry["checksum"], entry["size"], mirrored=True)
+        path = self._path(entry["href"])
+
+        if record is None:
+            st = os.stat(path)
+            record = (
+                util.checksum_key(st),
+                *digest.digest_path(path, digest.PART_SIZE if st.st_size > digest.PART_SIZE else None),
+            )
+
+        self._sink(path, record[1], record[2])
+
+        with util.suppress_oserror(errno.ENOENT):
+            os.unlink(path)
+        with util.suppress_oserror(errno.ENOENT):
+            os.unlink(os.path.join(self._path_data, record[1]))
+
+        return n_bytes, record
+
+    def _download_all(self, http, phase, entries, stream=False, mirrored=False):
+        # Files that failed for good do not stop the others, so a rerun only
+        # has to fetch what is missing. The phase fails once all are done.
+        def _fn(entry):
+            try:
+                if not stream:
+                    return self._download(http, entry["href"], entry["checksum"], entry["size"], mirrored)
+
+                if self._budget is not None:
+                    self._budget.acquire(entry["size"] or 0)
+                try:
+                    return self._stream(http, entry)
+                finally:
+                    if self._budget is not None:
+                        self._budget.release(entry["size"] or 0)
+            except RuntimeError as e:
+                return e
+
+        n_total = len(entries)
+        n_failed = 0
+        for i_total, (entry, result) in enumerate(util.map_ordered(_fn, entries, self._jobs), start=1):
+            if isinstance(result, RuntimeError):
+                print(f"[{i_total}/{n_total}] '{entry['href']}' (failed: {result})")
+                phase.add(retries=self._retries(entry["href"], failed=True))
+                n_failed += 1
+                continue
+
+            n_bytes, record = result
+            phase.add(retries=self._retries(entry["href"]))
+            if n_bytes is None:
+                print(f"[{i_total}/{n_total}] '{entry['href']}' (already present)")
+            else:
+                print(f"[{i_total}/{n_total}] '{entry['href']}'")
+                phase.add(files=1, n_bytes=n_bytes)
+
+            if stream:
+                self._stored[os.path.relpath(self._path(entry["href"]), self._path_repo)] = {
+                    "checksum": record[1],
+                    "size": entry["size"],
+                }
+            elif record is not None:
+                self._checksums[record[0]] = record[1]
+                if not entry["checksum"].startswith("sha256-"):
+                    self._upstream[record[0]] = entry["checksum"]
+                if record[2] is not None:
+                    self._digests[record[1]] = {"part-size": digest.PART_SIZE, "parts": record[2]}
+
+        if n_failed > 0:
+            raise RuntimeError(f"Failed to fetch {n_failed} of {n_total} files, see '{self._path_failures}'")
+
+    def _load_stored(self):
+        # Collect the sha256 digests of all data of this platform in the
+        # selected storage, either from the remote listing, or from the
+        # record of the local content store, or both.
+        stored = set()
+
+        # Packages recorded as stored by a previous, possibly failed, run on
+        # this cache are stored already, even if they were streamed into
+        # remote storage and never listed anywhere else.
+        record = util.load_json(self._path_stored)
+        if record.get("storage") == self._skip_stored and record.get("platform-id") == self._platform_id:
+            for entry in record.get("files", {}).values():
+                if entry["checksum"].startswith("sha256-"):
+                    stored.add(bytes.fromhex(entry["checksum"][len("sha256-"):]))
+
+        if self._list_remote:
+            stored |= push.list_digests(boto3.client("s3"), self._skip_stored, self._platform_id)
+
+        if self._path_store is not None:
+            with util.suppress_oserror(errno.ENOENT):
+                path = os.path.join(self._path_store, self._platform_id, f"pushed-{self._skip_stored}")
+                with open(path, "r", encoding="utf-8") as filp:
+                    for line in filp:
+                        if line.startswith("sha256-"):
+                            stored.add(bytes.fromhex(line.strip()[len("sha256-"):]))
+
+        return stored
+
+    def _split_stored(self, packages):
+        # Split off all packages that are already stored remotely. Only
+        # sha256 checksums can be matched against the content-addressed
+        # storage, so packages with other checksums are always downloaded.
+        # Local copies of skipped packages are dropped, so the repository
+        # only contains the packages that still have to be pushed.
+        stored = self._load_stored()
+        fetch = []
+        skipped = {}
+
+        for entry in packages:
+            checksum = entry["checksum"]
+            if checksum.startswith("sha256-") and bytes.fromhex(checksum[len("sha256-"):]) in stored:
+                skipped[os.path.relpath(self._path(entry["href"]), self._path_repo)] = {
+                    "checksum": checksum,
+                    "size": entry["size"],
+                }
+                with util.suppress_oserror(errno.ENOENT):
+                    os.unlink(self._path(entry["href"]))
+            else:
+                fetch.append(entry)
+
+        return fetch, skipped
+
+    def _run_native(self):
+        os.makedirs(self._path_data, exist_ok=True)
+        os.makedirs(self._path_partial, exist_ok=True)
+        self._cached = util.load_json(self._path_checksums)
+        self._upstream = util.load_json(self._path_upstream)
+        self._failures = {}
+
+        try:
+            with urllib3.PoolManager(maxsize=self._jobs, block=True, retries=False, timeout=60.0) as http:
+                self._pull_native(http)
+        finally:
+            # Record the checksums and part digests of all downloaded files
+            # for the index, keyed like its checksum cache, even if the pull
+            # failed. A rerun then neither downloads nor hashes them again.
+            self._cached.update(self._checksums)
+            util.store_json(self._path_checksums, self._cached)
+            util.store_json(self._path_upstream, self._upstream)
+            util.store_json(self._path_digests, dict(util.load_json(self._path_digests), **self._digests))
+            util.store_json(self._path_failures, self._failures)
+            # Packages streamed into remote storage are gone from local disk,
+            # so they must be recorded as stored even if the pull failed.
+            if self._stored is not None:
+                util.store_json(
+                    self._path_stored,
+                    {"storage": self._skip_stored, "platform-id": self._platform_id, "files": self._stored},
+                )
+
+        # Partial files left behind by previous runs are of no use anymore.
+        for entry in os.listdir(self._path_partial):
+            with util.suppress_oserror(errno.ENOENT):
+                os.unlink(os.path.join(self._path_partial, entry))
+
+    def _fetch_repomd(self, http):
+        reply = self._fetch(http, "repodata/repomd.xml")
+        try:
+            return reply.data
+        finally:
+            reply.release_conn()
+
+    def _pull_native(self, http):
+        # Fetch `repomd.xml` first, then all metadata files it refers to. The
+        # package list is stream-parsed from the downloaded `primary`
+        # metadata. `repomd.xml` itself is written last, so the repository is
+        # never complete before all its files are.
+        with self._metrics.phase("metadata") as phase:
+            content = self._retry("repodata/repomd.xml", lambda: self._fetch_repomd(http))
+            phase.add(retries=self._retries("repodata/repomd.xml"))
+
+            _, entries = repodata.parse_repomd(io.BytesIO(content))
+            self._download_all(http, phase, entries)
+
+            primary = [v for v in entries if v["type"] == "primary"]
+            if len(primary) != 1:
+                raise RuntimeError("Repository metadata lacks a unique 'primary' entry")
+
+            packages = {}
+            with repodata.open_compressed(self._path(primary[0]["href"])) as filp:
+                for entry in repodata.iter_packages(filp):
+                    packages.setdefault(entry["href"], entry)
+
+        packages = list(packages.values())
+        if self._skip_stored is not None:
+            packages, self._stored = self._split_stored(packages)
+            print(f"Skipping {len(self._stored)} packages already stored in '{self._skip_stored}'")
+
+        with self._metrics.phase("packages") as phase:
+            self._download_all(http, phase, packages, stream=self._sink is not None, mirrored=True)
+
+        if self._mirrors is not None:
+            for url, n_bytes, seconds in self._mirrors.stats():
+                rate = n_bytes / 2**20 / seconds if seconds > 0 else 0.0
+                print(f"Mirror '{url}': {n_bytes / 2**20:.1f} MiB in {seconds:.1f}s ({rate:.1f} MiB/s per download)")
+
+        with self._metrics.phase("repomd") as phase:
+            path = self._path("repodata/repomd.xml")
+            with util.open_tmpfile(os.path.dirname(path), mode=0o644) as ctx:
+                ctx["stream"].write(content)
+                ctx["name"] = os.path.basename(path)
+                ctx["replace"] = True
+            phase.add(files=1, n_bytes=len(content))
+
+            digestproc = digest.Digest()
+            digestproc.update(content)
+            checksum = digestproc.finish()[0]
+            self._checksums[self._link_data(path, checksum)] = checksum
+
     def pull(self):
         """Run operation"""
 
         with util.suppress_oserror(errno.ENOENT):
             os.unlink(os.path.join(self._path_conf, "repo.ok"))
+        # The record of stored packages is replaced by native pulls that skip
+        # stored packages, but they consult it before. Any other pull leaves
+        # all packages in the repository.
+        if self._skip_stored is None:
+            with util.suppress_oserror(errno.ENOENT):
+                os.unlink(self._path_stored)
+
+        if self._backend == "native":
+            self._run_native()
+        else:
+            with self._metrics.phase("reposync") as phase:
+                ret = self._run_reposync()
+                if ret != 0:
+                    raise RuntimeError(f"Failed during dnf reposync with exitcode '{ret}'")
 
-        ret = self._run_reposync()
-        if ret != 0:
-            raise RuntimeError(f"Failed during dnf reposync with exitcode '{ret}'")
+                for level, _, entries in os.walk(self._path_repo):
+                    for entry in entries:
+                        phase.add(files=1, n_bytes=os.stat(os.path.join(level, entry)).st_size)
 
         with open(os.path.join(self._path_conf, "repo.ok"), "wb"):
             pass
@@ -6,38 +6,401 @@ snapshots to configured remote storage.
 
 # pylint: disable=duplicate-code,invalid-name,too-few-public-methods
 
+import base64
+import concurrent.futures
 import contextlib
+import io
+import json
 import os
+import threading
 
 import boto3
+import botocore.config
+import botocore.exceptions
 
+from . import delta, digest, fingerprint, journal, manifest, transfer, util
+from . import metrics as ctl_metrics
+from . import plan as ctl_plan
 
+
+JOBS = 16
+STORAGES = ["public", "rhvpn"]
+
+
+def list_digests(s3c, storage, platform_id):
+    """List the data of a platform in remote storage
+
+    List all data objects of the given storage and platform, and return the
+    set of their sha256 digests as raw bytes. Only the digests are retained
+    rather than the full keys, so the set stays compact even for platforms
+    with hundreds of thousands of packages.
+
+    Parameters
+    ----------
+    s3c
+        S3 client to use.
+    storage
+        Storage target to list.
+    platform_id
+        Platform to list.
+    """
+
+    remote = set()
+    paginator = s3c.get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket="rpmrepo-storage",
+        Prefix=f"data/{storage}/{platform_id}/",
+        PaginationConfig={'PageSize': 1000},
+    )
+    for page in pages:
+        for entry in page.get("Contents", []):
+            name = entry["Key"].rsplit("/", 1)[1]
+            if name.startswith("sha256-") and len(name) == len("sha256-") + 64:
+                remote.add(bytes.fromhex(name[len("sha256-"):]))
+    return remote
+
+
+# pylint: disable=too-many-instance-attributes
 class Push(contextlib.AbstractContextManager):
-    """Push RPM repository"""
+    """Push RPM repository
+
+    Uploaded objects are recorded in the push journal of the cache for the
+    run `run`, usually the name of the snapshot that is pushed, so a failed
+    push of the same run can be resumed (see `journal`). If `reset_journal`
+    is set, the journal is not used for planning, and discarded once the push
+    is executed. Journals of other runs are only discarded then as well, so
+    planning a push never affects the journal.
+    """
 
-    def __init__(self, cache):
+    # pylint: disable=too-many-arguments
+    def __init__(
+            self,
+            cache,
+            *,
+            store=None,
+            jobs=None,
+            list_remote=True,
+            profile=None,
+            max_bandwidth=None,
+            max_requests=None,
+            run=None,
+            reset_journal=False,
+            metrics=None,
+    ):
         self._cache = cache
+        self._jobs = jobs or JOBS
+        self._max_bandwidth = max_bandwidth
+        self._max_requests = max_requests
+        self._bucket_bandwidth = None if max_bandwidth is None else transfer.TokenBucket(max_bandwidth)
+        self._bucket_requests = None if max_requests is None else transfer.TokenBucket(max_requests)
+        self._list_remote = list_remote
+        self._metrics = metrics or ctl_metrics.Metrics("push")
+        self._profile = profile
+        self._s3c = None
+        self._s3c_connections = 0
+        self._exitstack = None
+        self._journal = None
+        self._lock = threading.Lock()
+        self._remote = {}
+        self._reset_journal = reset_journal
+        self._retries = 0
+        self._run = run
+        self._sources = {}
+        self._path_store = store
         self._path_conf = os.path.join(cache, "conf")
         self._path_data = os.path.join(cache, "index/data")
-        self._path_snapshot = os.path.join(cache, "index/snapshot")
+        self._path_digests = os.path.join(cache, "index/digests.json")
+        self._path_journal = os.path.join(cache, "conf/push-journal")
+        self._path_manifest = os.path.join(cache, "index/manifest.jsonl.gz")
+        self._path_metrics = os.path.join(cache, "conf/metrics-push.json")
+        self._path_repomd = os.path.join(cache, "repo/repodata/repomd.xml")
+        self._path_stored = os.path.join(cache, "conf/stored.json")
+
+    def __enter__(self):
+        self._exitstack = contextlib.ExitStack()
+        with self._exitstack:
+            self._journal = self._exitstack.enter_context(
+                journal.Journal(self._path_journal, run=self._run, reset=self._reset_journal),
+            )
+
+            # Setup succeeded, make sure to retain the exitstack for __exit__.
+            self._exitstack = self._exitstack.pop_all()
+
+        return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        pass
+        self._exitstack.close()
+        self._exitstack = None
+        self._journal = None
 
-    def push_data_s3(self, storage, platform_id):
-        """Push data to S3"""
+    def _client(self, connections=None):
+        # A single client is shared by all workers. Clients are thread-safe,
+        # but their connection pool must be large enough to serve every
+        # worker, or requests serialize on the pool.
+        connections = max(connections or self._jobs, 10)
+        if self._s3c is None or self._s3c_connections < connections:
+            config = botocore.config.Config(max_pool_connections=connections)
+            self._s3c = boto3.client("s3", config=config)
+            self._s3c_connections = connections
+            self._s3c.meta.events.register_first("before-send.s3", self._throttle)
+            self._s3c.meta.events.register("request-created.s3", self._count_retry)
+        return self._s3c
 
-        assert os.access(os.path.join(self._path_conf, "index.ok"), os.R_OK)
-        assert storage in ["public", "rhvpn"]
+    @contextlib.contextmanager
+    def _count_retries(self, phase):
+        # Account all requests retried while the context is active to the
+        # given phase, even if it fails.
+        retries = self._retries
+        try:
+            yield
+        finally:
+            phase.add(retries=self._retries - retries)
 
-        s3c = boto3.client("s3")
+    @property
+    def retries(self):
+        """Number of requests retried by this push so far"""
 
-        n_total = 0
-        for _, _, entries in os.walk(self._path_data):
-            for entry in entries:
-                n_total += 1
+        return self._retries
+
+    def _count_retry(self, request, **_kwargs):
+        # botocore creates a new request for every attempt of a call, and
+        # records the attempt in its context. Count all attempts but the
+        # first, so phases can report the retries of their requests.
+        if request.context.get("retries", {}).get("attempt", 1) > 1:
+            with self._lock:
+                self._retries += 1
+
+    def _throttle(self, request, **_kwargs):
+        # Every request of the client passes through here right before it is
+        # sent, including retries and the parts of managed transfers, so the
+        # caps apply globally across all workers. The bandwidth is charged
+        # for each chunk of the body as it is sent, so a large body only
+        # holds back the worker sending it. Retries are sent as new request
+        # with the original body, which is wrapped again and only charged
+        # for what is sent again.
+        if self._bucket_requests is not None:
+            self._bucket_requests.acquire()
+        if self._bucket_bandwidth is not None and not isinstance(request.body, transfer.ThrottledReader):
+            if isinstance(request.body, (bytes, bytearray)) and request.body:
+                request.body = transfer.ThrottledReader(io.BytesIO(request.body), self._bucket_bandwidth)
+            elif hasattr(request.body, "read"):
+                request.body = transfer.ThrottledReader(request.body, self._bucket_bandwidth)
+
+    def _load_digests(self):
+        return util.load_json(self._path_digests)
+
+    @staticmethod
+    def _load_pushed(path):
+        # The record of pushed checksums lists one checksum per line, rather
+        # than being JSON, so it can be appended to.
+        try:
+            with open(path, "r", encoding="utf-8") as filp:
+                return {line.strip() for line in filp}
+        except FileNotFoundError:
+            return set()
+
+    def _load_stored(self):
+        # List the checksum, size, and remote key of every package that was
+        # skipped by the pull, since it was already stored remotely.
+        stored = util.load_json(self._path_stored)
+        if not stored:
+            return []
+
+        return sorted({
+            (v["checksum"], v["size"], f"data/{stored['storage']}/{stored['platform-id']}/{v['checksum']}")
+            for v in stored["files"].values()
+        })
+
+    def _load_throughput(self):
+        # The upload throughput in bytes per second and the request rate of
+        # the previous push of this cache, if any. The request rate is taken
+        # from the refs, since they carry no data. Metrics are written once a
+        # command finished, so this never includes the currently running push.
+        try:
+            with open(self._path_metrics, "r", encoding="utf-8") as filp:
+                phases = json.load(filp)["phases"]
+        except (FileNotFoundError, KeyError, ValueError):
+            return None, None
+
+        def _rate(prefix, key):
+            n = sum(v[key] for v in phases if v["name"].startswith(prefix))
+            wall = sum(v["wall-seconds"] for v in phases if v["name"].startswith(prefix))
+            if n == 0 or wall <= 0:
+                return None
+            return n / wall
+
+        return _rate("data-", "bytes"), _rate("snapshot", "files")
+
+    @staticmethod
+    def _upload_multipart(s3c, filp, key, digests, jobs):
+        upload = s3c.create_multipart_upload(
+            Bucket="rpmrepo-storage",
+            Key=key,
+            ChecksumAlgorithm="SHA256",
+        )
 
-        i_total = 0
+        # Parts are read by the worker that uploads them, so at most `jobs`
+        # parts of the file are held in memory at a time.
+        def _part(item):
+            i, part = item
+            reply = s3c.upload_part(
+                Body=os.pread(filp.fileno(), digests["part-size"], (i - 1) * digests["part-size"]),
+                Bucket="rpmrepo-storage",
+                ChecksumSHA256=part,
+                Key=key,
+                PartNumber=i,
+                UploadId=upload["UploadId"],
+            )
+            return {"ChecksumSHA256": part, "ETag": reply["ETag"], "PartNumber": i}
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                parts = list(executor.map(_part, enumerate(digests["parts"], start=1)))
+
+            s3c.complete_multipart_upload(
+                Bucket="rpmrepo-storage",
+                Key=key,
+                MultipartUpload={"Parts": parts},
+                UploadId=upload["UploadId"],
+            )
+        except BaseException:
+            s3c.abort_multipart_upload(
+                Bucket="rpmrepo-storage",
+                Key=key,
+                UploadId=upload["UploadId"],
+            )
+            raise
+
+    # pylint: disable=too-many-arguments
+    def _upload(self, s3c, path, key, checksum, *, digests, profile):
+        # Data files are uploaded with the digests calculated during indexing,
+        # so the client does not read the file once more to checksum it. Only
+        # large files without part digests matching the transfer profile fall
+        # back to the managed upload of boto3.
+        size = os.stat(path).st_size
+        parts = digests.get(checksum)
+        if parts is not None and (
+                parts["part-size"] != profile.part_size
+                or len(parts["parts"]) != -(-size // parts["part-size"])
+        ):
+            parts = None
+
+        with open(path, "rb") as filp:
+            if size <= profile.threshold:
+                s3c.put_object(
+                    Body=filp,
+                    Bucket="rpmrepo-storage",
+                    ChecksumSHA256=base64.b64encode(bytes.fromhex(checksum[len("sha256-"):])).decode(),
+                    Key=key,
+                )
+            elif parts is not None:
+                self._upload_multipart(s3c, filp, key, parts, profile.part_jobs)
+            else:
+                s3c.upload_fileobj(filp, "rpmrepo-storage", key, Config=profile.transfer_config())
+
+    def _source(self, storage, key, checksum, remote):
+        # Find an object with the same content in another storage target, so
+        # it can be copied server-side. Objects pushed earlier by this push
+        # are preferred over the remote listings.
+        raw = bytes.fromhex(checksum[len("sha256-"):])
+        if raw in self._sources:
+            return self._sources[raw]
+        for target, digests in remote.items():
+            if target != storage and raw in digests:
+                return f"data/{target}/" + key[len(f"data/{storage}/"):]
+        return None
+
+    @staticmethod
+    def _copy(s3c, source, key, size, profile):
+        # Objects of up to 5GiB are copied with a single request, larger ones
+        # are copied in parts, which are copied concurrently just like the
+        # parts of an upload.
+        if size <= transfer.MAX_PUT_SIZE:
+            s3c.copy_object(
+                Bucket="rpmrepo-storage",
+                ChecksumAlgorithm="SHA256",
+                CopySource={"Bucket": "rpmrepo-storage", "Key": source},
+                Key=key,
+            )
+            return
+
+        part_size = max(profile.part_size, -(-size // transfer.MAX_PARTS))
+        upload = s3c.create_multipart_upload(
+            Bucket="rpmrepo-storage",
+            Key=key,
+        )
+
+        def _part(i):
+            start = (i - 1) * part_size
+            reply = s3c.upload_part_copy(
+                Bucket="rpmrepo-storage",
+                CopySource={"Bucket": "rpmrepo-storage", "Key": source},
+                CopySourceRange=f"bytes={start}-{min(start + part_size, size) - 1}",
+                Key=key,
+                PartNumber=i,
+                UploadId=upload["UploadId"],
+            )
+            return {"ETag": reply["CopyPartResult"]["ETag"], "PartNumber": i}
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=profile.part_jobs) as executor:
+                parts = list(executor.map(_part, range(1, -(-size // part_size) + 1)))
+
+            s3c.complete_multipart_upload(
+                Bucket="rpmrepo-storage",
+                Key=key,
+                MultipartUpload={"Parts": parts},
+                UploadId=upload["UploadId"],
+            )
+        except BaseException:
+            s3c.abort_multipart_upload(
+                Bucket="rpmrepo-storage",
+                Key=key,
+                UploadId=upload["UploadId"],
+            )
+            raise
+
+    def _plan_stored(self, target, storage, platform_id, jnl):
+        # Packages that were not pulled, since they were already stored in
+        # remote storage, have no local data. They are present in the storage
+        # they were found in, and copied server-side into any other storage.
+        keys = {v[1] for v in target.items}
+        for checksum, size, key_stored in self._load_stored():
+            key = f"data/{storage}/{platform_id}/{checksum}"
+            if key in keys:
+                continue
+            if key == key_stored:
+                target.items.append((None, key, checksum, size, ctl_plan.PRESENT, "already stored"))
+            elif jnl.contains(key, size, checksum):
+                target.items.append((None, key, checksum, size, ctl_plan.PRESENT, "already pushed"))
+            elif bytes.fromhex(checksum[len("sha256-"):]) in self._remote[platform_id].get(storage, ()):
+                target.items.append((None, key, checksum, size, ctl_plan.PRESENT, "already present"))
+            else:
+                target.items.append((None, key, checksum, size, ctl_plan.COPY, key_stored))
+
+    def _plan_data(self, target, storage, platform_id, jnl):
+        # If the data was indexed into a shared content store, the store
+        # remembers which checksums were already pushed by this worker, so
+        # every checksum is uploaded at most once.
+        pushed = set()
+        if self._path_store is not None and os.path.isdir(os.path.join(self._path_store, platform_id)):
+            pushed = self._load_pushed(os.path.join(self._path_store, platform_id, f"pushed-{storage}"))
+
+        # Data is content-addressed, so any checksum that already exists in
+        # the remote storage does not have to be uploaded again. The remote
+        # listing can be skipped, in which case only the local record of the
+        # content store is used.
+        # Other storage targets are listed as well, since a checksum present
+        # there can be copied server-side rather than uploaded once more.
+        if platform_id not in self._remote:
+            self._remote[platform_id] = {}
+            if self._list_remote:
+                for entry in STORAGES:
+                    self._remote[platform_id][entry] = list_digests(self._client(), entry, platform_id)
+        remote = self._remote[platform_id]
+
+        # Every object confirmed uploaded is recorded in the push journal of
+        # this cache, so an interrupted push can be resumed where it stopped.
         for level, _, entries in os.walk(self._path_data):
             levelpath = os.path.relpath(level, self._path_data)
             if levelpath == ".":
@@ -46,54 +409,351 @@ class Push(contextlib.AbstractContextManager):
                 path = os.path.join(platform_id, levelpath)
 
             for entry in entries:
-                i_total += 1
+                key = f"data/{storage}/{path}/{entry}"
+                size = os.stat(os.path.join(level, entry)).st_size
+                if entry in pushed or jnl.contains(key, size, entry):
+                    cls, note = ctl_plan.PRESENT, "already pushed"
+                elif bytes.fromhex(entry[len("sha256-"):]) in remote.get(storage, ()):
+                    cls, note = ctl_plan.PRESENT, "already present"
+                else:
+                    note = self._source(storage, key, entry, remote)
+                    cls = ctl_plan.NEW if note is None else ctl_plan.COPY
+                target.items.append((os.path.join(level, entry), key, entry, size, cls, note))
+
+                # Later targets can copy everything this target pushes.
+                self._sources[bytes.fromhex(entry[len("sha256-"):])] = key
+
+        self._plan_stored(target, storage, platform_id, jnl)
+
+        # Unless a transfer profile was given explicitly, derive it from the
+        # sizes of the files to upload and the throughput of the last push.
+        target.profile = self._profile
+        if target.profile is None:
+            target.profile = transfer.Profile.auto(
+                [v[3] for v in target.items if v[4] == ctl_plan.NEW],
+                self._jobs,
+                throughput=self._load_throughput()[0],
+            )
+
+    def _load_base(self, path, base):
+        # Resolve the base of a delta snapshot to its delta depth and the
+        # checksums of all its paths, as listed by its manifest. Returns
+        # `None` if the snapshot must be pushed in full instead.
+        if base == path:
+            print(f"Snapshot '{path}' cannot be a delta of itself, pushing it in full")
+            return None
+
+        s3c = self._client()
+        record = delta.load_s3(s3c, base)
+        depth = 1 if record is None else record["depth"] + 1
+        if depth > delta.MAX_DEPTH:
+            print(f"Delta chain of '{base}' is at its maximum depth, pushing '{path}' in full")
+            return None
+
+        try:
+            with manifest.open_s3(s3c, base) as reader:
+                checksums = {v["path"]: v["checksum"] for v in reader}
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] not in ["NoSuchKey", "404"]:
+                raise
+            print(f"Snapshot '{base}' has no manifest, pushing '{path}' in full")
+            return None
 
-                print(f"[{i_total}/{n_total}] 'data/{storage}/{path}/{entry}'")
+        return depth, checksums
 
-                with open(os.path.join(level, entry), "rb") as filp:
-                    s3c.upload_fileobj(
-                        filp,
-                        "rpmrepo-storage",
-                        f"data/{storage}/{path}/{entry}",
-                    )
+    def _plan_snapshot(self, target, snapshot_id, snapshot_suffix, base, jnl):
+        path = snapshot_id + snapshot_suffix
 
-    def push_snapshot_s3(self, snapshot_id, snapshot_suffix):
-        """Push snapshot to S3"""
+        #
+        # A delta snapshot only gets refs for paths that differ from its base,
+        # and tombstones for paths that no longer exist. Everything else is
+        # resolved through the base, so the refs of a delta scale with the
+        # changes since the base rather than the size of the repository.
+        #
+
+        base_checksums = {}
+        if base is not None:
+            resolved = self._load_base(path, base)
+            if resolved is not None:
+                target.delta = (base, resolved[0])
+                base_checksums = resolved[1]
+
+        def _add(relpath, checksum):
+            key = f"data/ref/{path}/{relpath}"
+            if base_checksums.get(relpath) == checksum:
+                target.items.append((relpath, key, checksum, 0, ctl_plan.PRESENT, f"in base '{base}'"))
+            elif jnl.contains(key, 0, checksum):
+                target.items.append((relpath, key, checksum, 0, ctl_plan.PRESENT, "already pushed"))
+            else:
+                target.items.append((relpath, key, checksum, 0, ctl_plan.NEW, None))
+
+        with manifest.Reader(self._path_manifest) as reader:
+            for entry in reader:
+                _add(entry["path"], entry["checksum"])
+                base_checksums.pop(entry["path"], None)
+
+        for relpath in sorted(base_checksums):
+            _add(relpath, delta.REMOVED)
+
+    @staticmethod
+    def _schedule(targets):
+        # Order the work of a push: Data is pushed before any refs, and the
+        # blobs of each data target are pushed largest first, so a large blob
+        # does not end up as the last transfer and stretch the tail of the
+        # push, while small blobs fill the gaps of the other workers. Data
+        # targets keep their relative order, since later targets can copy
+        # from earlier ones. Thread markers are written once all targets
+        # are done (see `execute()`).
+        for target in targets:
+            if target.kind == "data":
+                target.items.sort(key=lambda v: v[3], reverse=True)
+
+        return sorted(targets, key=lambda v: v.kind != "data")
+
+    def plan(self, targets):
+        """Plan a push
+
+        Classify all items of the given targets and return the resulting
+        plan, without pushing anything. Each target is a tuple of either
+        `("data", storage, platform_id)` or `("snapshot", snapshot_id,
+        snapshot_suffix)`. Data targets are planned and later pushed in the
+        given order, so data targets can copy any data of a previous data
+        target. The work of all targets is scheduled as part of the plan.
+
+        Snapshot targets can name a base snapshot as additional fourth
+        element, to push the snapshot as delta of this base (see `delta`).
+        If the base has no manifest, or its chain of deltas is already at
+        the maximum depth, the snapshot is pushed in full instead.
+
+        Parameters
+        ----------
+        targets
+            List of targets to plan.
+        """
 
         assert os.access(os.path.join(self._path_conf, "index.ok"), os.R_OK)
 
-        s3c = boto3.client("s3")
+        # Estimates use the measured rates, but never exceed the caps.
+        throughput, request_rate = self._load_throughput()
+        if throughput is not None and self._max_bandwidth is not None:
+            throughput = min(throughput, self._max_bandwidth)
+        if request_rate is not None and self._max_requests is not None:
+            request_rate = min(request_rate, self._max_requests)
 
-        n_total = 0
-        for _, _, entries in os.walk(self._path_snapshot):
-            for entry in entries:
-                n_total += 1
+        result = ctl_plan.Plan(throughput, request_rate)
 
-        i_total = 0
-        for level, _subdirs, entries in os.walk(self._path_snapshot):
-            levelpath = os.path.relpath(level, self._path_snapshot)
-            if levelpath == ".":
-                path = os.path.join(snapshot_id + snapshot_suffix)
+        for kind, *args in targets:
+            if kind == "data":
+                target = ctl_plan.Target(kind, tuple(args))
+                assert args[0] in STORAGES
+                self._plan_data(target, *args, self._journal)
             else:
-                path = os.path.join(snapshot_id + snapshot_suffix, levelpath)
+                snapshot_id, snapshot_suffix, *base = args
+                target = ctl_plan.Target(kind, (snapshot_id, snapshot_suffix))
+                self._plan_snapshot(target, snapshot_id, snapshot_suffix, base[0] if base else None, self._journal)
+            result.targets.append(target)
 
-            for entry in entries:
-                i_total += 1
+        result.targets = self._schedule(result.targets)
 
-                with open(os.path.join(level, entry), "rb") as filp:
-                    checksum = filp.read().decode()
+        return result
 
-                print(f"[{i_total}/{n_total}] '{path}/{entry}' -> {checksum}")
+    def _execute_data(self, target):
+        storage, platform_id = target.args
+        digests = self._load_digests()
+        profile = target.profile
 
-                s3c.put_object(
-                    Body=b"",
+        print(f"Transfer profile: {profile}")
+        s3c = self._client(self._jobs * profile.part_jobs)
+
+        def _push(item):
+            path, key, checksum, size, cls, note = item
+            if cls == ctl_plan.NEW:
+                self._upload(s3c, path, key, checksum, digests=digests, profile=profile)
+            elif cls == ctl_plan.COPY:
+                self._copy(s3c, note, key, size, profile)
+
+        # Pushed checksums are appended to the record of the content store
+        # through a single handle. It is line-buffered, so every checksum is
+        # recorded as soon as the item was pushed. The shared lock keeps the
+        # index from rewriting the record while it is appended to.
+        with contextlib.ExitStack() as stack:
+            filp_pushed = None
+            if self._path_store is not None and os.path.isdir(os.path.join(self._path_store, platform_id)):
+                stack.enter_context(util.lock_file(os.path.join(self._path_store, platform_id, "pushed.lock")))
+                filp_pushed = stack.enter_context(open(
+                    os.path.join(self._path_store, platform_id, f"pushed-{storage}"),
+                    "a",
+                    buffering=1,
+                    encoding="utf-8",
+                ))
+
+            with self._metrics.phase(f"data-{storage}") as phase, self._count_retries(phase):
+                n_total = len(target.items)
+                for i_total, (item, _) in enumerate(util.map_ordered(_push, target.items, self._jobs), start=1):
+                    _, key, checksum, size, cls, note = item
+
+                    if cls == ctl_plan.NEW:
+                        print(f"[{i_total}/{n_total}] '{key}'")
+                        phase.add(files=1, n_bytes=size)
+                    elif cls == ctl_plan.COPY:
+                        print(f"[{i_total}/{n_total}] '{key}' (copy of '{note}')")
+                    else:
+                        print(f"[{i_total}/{n_total}] '{key}' ({note})")
+
+                    if note != "already pushed":
+                        self._journal.add(key, size, checksum)
+                        if filp_pushed is not None:
+                            filp_pushed.write(checksum + "\n")
+
+        summary = target.summary()
+        print(
+            f"Uploaded {summary[ctl_plan.NEW]['files']} files ({summary[ctl_plan.NEW]['bytes'] / 2**20:.1f} MiB), "
+            f"copied {summary[ctl_plan.COPY]['files']} files ({summary[ctl_plan.COPY]['bytes'] / 2**20:.1f} MiB), "
+            f"skipped {summary[ctl_plan.PRESENT]['files']} files ({summary[ctl_plan.PRESENT]['bytes'] / 2**20:.1f} MiB)"
+        )
+
+    def _execute_snapshot(self, target):
+        snapshot_id, snapshot_suffix = target.args
+        path = snapshot_id + snapshot_suffix
+        s3c = self._client()
+
+        def _push(item):
+            if item[4] != ctl_plan.NEW:
+                return
+            if item[2] == delta.REMOVED:
+                metadata = {"rpmrepo-removed": "1"}
+            else:
+                metadata = {"rpmrepo-checksum": item[2]}
+            s3c.put_object(Body=b"", Bucket="rpmrepo-storage", Key=item[1], Metadata=metadata)
+
+        with self._metrics.phase("snapshot") as phase, self._count_retries(phase):
+            n_total = len(target.items)
+            for i_total, (item, _) in enumerate(util.map_ordered(_push, target.items, self._jobs), start=1):
+                if item[4] != ctl_plan.NEW:
+                    print(f"[{i_total}/{n_total}] '{path}/{item[0]}' -> {item[2]} ({item[5]})")
+                    continue
+
+                print(f"[{i_total}/{n_total}] '{path}/{item[0]}' -> {item[2]}")
+                phase.add(files=1)
+                self._journal.add(item[1], 0, item[2])
+
+    def execute(self, push_plan):
+        """Execute a push plan
+
+        Push all targets of a plan created by `plan()`, in order.
+
+        Parameters
+        ----------
+        push_plan
+            Plan to execute.
+        """
+
+        self._journal.start()
+
+        # Delta snapshots record their base before their refs are pushed.
+        # Otherwise, direct requests to the snapshot would not resolve any
+        # inherited path until the push completed. Full snapshots drop any
+        # record a previous push of the same snapshot might have left, but
+        # only once all their refs are in place.
+        for target in push_plan.targets:
+            if target.kind == "data":
+                self._execute_data(target)
+            elif target.delta is not None:
+                delta.store_s3(self._client(), target.args[0] + target.args[1], *target.delta)
+                self._execute_snapshot(target)
+            else:
+                self._execute_snapshot(target)
+                delta.delete_s3(self._client(), target.args[0] + target.args[1])
+
+        # The manifest of each snapshot is stored alongside its refs, so the
+        # snapshot can be resolved with a single request. The refs and
+        # manifests are pushed first, but the thread markers are only written
+        # once everything else is in place, so a snapshot is never visible
+        # partially.
+        snapshots = [v.args for v in push_plan.targets if v.kind == "snapshot"]
+
+        for snapshot_id, snapshot_suffix in snapshots:
+            with open(self._path_manifest, "rb") as filp:
+                self._client().put_object(
+                    Body=filp,
                     Bucket="rpmrepo-storage",
-                    Key=f"data/ref/{path}/{entry}",
-                    Metadata={"rpmrepo-checksum": checksum},
+                    Key=manifest.key_s3(snapshot_id + snapshot_suffix),
                 )
 
-        s3c.put_object(
-            Body=b"",
-            Bucket="rpmrepo-storage",
-            Key=f"data/thread/{snapshot_id}/{snapshot_id}{snapshot_suffix}",
-        )
+        for snapshot_id, snapshot_suffix in snapshots:
+            self._client().put_object(
+                Body=b"",
+                Bucket="rpmrepo-storage",
+                Key=f"data/thread/{snapshot_id}/{snapshot_id}{snapshot_suffix}",
+            )
+
+        # Once a snapshot is visible, record the fingerprint of its
+        # repository, so later runs can tell whether it changed since.
+        if snapshots and os.path.exists(self._path_repomd):
+            with open(self._path_repomd, "rb") as filp:
+                content = filp.read()
+            for snapshot_id, snapshot_suffix in snapshots:
+                fingerprint.store_s3(
+                    self._client(),
+                    snapshot_id,
+                    snapshot_id + snapshot_suffix,
+                    fingerprint.compute(content),
+                )
+
+    def push_file(self, storage, platform_id, path, checksum, parts=None):
+        """Push a single data file
+
+        Upload a single data file right away, unless the push journal
+        records it as uploaded already. This is used to stream files into
+        remote storage while the repository is still being pulled, and can
+        be called concurrently from multiple threads.
+        Returns the number of bytes uploaded.
+
+        Parameters
+        ----------
+        storage
+            Storage target to push to.
+        platform_id
+            Platform of the data.
+        path
+            Path to the file to push.
+        checksum
+            The sha256 checksum of the file, in the form `sha256-<hex>`.
+        parts
+            The part digests of the file as calculated by `digest`, or `None`.
+        """
+
+        key = f"data/{storage}/{platform_id}/{checksum}"
+        size = os.stat(path).st_size
+        profile = self._profile or transfer.Profile()
+
+        with self._lock:
+            if self._journal.contains(key, size, checksum):
+                return 0
+            s3c = self._client(self._jobs * profile.part_jobs)
+
+        digests = {}
+        if parts is not None:
+            digests[checksum] = {"part-size": digest.PART_SIZE, "parts": parts}
+        self._upload(s3c, path, key, checksum, digests=digests, profile=profile)
+
+        with self._lock:
+            self._journal.add(key, size, checksum)
+
+        return size
+
+    def push_data_s3(self, storage, platform_id):
+        """Push data to S3"""
+
+        self.execute(self.plan([("data", storage, platform_id)]))
+
+    def push_snapshot_s3(self, snapshot_id, snapshot_suffix, base=None):
+        """Push snapshot to S3
+
+        If `base` is given, the snapshot is pushed as delta of this snapshot.
+        """
+
+        if base is None:
+            self.execute(self.plan([("snapshot", snapshot_id, snapshot_suffix)]))
+        else:
+            self.execute(self.plan([("snapshot", snapshot_id, snapshot_suffix, base)]))
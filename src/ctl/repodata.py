@@ -0,0 +1,113 @@
+"""rpmrepo - RPM Repository Metadata
+
+This module provides streaming parsers for the metadata of RPM repositories,
+in particular `repodata/repomd.xml` and the package list in the `primary`
+metadata file it refers to.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import bz2
+import gzip
+import lzma
+import xml.etree.ElementTree
+
+
+NS_COMMON = "{http://linux.duke.edu/metadata/common}"
+NS_REPO = "{http://linux.duke.edu/metadata/repo}"
+
+
+def open_compressed(path):
+    """Open a possibly compressed metadata file
+
+    Open the file at the given path for reading and transparently decompress
+    it based on its file-name suffix. The returned stream yields the
+    uncompressed content. `.zst` requires the optional `zstandard` module,
+    an `ImportError` is raised if it is not available.
+
+    Parameters
+    ----------
+    path
+        Path to the metadata file to open.
+    """
+
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".zst"):
+        import zstandard # pylint: disable=import-error,import-outside-toplevel
+        return zstandard.open(path, "rb")
+    return open(path, "rb") # pylint: disable=consider-using-with
+
+
+def parse_repomd(filp):
+    """Parse `repomd.xml`
+
+    Parse the root metadata file of an RPM repository and return a list with
+    an entry for each metadata file it refers to. Each entry is a dictionary
+    with the keys `type`, `href`, `checksum` (in the form `<type>-<hex>`),
+    and `size` (or `None`, if not specified).
+    Additionally, the `revision` of the metadata is returned.
+
+    Parameters
+    ----------
+    filp
+        Readable binary stream of the `repomd.xml` file.
+    """
+
+    root = xml.etree.ElementTree.parse(filp).getroot()
+
+    revision = root.findtext(f"{NS_REPO}revision")
+
+    entries = []
+    for data in root.iter(f"{NS_REPO}data"):
+        location = data.find(f"{NS_REPO}location")
+        checksum = data.find(f"{NS_REPO}checksum")
+        size = data.findtext(f"{NS_REPO}size")
+
+        entries.append({
+            "type": data.get("type"),
+            "href": location.get("href"),
+            "checksum": f"{checksum.get('type')}-{checksum.text.strip()}",
+            "size": int(size) if size else None,
+        })
+
+    return revision, entries
+
+
+def iter_packages(filp):
+    """Iterate packages of `primary.xml`
+
+    Stream-parse the uncompressed `primary` metadata of an RPM repository
+    and yield a dictionary for each package. Each dictionary has the keys
+    `href`, `checksum` (in the form `<type>-<hex>`), and `size`. Parsed
+    elements are dropped right away, so memory usage does not grow with the
+    number of packages.
+
+    Parameters
+    ----------
+    filp
+        Readable binary stream of the uncompressed `primary.xml` content.
+    """
+
+    root = None
+    for event, element in xml.etree.ElementTree.iterparse(filp, events=("start", "end")):
+        if root is None:
+            root = element
+        if event != "end" or element.tag != f"{NS_COMMON}package":
+            continue
+
+        checksum = element.find(f"{NS_COMMON}checksum")
+        location = element.find(f"{NS_COMMON}location")
+        size = element.find(f"{NS_COMMON}size")
+
+        yield {
+            "href": location.get("href"),
+            "checksum": f"{checksum.get('type')}-{checksum.text.strip()}",
+            "size": int(size.get("package")),
+        }
+
+        root.clear()
@@ -0,0 +1,135 @@
+"""rpmrepo - Reuse Unchanged RPM Repository Snapshot
+
+This module creates a snapshot of an RPM repository that did not change since
+its last snapshot, without pulling the repository. Only `repomd.xml` is
+fetched from upstream and compared against the fingerprint recorded when the
+last snapshot of the same snapshot ID was pushed. If it matches, the new
+snapshot is created from the manifest of the last snapshot: its refs all
+point to data that is already stored, so nothing but the refs, the manifest,
+and the thread marker are written.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import contextlib
+import errno
+import io
+import os
+import urllib.parse
+
+import boto3
+import urllib3
+
+from . import digest, fingerprint, manifest, push, util
+from . import metrics as ctl_metrics
+
+
+# pylint: disable=too-many-instance-attributes
+class Reuse(contextlib.AbstractContextManager):
+    """Reuse unchanged RPM repository snapshot"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+            self,
+            cache,
+            baseurl,
+            *,
+            snapshot_id,
+            snapshot_suffix,
+            store=None,
+            jobs=None,
+            delta=False,
+            metrics=None,
+    ):
+        self._baseurl = baseurl
+        self._cache = cache
+        self._delta = delta
+        self._jobs = jobs
+        self._metrics = metrics or ctl_metrics.Metrics("reuse")
+        self._snapshot_id = snapshot_id
+        self._snapshot_suffix = snapshot_suffix
+        self._store = store
+        self._path_index_ok = os.path.join(cache, "conf/index.ok")
+        self._path_manifest = os.path.join(cache, "index/manifest.jsonl.gz")
+        self._path_repomd = os.path.join(cache, "repo/repodata/repomd.xml")
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        pass
+
+    def _fetch_repomd(self):
+        http = urllib3.PoolManager(timeout=60.0)
+        url = urllib.parse.urljoin(self._baseurl.rstrip("/") + "/", "repodata/repomd.xml")
+        reply = http.request("GET", url)
+        if reply.status != 200:
+            raise RuntimeError(f"Failed to fetch 'repodata/repomd.xml' with status '{reply.status}'")
+        return reply.data
+
+    @staticmethod
+    def _write(path, stream):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with util.open_tmpfile(os.path.dirname(path), mode=0o644) as ctx:
+            for block in iter(lambda: stream.read(digest.BUFFER_SIZE), b""):
+                ctx["stream"].write(block)
+            ctx["name"] = os.path.basename(path)
+            ctx["replace"] = True
+
+    def reuse(self):
+        """Run operation
+
+        Returns `True` if the snapshot was created from the last snapshot, or
+        `False` if the repository changed since (or was never snapshotted),
+        in which case nothing was written.
+        """
+
+        s3c = boto3.client("s3")
+
+        with self._metrics.phase("check") as phase:
+            content = self._fetch_repomd()
+            current = fingerprint.compute(content)
+            previous = fingerprint.load_s3(s3c, self._snapshot_id)
+            phase.add(files=1, n_bytes=len(content))
+
+        if previous is None:
+            print(f"No previous snapshot of '{self._snapshot_id}' recorded")
+            return False
+        if (previous["repomd"], previous["revision"]) != (current["repomd"], current["revision"]):
+            print(f"Repository changed since snapshot '{previous['snapshot']}'")
+            return False
+
+        print(f"Repository unchanged since snapshot '{previous['snapshot']}', reusing it")
+
+        #
+        # Stage the repository metadata and the manifest of the previous
+        # snapshot in the local cache, as if the repository was pulled and
+        # indexed, and push the new snapshot from there. Every ref points to
+        # data that is already stored, so no data is pushed at all. As a
+        # delta of the previous snapshot, not even a single ref is pushed.
+        #
+
+        with util.suppress_oserror(errno.ENOENT):
+            os.unlink(self._path_index_ok)
+
+        with self._metrics.phase("manifest") as phase:
+            self._write(self._path_repomd, io.BytesIO(content))
+            reply = s3c.get_object(Bucket="rpmrepo-storage", Key=manifest.key_s3(previous["snapshot"]))
+            self._write(self._path_manifest, reply["Body"])
+            phase.add(files=2, n_bytes=len(content) + reply["ContentLength"])
+
+        os.makedirs(os.path.dirname(self._path_index_ok), exist_ok=True)
+        with open(self._path_index_ok, "wb"):
+            pass
+
+        target = ("snapshot", self._snapshot_id, self._snapshot_suffix)
+        if self._delta:
+            target += (previous["snapshot"],)
+
+        with push.Push(
+                self._cache,
+                store=self._store,
+                jobs=self._jobs,
+                run=self._snapshot_id + self._snapshot_suffix,
+                metrics=self._metrics,
+        ) as cmd:
+            cmd.execute(cmd.plan([target]))
+
+        return True
@@ -0,0 +1,150 @@
+"""rpmrepo - Stream RPM Repository Snapshot
+
+This module creates a snapshot of an RPM repository in a single pass, rather
+than pulling, indexing, and pushing the entire repository one after another.
+Packages are pushed to remote storage right after they were downloaded, and
+are then evicted from local disk, so the local disk usage is bounded by a
+configurable budget rather than the size of the repository. Only the
+repository metadata and the index stay local until the snapshot is complete.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import contextlib
+
+import boto3
+
+from . import fingerprint, index, pull, push, reuse
+from . import metrics as ctl_metrics
+
+
+# pylint: disable=too-many-instance-attributes
+class Snapshot(contextlib.AbstractContextManager):
+    """Stream RPM repository snapshot"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+            self,
+            cache,
+            platform_id,
+            baseurl,
+            *,
+            storage,
+            snapshot_id,
+            snapshot_suffix,
+            store=None,
+            jobs=None,
+            list_remote=True,
+            disk_budget=None,
+            skip_unchanged=False,
+            delta=False,
+            mirrors=None,
+            reset_journal=False,
+            metrics=None,
+    ):
+        self._baseurl = baseurl
+        self._cache = cache
+        self._delta = delta
+        self._disk_budget = disk_budget
+        self._jobs = jobs
+        self._list_remote = list_remote
+        self._metrics = metrics or ctl_metrics.Metrics("snapshot")
+        self._mirrors = mirrors
+        self._platform_id = platform_id
+        self._reset_journal = reset_journal
+        self._skip_unchanged = skip_unchanged
+        self._snapshot_id = snapshot_id
+        self._snapshot_suffix = snapshot_suffix
+        self._storage = storage
+        self._store = store
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        pass
+
+    def snapshot(self):
+        """Run operation"""
+
+        #
+        # If requested, check whether the repository changed since the last
+        # snapshot of this snapshot ID first, and if not, reuse that snapshot
+        # rather than pulling anything.
+        #
+
+        if self._skip_unchanged:
+            with reuse.Reuse(
+                    self._cache,
+                    self._baseurl,
+                    snapshot_id=self._snapshot_id,
+                    snapshot_suffix=self._snapshot_suffix,
+                    store=self._store,
+                    jobs=self._jobs,
+                    delta=self._delta,
+                    metrics=self._metrics,
+            ) as cmd_reuse:
+                if cmd_reuse.reuse():
+                    return
+
+        with push.Push(
+                self._cache,
+                store=self._store,
+                jobs=self._jobs,
+                list_remote=self._list_remote,
+                run=self._snapshot_id + self._snapshot_suffix,
+                reset_journal=self._reset_journal,
+                metrics=self._metrics,
+        ) as cmd_push:
+
+            #
+            # Pull the repository and push every package as soon as it was
+            # downloaded. Packages already stored remotely are not pulled at
+            # all, and pushed packages are evicted right away. Both are
+            # recorded as stored, so the index and the refs still cover them.
+            #
+
+            with self._metrics.phase(f"stream-{self._storage}") as phase:
+                def _sink(path, checksum, parts):
+                    n_bytes = cmd_push.push_file(self._storage, self._platform_id, path, checksum, parts)
+                    if n_bytes > 0:
+                        phase.add(files=1, n_bytes=n_bytes)
+
+                with pull.Pull(
+                        self._cache,
+                        self._platform_id,
+                        self._baseurl,
+                        jobs=self._jobs,
+                        skip_stored=self._storage,
+                        store=self._store,
+                        list_remote=self._list_remote,
+                        sink=_sink,
+                        disk_budget=self._disk_budget,
+                        mirrors=self._mirrors,
+                        metrics=self._metrics,
+                ) as cmd_pull:
+                    retries = cmd_push.retries
+                    try:
+                        cmd_pull.pull()
+                    finally:
+                        phase.add(retries=cmd_push.retries - retries)
+
+            #
+            # Index what is left locally. The pull recorded the checksums of
+            # all files it downloaded, so this does not read any file again.
+            #
+
+            with index.Index(self._cache, jobs=self._jobs, metrics=self._metrics) as cmd_index:
+                cmd_index.index()
+
+            #
+            # Push the repository metadata, then all refs and the manifest,
+            # and lastly the thread marker that makes the snapshot visible.
+            # If requested, the snapshot is pushed as delta of the last
+            # snapshot of its snapshot ID, as recorded by its fingerprint.
+            #
+
+            target = ("snapshot", self._snapshot_id, self._snapshot_suffix)
+            if self._delta:
+                previous = fingerprint.load_s3(boto3.client("s3"), self._snapshot_id)
+                if previous is not None:
+                    target += (previous["snapshot"],)
+
+            cmd_push.execute(cmd_push.plan([("data", self._storage, self._platform_id), target]))
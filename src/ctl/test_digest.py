@@ -0,0 +1,49 @@
+"""rpmrepo - File Digest Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import base64
+import hashlib
+import random
+
+import pytest
+
+from . import digest
+
+
+P = digest.PART_SIZE
+
+
+def _expected(content):
+    parts = [
+        base64.b64encode(hashlib.sha256(content[i:i + P]).digest()).decode()
+        for i in range(0, len(content), P)
+    ]
+    return "sha256-" + hashlib.sha256(content).hexdigest(), parts
+
+
+@pytest.mark.parametrize("size", [0, 1, P - 1, P, P + 1, 2 * P + 3])
+def test_digest_path(tmp_path, size):
+    """Part digests match the digests of the slices of the file"""
+
+    content = random.Random(size).randbytes(size)
+    path = str(tmp_path / "file")
+    with open(path, "wb") as filp:
+        filp.write(content)
+
+    assert digest.digest_path(path, P) == _expected(content)
+    assert digest.digest_path(path) == (_expected(content)[0], None)
+    assert digest.checksum_path(path) == _expected(content)[0]
+
+
+@pytest.mark.parametrize("block", [1000, P - 1, P + 1, 3 * P])
+def test_digest_update(block):
+    """Blocks fed via `update()` may straddle parts"""
+
+    content = random.Random(block).randbytes(2 * P + 1)
+
+    digestproc = digest.Digest(P)
+    for i in range(0, len(content), block):
+        digestproc.update(content[i:i + block])
+
+    assert digestproc.finish() == _expected(content)
@@ -0,0 +1,72 @@
+"""rpmrepo - Repository Fingerprint Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import io
+
+import botocore.exceptions
+
+from . import fingerprint
+
+
+def _repomd(revision, checksum):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<repomd xmlns="http://linux.duke.edu/metadata/repo">\n'
+        f'  <revision>{revision}</revision>\n'
+        '  <data type="primary">\n'
+        f'    <checksum type="sha256">{checksum}</checksum>\n'
+        '    <location href="repodata/primary.xml.gz"/>\n'
+        '  </data>\n'
+        '</repomd>\n'
+    ).encode()
+
+
+class _Client:
+    """In-memory S3 client"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        """Fake `get_object()`"""
+        assert Bucket == "rpmrepo-storage"
+        if Key not in self.objects:
+            raise botocore.exceptions.ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Body, Bucket, Key):
+        """Fake `put_object()`"""
+        assert Bucket == "rpmrepo-storage"
+        self.objects[Key] = Body
+
+
+def test_compute():
+    """Fingerprints are stable, and change with `repomd.xml`"""
+
+    content = _repomd(1700000000, "a" * 64)
+    value = fingerprint.compute(content)
+
+    assert value["revision"] == "1700000000"
+    assert value["repomd"].startswith("sha256-")
+    assert fingerprint.compute(content) == value
+    assert fingerprint.compute(_repomd(1700000000, "a" * 64)) == value
+
+    # Changed metadata changes the fingerprint, even with the same revision.
+    changed = fingerprint.compute(_repomd(1700000000, "b" * 64))
+    assert changed["revision"] == value["revision"]
+    assert changed != value
+    assert fingerprint.compute(_repomd(1700000001, "a" * 64)) != value
+
+
+def test_roundtrip():
+    """Stored fingerprints are loaded with the name of their snapshot"""
+
+    s3c = _Client()
+    assert fingerprint.load_s3(s3c, "el9") is None
+
+    value = fingerprint.compute(_repomd(1700000000, "a" * 64))
+    fingerprint.store_s3(s3c, "el9", "el9-20240101", value)
+
+    assert fingerprint.load_s3(s3c, "el9") == dict(value, snapshot="el9-20240101")
+    assert fingerprint.load_s3(s3c, "el8") is None
@@ -0,0 +1,133 @@
+"""rpmrepo - Repository Index Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import hashlib
+import os
+
+import pytest
+
+from . import index, manifest, util
+from . import metrics as ctl_metrics
+
+
+FILES = {
+    "Packages/a.rpm": b"a" * 100,
+    "Packages/b.rpm": b"b" * 200,
+    "repodata/repomd.xml": b"<repomd/>",
+}
+
+
+def _cache(tmp_path, name="cache"):
+    cache = str(tmp_path / name)
+    for path, content in FILES.items():
+        os.makedirs(os.path.dirname(os.path.join(cache, "repo", path)), exist_ok=True)
+        with open(os.path.join(cache, "repo", path), "wb") as filp:
+            filp.write(content)
+    os.makedirs(os.path.join(cache, "conf"))
+    with open(os.path.join(cache, "conf/repo.ok"), "wb"):
+        pass
+    return cache
+
+
+def _index(cache, store=None):
+    metrics = ctl_metrics.Metrics("index")
+    with index.Index(cache, jobs=2, store=store, platform_id="el9", metrics=metrics) as cmd:
+        cmd.index()
+    with manifest.Reader(os.path.join(cache, "index/manifest.jsonl.gz")) as reader:
+        checksums = {v["path"]: v["checksum"] for v in reader}
+    return next(v for v in metrics.phases if v.name == "hash").files, checksums
+
+
+def _checksum(content):
+    return "sha256-" + hashlib.sha256(content).hexdigest()
+
+
+def test_incremental(tmp_path):
+    """Unchanged files are found in the checksum cache, changed ones hashed"""
+
+    cache = _cache(tmp_path)
+
+    n_hashed, checksums = _index(cache)
+    assert n_hashed == len(FILES)
+    assert checksums == {k: _checksum(v) for k, v in FILES.items()}
+
+    assert _index(cache) == (0, checksums)
+
+    # A new modification time invalidates the cache entry, even if the
+    # content is the same.
+    path = os.path.join(cache, "repo/Packages/a.rpm")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    assert _index(cache) == (1, checksums)
+
+    # So does a new size, even if the modification time is the same.
+    st = os.stat(path)
+    with open(path, "ab") as filp:
+        filp.write(b"a")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    n_hashed, checksums = _index(cache)
+    assert n_hashed == 1
+    assert checksums["Packages/a.rpm"] == _checksum(b"a" * 101)
+    with open(os.path.join(cache, "index/data", _checksum(b"a" * 101)), "rb") as filp:
+        assert filp.read() == b"a" * 101
+
+
+def test_store(tmp_path):
+    """Files found in the content store are replaced with links to it"""
+
+    store = str(tmp_path / "store")
+    cache_a = _cache(tmp_path, "a")
+    cache_b = _cache(tmp_path, "b")
+
+    _index(cache_a, store)
+    _index(cache_b, store)
+
+    for path, content in FILES.items():
+        st_a = os.stat(os.path.join(cache_a, "repo", path))
+        st_b = os.stat(os.path.join(cache_b, "repo", path))
+        st_store = os.stat(os.path.join(store, "el9/data", _checksum(content)))
+        assert st_a.st_ino == st_b.st_ino == st_store.st_ino
+        # The store, and the repository and data directory of each cache.
+        assert st_store.st_nlink == 5
+        assert os.path.samefile(
+            os.path.join(cache_b, "index/data", _checksum(content)),
+            os.path.join(cache_b, "repo", path),
+        )
+
+    # The links are recorded in the checksum cache, so the next run does
+    # not hash the linked files again.
+    assert _index(cache_b, store)[0] == 0
+
+
+def test_prune(tmp_path):
+    """Records of pushed checksums are pruned, unless a push appends to them"""
+
+    store = str(tmp_path / "store")
+    cache = _cache(tmp_path)
+    _index(cache, store)
+
+    path = os.path.join(store, "el9/pushed-public")
+    records = [_checksum(b"gone"), _checksum(FILES["Packages/a.rpm"])]
+    with open(path, "w", encoding="utf-8") as filp:
+        filp.write("".join(v + "\n" for v in records))
+
+    with util.lock_file(os.path.join(store, "el9/pushed.lock")):
+        _index(cache, store)
+    with open(path, "r", encoding="utf-8") as filp:
+        assert filp.read().split() == records
+
+    _index(cache, store)
+    with open(path, "r", encoding="utf-8") as filp:
+        assert filp.read().split() == records[1:]
+
+
+def test_trust_missing(tmp_path):
+    """Trusting the metadata of a repository without metadata fails clearly"""
+
+    cache = _cache(tmp_path)
+    os.unlink(os.path.join(cache, "repo/repodata/repomd.xml"))
+
+    with index.Index(cache, trust_metadata=True) as cmd:
+        with pytest.raises(RuntimeError, match="repomd.xml"):
+            cmd.index()
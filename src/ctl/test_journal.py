@@ -0,0 +1,130 @@
+"""rpmrepo - Push Journal Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import os
+
+from . import journal
+
+
+def _segments(path):
+    return sorted(v for v in os.listdir(path) if v.endswith(".jsonl"))
+
+
+def test_replay(tmp_path):
+    """Checkpointed entries are replayed when the journal is opened again"""
+
+    path = str(tmp_path / "journal")
+
+    with journal.Journal(path, run="snap-1") as jnl:
+        jnl.add("data/public/el9/sha256-a", 1, "sha256-a")
+        jnl.checkpoint()
+        jnl.add("data/ref/snap-1/a.rpm", 0, "sha256-a")
+        assert len(_segments(path)) == 1
+
+    # Pending entries are checkpointed when the journal is closed.
+    assert len(_segments(path)) == 2
+
+    with journal.Journal(path, run="snap-1") as jnl:
+        assert len(jnl) == 2
+        assert jnl.contains("data/public/el9/sha256-a", 1, "sha256-a")
+        assert jnl.contains("data/ref/snap-1/a.rpm", 0, "sha256-a")
+        assert not jnl.contains("data/public/el9/sha256-a", 2, "sha256-a")
+        assert not jnl.contains("data/ref/snap-1/a.rpm", 0, "sha256-b")
+        assert not jnl.contains("data/ref/snap-1/b.rpm", 0, "sha256-b")
+
+
+def test_checkpoint_entries(tmp_path, monkeypatch):
+    """A checkpoint is written once enough entries are pending"""
+
+    monkeypatch.setattr(journal, "CHECKPOINT_ENTRIES", 4)
+    path = str(tmp_path / "journal")
+
+    jnl = journal.Journal(path)
+    for i in range(9):
+        jnl.add(f"key-{i}", i, f"sha256-{i}")
+    assert len(_segments(path)) == 2
+
+    # An interrupted push only loses the entries since the last checkpoint.
+    assert len(journal.Journal(path)) == 8
+
+
+def test_compact(tmp_path, monkeypatch):
+    """Checkpoints compact all segments once enough piled up"""
+
+    monkeypatch.setattr(journal, "COMPACT_SEGMENTS", 4)
+    path = str(tmp_path / "journal")
+
+    with journal.Journal(path) as jnl:
+        for i in range(10):
+            jnl.add("key-0" if i % 2 else f"key-{i}", i, f"sha256-{i}")
+            jnl.checkpoint()
+            assert len(_segments(path)) < 4
+
+    with journal.Journal(path) as jnl:
+        assert len(jnl) == 5
+        assert jnl.contains("key-0", 9, "sha256-9")
+        assert jnl.contains("key-8", 8, "sha256-8")
+
+
+def test_scope(tmp_path):
+    """Journals of other runs are discarded, as are reset journals"""
+
+    path = str(tmp_path / "journal")
+
+    with journal.Journal(path, run="snap-1") as jnl:
+        jnl.add("key", 1, "sha256-a")
+
+    with journal.Journal(path, run="snap-2") as jnl:
+        assert len(jnl) == 0
+        jnl.add("key", 1, "sha256-a")
+
+    assert len(journal.Journal(path, run="snap-2")) == 1
+    assert len(journal.Journal(path, run="snap-2", reset=True)) == 0
+    assert len(journal.Journal(path, run="snap-2")) == 1
+
+    # Segments are only dropped once recording starts.
+    journal.Journal(path, run="snap-2", reset=True).start()
+    assert len(journal.Journal(path, run="snap-2")) == 0
+
+
+def test_open(tmp_path):
+    """Opening a journal leaves it alone, whatever the run"""
+
+    path = str(tmp_path / "journal")
+
+    with journal.Journal(path, run="snap-1") as jnl:
+        jnl.add("key", 1, "sha256-a")
+    segments = _segments(path)
+
+    with journal.Journal(path, run="snap-2", reset=True) as jnl:
+        assert len(jnl) == 0
+    with journal.Journal(path, run="snap-2") as jnl:
+        assert len(jnl) == 0
+
+    # Journals without run use the segments of any run.
+    with journal.Journal(path) as jnl:
+        assert jnl.contains("key", 1, "sha256-a")
+        jnl.add("other", 1, "sha256-b")
+
+    assert _segments(path) == segments + ["00000001.jsonl"]
+    assert len(journal.Journal(path, run="snap-1")) == 2
+
+
+def test_expire(tmp_path, monkeypatch):
+    """Entries older than the maximum age are dropped"""
+
+    path = str(tmp_path / "journal")
+    now = [1000000.0]
+    monkeypatch.setattr(journal.time, "time", lambda: now[0])
+
+    with journal.Journal(path) as jnl:
+        jnl.add("old", 1, "sha256-a")
+    now[0] += journal.MAX_AGE / 2
+    with journal.Journal(path) as jnl:
+        jnl.add("new", 1, "sha256-b")
+    now[0] += journal.MAX_AGE / 2 + 1
+
+    with journal.Journal(path) as jnl:
+        assert not jnl.contains("old", 1, "sha256-a")
+        assert jnl.contains("new", 1, "sha256-b")
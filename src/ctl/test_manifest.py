@@ -0,0 +1,59 @@
+"""rpmrepo - Snapshot Manifest Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import gzip
+import io
+import json
+
+import pytest
+
+from . import manifest
+
+
+ENTRIES = [
+    {"path": "repodata/repomd.xml", "size": 3, "checksum": "sha256-" + "c" * 64},
+    {"path": "Packages/b.rpm", "size": 2, "checksum": "sha256-" + "b" * 64},
+    {"path": "Packages/a.rpm", "size": 1, "checksum": "sha256-" + "a" * 64},
+]
+
+
+@pytest.mark.parametrize("name", ["manifest.jsonl", "manifest.jsonl.gz"])
+def test_roundtrip(tmp_path, name):
+    """Manifests read back all entries, sorted by path"""
+
+    path = str(tmp_path / name)
+    manifest.write(path, iter(ENTRIES))
+
+    with manifest.Reader(path) as reader:
+        assert reader.count == len(ENTRIES)
+        assert list(reader) == sorted(ENTRIES, key=lambda v: v["path"])
+
+
+def test_roundtrip_stream(tmp_path):
+    """Manifests can be read from a stream, as fetched from S3"""
+
+    path = str(tmp_path / "manifest.jsonl.gz")
+    manifest.write(path, ENTRIES)
+
+    with open(path, "rb") as filp:
+        stream = io.BytesIO(filp.read())
+    with manifest.Reader(manifest.key_s3("snap"), fileobj=stream) as reader:
+        assert [v["path"] for v in reader] == sorted(v["path"] for v in ENTRIES)
+    assert stream.closed
+
+
+@pytest.mark.parametrize("content", [
+    b"",
+    b"garbage\n",
+    json.dumps({"rpmrepo-manifest": manifest.VERSION}).encode() + b"\n",
+    json.dumps({"rpmrepo-manifest": manifest.VERSION + 1, "count": 0}).encode() + b"\n",
+])
+def test_invalid_header(content):
+    """Invalid headers raise, and close the stream"""
+
+    for name, data in [("manifest.jsonl", content), ("manifest.jsonl.gz", gzip.compress(content))]:
+        stream = io.BytesIO(data)
+        with pytest.raises(Exception):
+            manifest.Reader(name, fileobj=stream)
+        assert stream.closed
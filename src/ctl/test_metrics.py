@@ -0,0 +1,43 @@
+"""rpmrepo - Runtime Metrics Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+from . import metrics as ctl_metrics
+
+
+def _series(text, name):
+    return [v for v in text.splitlines() if v.startswith(name + "{")]
+
+
+def test_prometheus_repeated():
+    """Phases of the same name are reported as a single series"""
+
+    metrics = ctl_metrics.Metrics("push")
+    for files in [1, 2]:
+        with metrics.phase("data-public") as phase:
+            phase.add(files=files, n_bytes=10 * files, retries=files)
+    with metrics.phase("refs") as phase:
+        phase.add(files=5)
+
+    text = metrics.to_prometheus()
+
+    assert _series(text, "rpmrepo_phase_files") == [
+        'rpmrepo_phase_files{command="push",phase="data-public"} 3',
+        'rpmrepo_phase_files{command="push",phase="refs"} 5',
+    ]
+    assert _series(text, "rpmrepo_phase_bytes")[0].endswith(" 30")
+    assert _series(text, "rpmrepo_phase_retries")[0].endswith(" 3")
+    assert len(_series(text, "rpmrepo_phase_peak_rss_bytes")) == 2
+    assert text.count("# TYPE rpmrepo_phase_files gauge") == 1
+
+
+def test_prometheus_escape():
+    """Label values are escaped"""
+
+    metrics = ctl_metrics.Metrics("pull", labels={"url": 'a\\b"c\nd'})
+    with metrics.phase("fetch"):
+        pass
+
+    assert _series(metrics.to_prometheus(), "rpmrepo_phase_files") == [
+        'rpmrepo_phase_files{command="pull",phase="fetch",url="a\\\\b\\"c\\nd"} 0',
+    ]
@@ -0,0 +1,285 @@
+"""rpmrepo - Pull Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import contextlib
+import hashlib
+import http.server
+import os
+import socket
+import threading
+
+import pytest
+import urllib3
+
+from . import pull
+
+
+CONTENT = bytes(range(256)) * 64
+CHECKSUM = "sha256-" + hashlib.sha256(CONTENT).hexdigest()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serve the content of the server at any path, as configured by the server"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):
+        """Serve a GET request"""
+
+        self.server.ranges.append(self.headers.get("Range"))
+        mode = self.server.mode
+
+        if mode in [404, 503]:
+            self.send_response(mode)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        content = self.server.content
+        start = 0
+        header = self.headers.get("Range")
+        if header and mode != "ignore-range":
+            start = int(header[len("bytes="):].rstrip("-"))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            first = start + 1 if mode == "bad-range" else start
+            self.send_header("Content-Range", f"bytes {first}-{len(content) - 1}/{len(content)}")
+        else:
+            self.send_response(200)
+
+        body = content[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    """Run a local HTTP server"""
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.mode = None
+    server.content = CONTENT
+    server.ranges = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(name="puller")
+def fixture_puller(tmp_path, server):
+    """Create a pull of the local HTTP server"""
+
+    cmd = pull.Pull(str(tmp_path), "el9", f"http://127.0.0.1:{server.server_address[1]}/repo")
+    os.makedirs(os.path.join(tmp_path, "tmp/partial"))
+    os.makedirs(os.path.join(tmp_path, "index/data"))
+    with urllib3.PoolManager(retries=False, timeout=10.0) as pool:
+        yield cmd, pool
+
+
+def _path_partial(tmp_path, href):
+    return os.path.join(tmp_path, "tmp/partial", hashlib.sha256(f"{href}\0{CHECKSUM}".encode()).hexdigest())
+
+
+def test_fetch(puller, server):
+    """Replies are validated against the requested range"""
+
+    cmd, pool = puller
+
+    # pylint: disable=protected-access
+    with contextlib.closing(cmd._fetch(pool, "a.rpm")) as reply:
+        assert reply.status == 200
+        assert reply.read() == CONTENT
+
+    with contextlib.closing(cmd._fetch(pool, "a.rpm", 100)) as reply:
+        assert reply.status == 206
+        assert reply.read() == CONTENT[100:]
+    assert server.ranges == [None, "bytes=100-"]
+
+    # Servers may ignore the range and send the whole file.
+    server.mode = "ignore-range"
+    with contextlib.closing(cmd._fetch(pool, "a.rpm", 100)) as reply:
+        assert reply.status == 200
+
+    server.mode = "bad-range"
+    with pytest.raises(pull.TransientError):
+        cmd._fetch(pool, "a.rpm", 100)
+
+    server.mode = 503
+    with pytest.raises(pull.TransientError):
+        cmd._fetch(pool, "a.rpm")
+
+    server.mode = 404
+    with pytest.raises(RuntimeError) as e:
+        cmd._fetch(pool, "a.rpm")
+    assert not isinstance(e.value, pull.TransientError)
+
+
+@pytest.mark.parametrize("mode", [None, "ignore-range"])
+def test_resume(tmp_path, puller, server, mode):
+    """Partial files of previous attempts are resumed"""
+
+    cmd, pool = puller
+    server.mode = mode
+
+    with open(_path_partial(tmp_path, "Packages/a.rpm"), "wb") as filp:
+        filp.write(CONTENT[:1000])
+
+    # pylint: disable=protected-access
+    n_bytes, checksum, _ = cmd._transfer(pool, "Packages/a.rpm", CHECKSUM, len(CONTENT))
+
+    assert server.ranges == ["bytes=1000-"]
+    assert n_bytes == len(CONTENT) - (1000 if mode is None else 0)
+    assert checksum == CHECKSUM
+    with open(os.path.join(tmp_path, "repo/Packages/a.rpm"), "rb") as filp:
+        assert filp.read() == CONTENT
+    assert not os.path.exists(_path_partial(tmp_path, "Packages/a.rpm"))
+
+
+def test_resume_complete(tmp_path, puller, server):
+    """Complete partial files of unknown size are verified, not fetched again"""
+
+    cmd, pool = puller
+
+    with open(_path_partial(tmp_path, "Packages/a.rpm"), "wb") as filp:
+        filp.write(CONTENT)
+
+    # pylint: disable=protected-access
+    n_bytes, checksum, _ = cmd._transfer(pool, "Packages/a.rpm", CHECKSUM, None)
+
+    assert server.ranges == [f"bytes={len(CONTENT)}-"]
+    assert (n_bytes, checksum) == (0, CHECKSUM)
+    with open(os.path.join(tmp_path, "repo/Packages/a.rpm"), "rb") as filp:
+        assert filp.read() == CONTENT
+
+    # Partial files that do not match are dropped like any other.
+    with open(_path_partial(tmp_path, "Packages/a.rpm"), "wb") as filp:
+        filp.write(b"\xff" * len(CONTENT))
+    with pytest.raises(pull.TransientError):
+        cmd._transfer(pool, "Packages/a.rpm", CHECKSUM, None)
+    assert not os.path.exists(_path_partial(tmp_path, "Packages/a.rpm"))
+
+
+def test_resume_corrupted(tmp_path, puller, server):
+    """Corrupted partial files are dropped, so the next attempt starts over"""
+
+    cmd, pool = puller
+
+    with open(_path_partial(tmp_path, "Packages/a.rpm"), "wb") as filp:
+        filp.write(b"\xff" * 1000)
+
+    # pylint: disable=protected-access
+    with pytest.raises(pull.TransientError):
+        cmd._transfer(pool, "Packages/a.rpm", CHECKSUM, len(CONTENT))
+    assert not os.path.exists(_path_partial(tmp_path, "Packages/a.rpm"))
+
+    cmd._transfer(pool, "Packages/a.rpm", CHECKSUM, len(CONTENT))
+    assert server.ranges == ["bytes=1000-", None]
+    with open(os.path.join(tmp_path, "repo/Packages/a.rpm"), "rb") as filp:
+        assert filp.read() == CONTENT
+
+
+def test_download_cached(tmp_path, puller, server):
+    """Cached files are only skipped if their upstream checksum is unchanged"""
+
+    cmd, pool = puller
+    sha1 = "sha1-" + hashlib.sha1(CONTENT).hexdigest()
+
+    # pylint: disable=protected-access
+    n_bytes, record = cmd._download(pool, "Packages/a.rpm", sha1, len(CONTENT))
+    assert (n_bytes, record[1]) == (len(CONTENT), CHECKSUM)
+    cmd._cached[record[0]] = record[1]
+    cmd._upstream[record[0]] = sha1
+
+    assert cmd._download(pool, "Packages/a.rpm", sha1, len(CONTENT)) == (None, None)
+    assert server.ranges == [None]
+
+    # A changed upstream checksum is not satisfied by the cached sha256.
+    server.content = CONTENT[::-1]
+    sha1 = "sha1-" + hashlib.sha1(server.content).hexdigest()
+    n_bytes, record = cmd._download(pool, "Packages/a.rpm", sha1, len(CONTENT))
+    assert (n_bytes, record[1]) == (len(CONTENT), "sha256-" + hashlib.sha256(server.content).hexdigest())
+    with open(os.path.join(tmp_path, "repo/Packages/a.rpm"), "rb") as filp:
+        assert filp.read() == server.content
+
+
+def test_budget():
+    """Staging bytes beyond the budget waits until enough were evicted"""
+
+    budget = pull.Budget(100)
+    budget.acquire(60)
+
+    staged = threading.Event()
+
+    def _stage():
+        budget.acquire(50)
+        staged.set()
+
+    thread = threading.Thread(target=_stage, daemon=True)
+    thread.start()
+    assert not staged.wait(0.1)
+
+    budget.release(60)
+    assert staged.wait(5)
+    thread.join()
+
+    # Files larger than the budget are admitted once nothing else is staged.
+    budget.release(50)
+    budget.acquire(1000)
+    budget.release(1000)
+
+
+def test_mirrors():
+    """Mirrors are picked by throughput and pending bytes, and can be excluded"""
+
+    mirrors = pull.Mirrors(["a", "b"])
+
+    # Sources are tried early on, even if not measured yet.
+    assert mirrors.acquire(100) == "a"
+    assert mirrors.acquire(100) == "b"
+    mirrors.release("a", 100, 1000, 1.0)
+    mirrors.release("b", 100, 100, 1.0)
+
+    # The faster source is picked until the bytes pending on it take longer
+    # than a download from the slower source.
+    picked = [mirrors.acquire(100) for _ in range(11)]
+    assert picked == ["a"] * 10 + ["b"]
+    for url in picked:
+        mirrors.release(url, 100, 0, 0.0)
+
+    assert mirrors.acquire(100, exclude={"a"}) == "b"
+    assert mirrors.acquire(100, exclude={"a", "b"}) in ["a", "b"]
+
+
+def test_mirrors_failover(tmp_path, puller, server, monkeypatch):
+    """Downloads fail over to other mirrors"""
+
+    _, pool = puller
+    monkeypatch.setattr(pull, "BACKOFF", 0.0)
+
+    # Nothing listens on a port that was just released.
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead = f"http://127.0.0.1:{sock.getsockname()[1]}/repo"
+    live = f"http://127.0.0.1:{server.server_address[1]}/repo"
+
+    cmd = pull.Pull(str(tmp_path), "el9", dead, mirrors=[live])
+    # pylint: disable=protected-access
+    n_bytes, record = cmd._download(pool, "Packages/a.rpm", CHECKSUM, len(CONTENT), mirrored=True)
+
+    assert (n_bytes, record[1]) == (len(CONTENT), CHECKSUM)
+    assert [v[:2] for v in cmd._mirrors.stats()] == [(dead, 0), (live, len(CONTENT))]
+    assert cmd._failures["Packages/a.rpm"]["failures"] == 1
@@ -0,0 +1,174 @@
+"""rpmrepo - Push Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import io
+import json
+import os
+
+import botocore.exceptions
+
+from . import delta, journal, manifest, push
+from . import plan as ctl_plan
+
+
+def _sha(c):
+    return "sha256-" + c * 64
+
+
+BASE = {
+    "Packages/a.rpm": _sha("a"),
+    "Packages/b.rpm": _sha("b"),
+    "Packages/c.rpm": _sha("c"),
+}
+
+CURRENT = {
+    "Packages/a.rpm": _sha("a"),
+    "Packages/b.rpm": _sha("d"),
+    "Packages/e.rpm": _sha("e"),
+}
+
+
+class _Client:
+    """In-memory S3 client, serving delta records and manifests"""
+
+    def __init__(self, tmp_path):
+        self.objects = {}
+        self._tmp_path = tmp_path
+
+    def put_manifest(self, snapshot, checksums):
+        """Store a manifest of the given paths"""
+        path = os.path.join(self._tmp_path, f"{snapshot}.jsonl.gz")
+        manifest.write(path, [{"path": k, "size": 1, "checksum": v} for k, v in checksums.items()])
+        with open(path, "rb") as filp:
+            self.objects[manifest.key_s3(snapshot)] = filp.read()
+
+    def put_delta(self, snapshot, base, depth):
+        """Store a delta record"""
+        self.objects[delta.key_s3(snapshot)] = json.dumps({"base": base, "depth": depth}).encode()
+
+    def get_object(self, Bucket, Key):
+        """Fake `get_object()`"""
+        assert Bucket == "rpmrepo-storage"
+        if Key not in self.objects:
+            raise botocore.exceptions.ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+
+def _cache(tmp_path):
+    cache = str(tmp_path / "cache")
+    os.makedirs(os.path.join(cache, "index"), exist_ok=True)
+    manifest.write(
+        os.path.join(cache, "index/manifest.jsonl.gz"),
+        [{"path": k, "size": 1, "checksum": v} for k, v in CURRENT.items()],
+    )
+    return cache
+
+
+def _plan(tmp_path, s3c, base, jnl=None):
+    cmd = push.Push(_cache(tmp_path))
+    cmd._client = lambda connections=None: s3c  # pylint: disable=protected-access
+    target = ctl_plan.Target("snapshot", ("snap", "-2"))
+    # pylint: disable=protected-access
+    cmd._plan_snapshot(target, "snap", "-2", base, jnl or journal.Journal(str(tmp_path / "journal")))
+    return target
+
+
+def _items(target):
+    return {v[0]: (v[2], v[4], v[5]) for v in target.items}
+
+
+def test_plan_full(tmp_path):
+    """Snapshots without base get a ref for every path"""
+
+    target = _plan(tmp_path, _Client(tmp_path), None)
+
+    assert target.delta is None
+    assert _items(target) == {k: (v, ctl_plan.NEW, None) for k, v in CURRENT.items()}
+    assert all(v[1] == f"data/ref/snap-2/{v[0]}" for v in target.items)
+
+
+def test_plan_delta(tmp_path):
+    """Delta snapshots only get refs for changes, and tombstones"""
+
+    s3c = _Client(tmp_path)
+    s3c.put_manifest("snap-1", BASE)
+
+    target = _plan(tmp_path, s3c, "snap-1")
+
+    assert target.delta == ("snap-1", 1)
+    assert _items(target) == {
+        "Packages/a.rpm": (_sha("a"), ctl_plan.PRESENT, "in base 'snap-1'"),
+        "Packages/b.rpm": (_sha("d"), ctl_plan.NEW, None),
+        "Packages/c.rpm": (delta.REMOVED, ctl_plan.NEW, None),
+        "Packages/e.rpm": (_sha("e"), ctl_plan.NEW, None),
+    }
+
+
+def test_plan_delta_journal(tmp_path):
+    """Refs and tombstones recorded in the journal are not pushed again"""
+
+    s3c = _Client(tmp_path)
+    s3c.put_manifest("snap-1", BASE)
+    jnl = journal.Journal(str(tmp_path / "journal"))
+    jnl.add("data/ref/snap-2/Packages/b.rpm", 0, _sha("d"))
+    jnl.add("data/ref/snap-2/Packages/c.rpm", 0, delta.REMOVED)
+
+    items = _items(_plan(tmp_path, s3c, "snap-1", jnl))
+
+    assert items["Packages/b.rpm"] == (_sha("d"), ctl_plan.PRESENT, "already pushed")
+    assert items["Packages/c.rpm"] == (delta.REMOVED, ctl_plan.PRESENT, "already pushed")
+    assert items["Packages/e.rpm"] == (_sha("e"), ctl_plan.NEW, None)
+
+
+def test_plan_delta_depth(tmp_path):
+    """Deltas extend the chain of their base, up to the maximum depth"""
+
+    s3c = _Client(tmp_path)
+    s3c.put_manifest("snap-1", BASE)
+
+    s3c.put_delta("snap-1", "snap-0", delta.MAX_DEPTH - 1)
+    assert _plan(tmp_path, s3c, "snap-1").delta == ("snap-1", delta.MAX_DEPTH)
+
+    s3c.put_delta("snap-1", "snap-0", delta.MAX_DEPTH)
+    target = _plan(tmp_path, s3c, "snap-1")
+    assert target.delta is None
+    assert _items(target) == {k: (v, ctl_plan.NEW, None) for k, v in CURRENT.items()}
+
+
+def test_plan_delta_fallback(tmp_path):
+    """Snapshots are pushed in full if their base cannot be used"""
+
+    s3c = _Client(tmp_path)
+
+    # The base has no manifest.
+    target = _plan(tmp_path, s3c, "snap-1")
+    assert target.delta is None
+    assert len(target.items) == len(CURRENT)
+
+    # The base is the snapshot itself.
+    s3c.put_manifest("snap-2", BASE)
+    target = _plan(tmp_path, s3c, "snap-2")
+    assert target.delta is None
+    assert len(target.items) == len(CURRENT)
+
+
+def test_plan_journal_kept(tmp_path):
+    """Planning leaves the journal of other runs alone, even if reset"""
+
+    cache = _cache(tmp_path)
+    os.makedirs(os.path.join(cache, "conf"))
+    with open(os.path.join(cache, "conf/index.ok"), "wb"):
+        pass
+    path = os.path.join(cache, "conf/push-journal")
+    with journal.Journal(path, run="snap-1") as jnl:
+        jnl.add("data/ref/snap-1/Packages/a.rpm", 0, _sha("a"))
+    segments = sorted(os.listdir(path))
+
+    for reset in [False, True]:
+        with push.Push(cache, run="snap-2", reset_journal=reset) as cmd:
+            cmd._client = lambda connections=None: _Client(tmp_path)  # pylint: disable=protected-access
+            cmd.plan([("snapshot", "snap", "-2")])
+
+    assert sorted(os.listdir(path)) == segments
+    assert len(journal.Journal(path, run="snap-1")) == 1
@@ -0,0 +1,114 @@
+"""rpmrepo - Transfer Profile Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import io
+
+import pytest
+
+from . import digest, transfer
+
+
+M = 2**20
+
+
+def test_parse_size():
+    """Sizes accept binary suffixes"""
+
+    assert transfer.parse_size("17") == 17
+    assert transfer.parse_size("64K") == 64 * 2**10
+    assert transfer.parse_size("64M") == 64 * M
+    assert transfer.parse_size("64MiB") == 64 * M
+    assert transfer.parse_size("2g") == 2 * 2**30
+
+
+def test_token_bucket(monkeypatch):
+    """Token buckets go into debt, which later callers wait for"""
+
+    now = [0.0]
+    sleeps = []
+    monkeypatch.setattr(transfer.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(transfer.time, "sleep", sleeps.append)
+
+    bucket = transfer.TokenBucket(10)
+
+    bucket.acquire(5)
+    assert not sleeps
+
+    bucket.acquire(10)
+    assert sleeps == [0.5]
+
+    # The debt is paid off over time, and the bucket never holds more
+    # than its burst.
+    now[0] += 1.0
+    bucket.acquire(5)
+    assert sleeps == [0.5]
+
+    now[0] += 100.0
+    bucket.acquire(20)
+    assert sleeps == [0.5, 1.0]
+
+
+def test_throttled_reader():
+    """Throttled readers charge every byte read, including re-reads"""
+
+    class _Bucket:
+        def __init__(self):
+            self.taken = []
+
+        def acquire(self, n=1):
+            """Record taken tokens"""
+            self.taken.append(n)
+
+    bucket = _Bucket()
+    reader = transfer.ThrottledReader(io.BytesIO(b"x" * 10), bucket)
+
+    assert reader.read(4) == b"xxxx"
+    assert reader.read() == b"x" * 6
+    assert reader.read() == b""
+    assert bucket.taken == [4, 6]
+
+    reader.seek(0)
+    assert reader.tell() == 0
+    buffer = bytearray(8)
+    assert reader.readinto(buffer) == 8
+    assert bucket.taken == [4, 6, 8]
+
+
+def test_profile_parse():
+    """Profiles are parsed from key-value pairs"""
+
+    profile = transfer.Profile.parse("threshold=64M,part-size=16M,part-jobs=4")
+    assert (profile.threshold, profile.part_size, profile.part_jobs) == (64 * M, 16 * M, 4)
+    assert str(profile) == "threshold=64M,part-size=16M,part-jobs=4"
+
+    # The threshold follows the part size, unless given.
+    profile = transfer.Profile.parse("part-size=32M")
+    assert (profile.threshold, profile.part_size, profile.part_jobs) == (32 * M, 32 * M, 1)
+
+    with pytest.raises(ValueError):
+        transfer.Profile.parse("part-count=4")
+
+
+def test_profile_auto():
+    """Profiles are derived from the file sizes and the throughput"""
+
+    profile = transfer.Profile.auto([], 4)
+    assert (profile.threshold, profile.part_size, profile.part_jobs) == (digest.PART_SIZE, digest.PART_SIZE, 1)
+
+    # Without measurements, the largest tenth of the files is split, which
+    # is none of them here.
+    sizes = [M] * 9 + [100 * M]
+    profile = transfer.Profile.auto(sizes, 4)
+    assert (profile.threshold, profile.part_size, profile.part_jobs) == (104 * M, 8 * M, 1)
+
+    # With a throughput of 8MiB/s over 4 workers, each worker uploads 8MiB
+    # within the target time, so the large file is split and gets all
+    # workers.
+    profile = transfer.Profile.auto(sizes, 4, throughput=8 * M)
+    assert (profile.threshold, profile.part_size, profile.part_jobs) == (8 * M, 8 * M, 4)
+
+    # Files beyond the part limit of S3 get larger parts, and files beyond
+    # the single-request limit are always split.
+    profile = transfer.Profile.auto([100 * 2**30], 4)
+    assert (profile.threshold, profile.part_size, profile.part_jobs) == (transfer.MAX_PUT_SIZE, 16 * M, 4)
@@ -0,0 +1,81 @@
+"""rpmrepo - Utility Tests"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import threading
+import time
+
+import pytest
+
+from . import util
+
+
+def test_map_ordered_order():
+    """Results are yielded in the order of the items, not of completion"""
+
+    finished = []
+    events = [threading.Event() for _ in range(4)]
+
+    # Every item waits for the one after it, so they finish in reverse.
+    def _fn(i):
+        if i + 1 < len(events):
+            assert events[i + 1].wait(5)
+        finished.append(i)
+        events[i].set()
+        return i * 10
+
+    results = list(util.map_ordered(_fn, range(4), 4))
+
+    assert finished == [3, 2, 1, 0]
+    assert results == [(0, 0), (1, 10), (2, 20), (3, 30)]
+
+
+def test_map_ordered_window():
+    """Items are consumed lazily, even if a slow item holds back results"""
+
+    consumed = []
+
+    def _items():
+        for i in range(1000):
+            consumed.append(i)
+            yield i
+
+    def _fn(i):
+        if i == 0:
+            time.sleep(0.2)
+        return i
+
+    for item, result in util.map_ordered(_fn, _items(), 2):
+        assert item == result
+        assert len(consumed) - item <= 16 * 2
+
+    assert len(consumed) == 1000
+
+
+def test_map_ordered_error():
+    """The first exception propagates, and pending items are cancelled"""
+
+    started = []
+    consumed = []
+
+    def _items():
+        for i in range(100):
+            consumed.append(i)
+            yield i
+
+    def _fn(i):
+        if i == 0:
+            time.sleep(0.05)
+            raise ValueError(f"item {i}")
+        started.append(i)
+        time.sleep(0.1)
+        return i
+
+    with pytest.raises(ValueError, match="item 0"):
+        for _ in util.map_ordered(_fn, _items(), 1):
+            pass
+
+    # Only the item picked up right after the failure ran, all others
+    # were cancelled, or never taken from the iterator.
+    assert started in [[], [1]]
+    assert len(consumed) <= 4
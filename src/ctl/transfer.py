@@ -0,0 +1,240 @@
+"""rpmrepo - Transfer Profiles
+
+This module implements transfer profiles, which describe how data files are
+uploaded to remote storage: the size above which files are uploaded in
+multiple parts, the size of each part, and how many parts of a single file
+are uploaded concurrently.
+
+A profile can either be given explicitly, or be derived from the sizes of
+the files to upload and the throughput measured during a previous push.
+
+Additionally, this module implements token buckets, which are used to cap
+the bandwidth and request rate of all transfers of a push.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import io
+import math
+import threading
+import time
+
+import boto3.s3.transfer
+
+from . import digest
+
+
+MAX_PARTS = 10000
+MAX_PUT_SIZE = 5 * 2**30
+TARGET_SECONDS = 4
+
+_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30}
+
+
+def parse_size(value):
+    """Parse a size
+
+    Parse a size in bytes, optionally with one of the binary suffixes `K`,
+    `M`, or `G` (e.g., `64M` or `64MiB`).
+    """
+
+    value = value.strip().upper().removesuffix("IB").removesuffix("B")
+    if value[-1:] in _UNITS:
+        return int(value[:-1]) * _UNITS[value[-1:]]
+    return int(value)
+
+
+def _format_size(value):
+    for unit in ["G", "M", "K"]:
+        if value % _UNITS[unit] == 0:
+            return f"{value // _UNITS[unit]}{unit}"
+    return str(value)
+
+
+class Profile:
+    """Transfer profile
+
+    Files of up to `threshold` bytes are uploaded with a single request.
+    Larger files are uploaded in parts of `part_size` bytes, with up to
+    `part_jobs` parts of a file in flight at a time.
+    """
+
+    def __init__(self, threshold=digest.PART_SIZE, part_size=digest.PART_SIZE, part_jobs=1):
+        assert part_size >= 5 * 2**20
+        assert part_size <= threshold <= MAX_PUT_SIZE
+        assert part_jobs >= 1
+
+        self.threshold = threshold
+        self.part_size = part_size
+        self.part_jobs = part_jobs
+
+    def __str__(self):
+        return (
+            f"threshold={_format_size(self.threshold)},"
+            f"part-size={_format_size(self.part_size)},"
+            f"part-jobs={self.part_jobs}"
+        )
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse a transfer profile
+
+        Parse a profile given as comma-separated list of `key=value` pairs,
+        with the keys `threshold`, `part-size`, and `part-jobs`. Sizes can
+        use the suffixes `K`, `M`, and `G`. Keys that are not specified use
+        their default.
+
+        Parameters
+        ----------
+        spec
+            Profile specification, e.g., `threshold=64M,part-jobs=4`.
+        """
+
+        args = {}
+        for entry in spec.split(","):
+            key, _, value = entry.partition("=")
+            key = key.strip()
+            if key == "threshold":
+                args["threshold"] = parse_size(value)
+            elif key == "part-size":
+                args["part_size"] = parse_size(value)
+            elif key == "part-jobs":
+                args["part_jobs"] = int(value)
+            else:
+                raise ValueError(f"Unknown transfer profile key '{key}'")
+
+        if "part_size" in args and "threshold" not in args:
+            args["threshold"] = max(args["part_size"], digest.PART_SIZE)
+
+        return cls(**args)
+
+    @classmethod
+    def auto(cls, sizes, jobs, throughput=None):
+        """Derive a transfer profile
+
+        Derive a profile from the sizes of the files to upload, the number of
+        files uploaded concurrently, and optionally the throughput in bytes
+        per second that was measured previously.
+
+        Parts use the part size of the digests calculated during indexing,
+        unless the largest file would exceed the part limit of S3. Files are
+        split if a single worker would need more than `TARGET_SECONDS` to
+        upload them at its share of the measured throughput. Without a
+        measurement, the largest tenth of the files is split. Files beyond
+        the single-request limit of S3 are always split. Lastly, the
+        workers are spread over the split files, so a few large files still
+        keep all connections busy.
+
+        Parameters
+        ----------
+        sizes
+            List of the sizes of all files to upload.
+        jobs
+            Number of files uploaded concurrently.
+        throughput
+            Measured throughput in bytes per second, or `None`.
+        """
+
+        sizes = sorted(sizes)
+        if not sizes:
+            return cls()
+
+        part_size = digest.PART_SIZE
+        while sizes[-1] > part_size * MAX_PARTS:
+            part_size *= 2
+
+        if throughput:
+            threshold = throughput / jobs * TARGET_SECONDS
+        else:
+            threshold = sizes[min(len(sizes) - 1, int(len(sizes) * 0.9))]
+        threshold = min(math.ceil(threshold / part_size), MAX_PUT_SIZE // part_size) * part_size
+        threshold = max(part_size, threshold)
+
+        n_split = sum(1 for v in sizes if v > threshold)
+        part_jobs = 1
+        if n_split > 0:
+            part_jobs = max(1, min(jobs // min(n_split, jobs), math.ceil(sizes[-1] / part_size)))
+
+        return cls(threshold=threshold, part_size=part_size, part_jobs=part_jobs)
+
+    def transfer_config(self):
+        """Return the equivalent boto3 transfer configuration"""
+
+        return boto3.s3.transfer.TransferConfig(
+            max_concurrency=self.part_jobs,
+            multipart_chunksize=self.part_size,
+            multipart_threshold=self.threshold,
+        )
+
+
+class TokenBucket:
+    """Token bucket
+
+    Tokens are refilled at `rate` tokens per second, up to `burst` tokens.
+    Callers take tokens via `acquire()`, which waits until the taken tokens
+    are covered. A caller may take more tokens than the bucket holds, in
+    which case the bucket goes into debt that later callers have to wait
+    for, so the rate holds on average regardless of the size of a request.
+    The bucket can be shared by any number of threads.
+    """
+
+    def __init__(self, rate, burst=None):
+        assert rate > 0
+
+        self._rate = rate
+        self._burst = burst or rate
+        self._lock = threading.Lock()
+        self._tokens = self._burst
+        self._t_refill = time.monotonic()
+
+    def acquire(self, n=1):
+        """Take tokens from the bucket, waiting if required"""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._t_refill) * self._rate)
+            self._t_refill = now
+            self._tokens -= n
+            wait = -self._tokens / self._rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ThrottledReader(io.RawIOBase):
+    """Throttled reader
+
+    Wrap a binary stream, and take a token from `bucket` for every byte read
+    from it. HTTP clients read request bodies in small chunks as they send
+    them, so the bandwidth is charged as it is used, rather than for a whole
+    request up front. Rewinding the stream, as done to retry a request, is
+    passed through, so only the bytes actually sent are charged.
+    """
+
+    def __init__(self, stream, bucket):
+        super().__init__()
+        self._stream = stream
+        self._bucket = bucket
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._stream.seek(offset, whence)
+
+    def tell(self):
+        return self._stream.tell()
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        if data:
+            self._bucket.acquire(len(data))
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
@@ -6,8 +6,12 @@ standard library.
 
 # pylint: disable=invalid-name
 
+import collections
+import concurrent.futures
 import contextlib
 import errno
+import fcntl
+import json
 import os
 
 
@@ -86,3 +90,150 @@ def open_tmpfile(dirpath, mode=0o777):
             os.close(fd)
         if dirfd is not None:
             os.close(dirfd)
+
+
+@contextlib.contextmanager
+def lock_file(path, exclusive=False, blocking=True):
+    """Lock a file
+
+    Open the file at `path`, creating it if needed, and hold a `flock(2)` lock
+    on it for the duration of the context. Shared locks are taken by default,
+    exclusive locks if `exclusive` is set. The context object tells whether
+    the lock was taken, which is always the case unless `blocking` is `False`
+    and a conflicting lock is held.
+
+    Parameters
+    ----------
+    path
+        A path to the file to lock.
+    exclusive
+        Whether to take an exclusive rather than a shared lock.
+    blocking
+        Whether to wait for conflicting locks to be released.
+    """
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, operation)
+            locked = True
+        except BlockingIOError:
+            locked = False
+        yield locked
+    finally:
+        os.close(fd)
+
+
+def map_ordered(fn, items, jobs):
+    """Map a function over items concurrently
+
+    Apply `fn` to all items on a pool of `jobs` threads and yield tuples of
+    each item and its result, in the order of `items`. At most `4 * jobs`
+    items are in flight, and at most `16 * jobs` results are held back at a
+    time, so `items` can be a lazy iterator of any length. A long-running
+    item does not hold back the items after it until that many of their
+    results are pending, they are just yielded once it finished. If `fn`
+    raises an exception, it is propagated and all items that did not start
+    yet are cancelled.
+
+    Parameters
+    ----------
+    fn
+        Function to apply to each item.
+    items
+        Iterable of items.
+    jobs
+        Number of threads to use.
+    """
+
+    window = collections.deque()
+    running = set()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            for item in items:
+                future = executor.submit(fn, item)
+                window.append((item, future))
+                running.add(future)
+
+                if len(running) >= 4 * jobs:
+                    _, running = concurrent.futures.wait(
+                        running,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+
+                # Results are yielded in order, so a long-running item at
+                # the head of the window holds back all results after it.
+                # Bound their number by waiting for the head.
+                if len(window) >= 16 * jobs:
+                    item, future = window.popleft()
+                    yield item, future.result()
+
+                while window and window[0][1].done():
+                    item, future = window.popleft()
+                    yield item, future.result()
+
+            while window:
+                item, future = window.popleft()
+                yield item, future.result()
+        finally:
+            for _, future in window:
+                future.cancel()
+
+
+def checksum_key(st):
+    """Return the checksum-cache key of a file
+
+    Files are identified in the persistent checksum cache via their device,
+    inode, size, and modification time. A file keeps its key as long as its
+    content is not modified, regardless of how many links it has.
+
+    Parameters
+    ----------
+    st
+        Status of the file as returned by `os.stat()`.
+    """
+
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def load_json(path):
+    """Load a JSON file
+
+    Parse and return the JSON file at `path`, or an empty dictionary if the
+    file does not exist.
+
+    Parameters
+    ----------
+    path
+        Path to the file to load.
+    """
+
+    try:
+        with open(path, "r", encoding="utf-8") as filp:
+            return json.load(filp)
+    except FileNotFoundError:
+        return {}
+
+
+def store_json(path, content):
+    """Store a JSON file
+
+    Atomically write `content` as JSON to `path`, replacing any previous
+    file.
+
+    Parameters
+    ----------
+    path
+        Path to the file to write.
+    content
+        JSON-serializable content to write.
+    """
+
+    with open_tmpfile(os.path.dirname(path), mode=0o644) as ctx:
+        ctx["stream"].write(json.dumps(content, sort_keys=True).encode())
+        ctx["name"] = os.path.basename(path)
+        ctx["replace"] = True
@@ -18,6 +18,7 @@ request path as argument.
 # pylint: disable=too-many-statements
 
 import json
+import time
 import urllib.parse
 
 import botocore
@@ -36,6 +37,19 @@ _storage_urls = {
 
 _documentation_url = "https://osbuild.org/docs/developer-guide/projects/rpmrepo/"
 
+# Maximum number of delta snapshots followed to resolve a path. The snapshot
+# tooling never publishes deeper chains (see `ctl.delta.MAX_DEPTH`).
+_delta_depth_max = 8
+
+# Snapshots this Lambda instance found to have no delta record, so misses on
+# full snapshots do not pay for an extra request every time. Entries map a
+# snapshot to the time they expire, so a snapshot that was looked up before it
+# was pushed is picked up again. Bases are never cached, since flattening
+# drops the record before it drops the tombstones.
+_delta_absent = {}
+_delta_absent_max = 4096
+_delta_absent_ttl = 60.0
+
 
 def _error(code=500):
     """Synthesize API Error Reply"""
@@ -204,15 +218,93 @@ def _query_s3(storage, snapshot, path):
 
         return head.get("Metadata", {}).get("rpmci-checksum")
     else:
+        return _resolve_ref(s3c, snapshot, path)
+
+
+def _is_not_found(e):
+    """Check whether an S3 client error reports a missing object"""
+
+    return e.response.get("Error", {}).get("Code") in ["404", "NoSuchKey"]
+
+
+def _is_denied(e):
+    """Check whether an S3 client error reports denied access"""
+
+    return e.response.get("Error", {}).get("Code") in ["403", "AccessDenied"]
+
+
+def _query_delta(s3c, snapshot):
+    """Query the base of a delta snapshot
+
+    Return the name of the base snapshot of the given snapshot, or `None` if it
+    is a full snapshot. Without anonymous `s3:ListBucket` on `data/delta/`,
+    S3 reports missing records as denied, so denied records are taken for
+    missing as well. Any other failure is raised, so it is never mistaken for
+    a full snapshot. Malformed records raise `ValueError`.
+    """
+
+    now = time.monotonic()
+    if _delta_absent.get(snapshot, now) > now:
+        return None
+
+    try:
+        obj = s3c.get_object(
+            Bucket="rpmrepo-storage",
+            Key=f"data/delta/{snapshot}.json",
+        )
+    except botocore.exceptions.ClientError as e:
+        if not _is_not_found(e) and not _is_denied(e):
+            raise
+        if len(_delta_absent) >= _delta_absent_max:
+            _delta_absent.clear()
+        _delta_absent[snapshot] = now + _delta_absent_ttl
+        return None
+
+    try:
+        base = json.loads(obj["Body"].read())["base"]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed delta record of '{snapshot}'") from e
+    if not isinstance(base, str) or not base:
+        raise ValueError(f"Malformed delta record of '{snapshot}'")
+
+    return base
+
+
+def _resolve_ref(s3c, snapshot, path):
+    """Resolve a path of a snapshot to its checksum
+
+    Delta snapshots only carry refs for paths that changed since their base
+    snapshot, and tombstones for paths that were removed since. Any other path
+    is resolved through the base, as recorded in `data/delta/<snapshot>.json`.
+    Full snapshots have no such record. At most `_delta_depth_max` deltas are
+    followed.
+
+    Returns `None` if the path does not exist. Failures to query S3 raise
+    `botocore.exceptions.ClientError`, malformed delta records `ValueError`.
+    """
+
+    for _ in range(_delta_depth_max + 1):
         try:
             head = s3c.head_object(
                 Bucket="rpmrepo-storage",
                 Key=f"data/ref/{snapshot}/{path}",
             )
-        except botocore.exceptions.ClientError:
+        except botocore.exceptions.ClientError as e:
+            if not _is_not_found(e):
+                raise
+            head = None
+
+        if head is not None:
+            metadata = head.get("Metadata", {})
+            if "rpmrepo-removed" in metadata:
+                return None
+            return metadata.get("rpmrepo-checksum")
+
+        snapshot = _query_delta(s3c, snapshot)
+        if snapshot is None:
             return None
 
-        return head.get("Metadata", {}).get("rpmrepo-checksum")
+    return None
 
 
 def _run_enumerate(arguments):
@@ -281,7 +373,9 @@ def _run_mirror(arguments):
     thus share storage.
 
     The `mirror/*` command looks for the requested file in `data/ref/*`, reads
-    the metadata property and returns a redirect to the requested file.
+    the metadata property and returns a redirect to the requested file. If the
+    snapshot is a delta snapshot without a ref for the file, the file is looked
+    up in its base snapshot instead (see `_resolve_ref()`).
 
     Note that the "symlink-farm" is public. It contains empty files which have
     the checksum of their underlying file as metadata. Hence, they do not
@@ -297,7 +391,10 @@ def _run_mirror(arguments):
     if host is None:
         return _error(406)
 
-    checksum = _query_s3(arguments["storage"], arguments["snapshot"], arguments["path"])
+    try:
+        checksum = _query_s3(arguments["storage"], arguments["snapshot"], arguments["path"])
+    except (botocore.exceptions.ClientError, ValueError):
+        return _error(500)
     if checksum is None:
         return _error(404)
 
@@ -580,6 +677,113 @@ def test_query_s3():
     assert r is None
 
 
+def test_resolve_ref():
+    """Tests for resolving refs through delta snapshots"""
+
+    # This test verifies `_resolve_ref()` against an in-memory bucket, since
+    # our S3 buckets have no fixed delta snapshots for testing.
+
+    class _Body:
+        def __init__(self, data):
+            self._data = data
+
+        def read(self):
+            """Read the body"""
+            return self._data
+
+    class _Client:
+        def __init__(self, objects):
+            self.objects = objects
+            self.requests = 0
+
+        def _lookup(self, key, operation):
+            self.requests += 1
+            value = self.objects.get(key, "404")
+            if isinstance(value, str):
+                raise botocore.exceptions.ClientError({"Error": {"Code": value}}, operation)
+            return value
+
+        def head_object(self, Bucket, Key):
+            """Fake `head_object()`"""
+            assert Bucket == "rpmrepo-storage"
+            return {"Metadata": self._lookup(Key, "HeadObject")}
+
+        def get_object(self, Bucket, Key):
+            """Fake `get_object()`"""
+            assert Bucket == "rpmrepo-storage"
+            return {"Body": _Body(self._lookup(Key, "GetObject"))}
+
+    _delta_absent.clear()
+    s3c = _Client({
+        "data/ref/full/a": {"rpmrepo-checksum": "sha256-a"},
+        "data/ref/full/b": {"rpmrepo-checksum": "sha256-b"},
+        "data/ref/full/c": {"rpmrepo-checksum": "sha256-c"},
+        "data/ref/delta1/b": {"rpmrepo-checksum": "sha256-b1"},
+        "data/ref/delta1/c": {"rpmrepo-removed": "1"},
+        "data/delta/delta1.json": json.dumps({"base": "full", "depth": 1}).encode(),
+        "data/ref/delta2/d": {"rpmrepo-checksum": "sha256-d2"},
+        "data/delta/delta2.json": json.dumps({"base": "delta1", "depth": 2}).encode(),
+    })
+
+    assert _resolve_ref(s3c, "full", "a") == "sha256-a"
+    assert _resolve_ref(s3c, "full", "d") is None
+    assert _resolve_ref(s3c, "delta1", "a") == "sha256-a"
+    assert _resolve_ref(s3c, "delta1", "b") == "sha256-b1"
+    assert _resolve_ref(s3c, "delta1", "c") is None
+    assert _resolve_ref(s3c, "delta2", "a") == "sha256-a"
+    assert _resolve_ref(s3c, "delta2", "b") == "sha256-b1"
+    assert _resolve_ref(s3c, "delta2", "c") is None
+    assert _resolve_ref(s3c, "delta2", "d") == "sha256-d2"
+    assert _resolve_ref(s3c, "invalid", "a") is None
+
+    # Chains deeper than the limit are not followed, even if they loop.
+
+    s3c.objects["data/delta/loop.json"] = json.dumps({"base": "loop", "depth": 1}).encode()
+    s3c.requests = 0
+    assert _resolve_ref(s3c, "loop", "a") is None
+    assert s3c.requests == 2 * (_delta_depth_max + 1)
+
+    # Missing delta records are remembered, so further misses on a full
+    # snapshot only cost the ref lookup.
+
+    s3c.requests = 0
+    assert _resolve_ref(s3c, "full", "e") is None
+    assert s3c.requests == 1
+
+    # Delta records that are denied are taken for missing, since S3 reports
+    # missing objects as denied without list access. Misses on full
+    # snapshots thus stay misses.
+
+    s3c.objects["data/ref/ungranted/a"] = {"rpmrepo-checksum": "sha256-a"}
+    s3c.objects["data/delta/ungranted.json"] = "AccessDenied"
+    assert _resolve_ref(s3c, "ungranted", "a") == "sha256-a"
+    assert _resolve_ref(s3c, "ungranted", "b") is None
+    s3c.requests = 0
+    assert _resolve_ref(s3c, "ungranted", "c") is None
+    assert s3c.requests == 1
+
+    # Other failures are raised rather than taken for a full snapshot, and so
+    # are malformed delta records.
+
+    s3c.objects["data/ref/denied/a"] = "403"
+    s3c.objects["data/delta/throttled.json"] = "SlowDown"
+    s3c.objects["data/delta/garbled.json"] = b"{"
+    s3c.objects["data/delta/baseless.json"] = json.dumps({"depth": 1}).encode()
+
+    for snapshot, exception in [
+        ("denied", botocore.exceptions.ClientError),
+        ("throttled", botocore.exceptions.ClientError),
+        ("garbled", ValueError),
+        ("baseless", ValueError),
+    ]:
+        try:
+            _resolve_ref(s3c, snapshot, "a")
+        except exception:
+            pass
+        else:
+            assert False, snapshot
+
+
 def test_enumerate():
     """Tests for the enumerate command"""
 
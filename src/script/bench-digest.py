@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+"""bench-digest - Benchmark file digests
+
+A simple benchmark that compares the file-digest engine of `ctl.digest` with
+the previous implementation of `ctl.index`, which read files in 4KiB blocks.
+It either generates a set of random files, or hashes an existing directory
+tree (e.g., the `repo` directory of a pulled repository).
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from ctl import digest
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        add_help=True,
+        allow_abbrev=False,
+        argument_default=None,
+        description="File Digest Benchmark",
+        prog="bench-digest.py",
+    )
+    parser.add_argument(
+        "--files",
+        default=256,
+        help="Number of files to generate",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--jobs",
+        default=os.cpu_count() or 1,
+        help="Number of files to hash in parallel",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--path",
+        help="Hash the files of an existing directory rather than generating files",
+        metavar="PATH",
+        type=os.path.abspath,
+    )
+    parser.add_argument(
+        "--size",
+        default=4 * 1024 * 1024,
+        help="Size of each generated file in bytes",
+        metavar="BYTES",
+        type=int,
+    )
+
+    return parser.parse_args()
+
+
+def _legacy_checksum_path(path):
+    # The implementation of `ctl.index` before the digest engine was added.
+    with open(path, "rb") as filp:
+        hashproc = hashlib.sha256()
+        for block in iter(lambda ctx=filp: ctx.read(4096), b''):
+            hashproc.update(block)
+        return "sha256-" + hashproc.hexdigest()
+
+
+def _generate(path, n_files, size):
+    paths = []
+    for i in range(n_files):
+        paths.append(os.path.join(path, f"file-{i}"))
+        with open(paths[-1], "wb") as filp:
+            filp.write(os.urandom(size))
+    return paths
+
+
+def _drop_cache(paths):
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def _run(name, fn, paths, n_bytes, jobs):
+    _drop_cache(paths)
+
+    t_start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(fn, paths))
+    t_total = max(time.monotonic() - t_start, 1e-6)
+
+    print(f"{name:<10} jobs={jobs:<3} {t_total:8.3f}s {n_bytes / 2**20 / t_total:10.1f} MB/s")
+
+    return results
+
+
+def main():
+    """Script Entrypoint"""
+
+    args = _parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-digest-") as tmpdir:
+        if args.path:
+            paths = []
+            for level, _, entries in os.walk(args.path):
+                paths += [os.path.join(level, entry) for entry in entries]
+        else:
+            paths = _generate(tmpdir, args.files, args.size)
+
+        n_bytes = sum(os.stat(path).st_size for path in paths)
+        print(f"Hashing {len(paths)} files ({n_bytes / 2**20:.1f} MiB)")
+
+        for jobs in sorted({1, args.jobs}):
+            legacy = _run("legacy", _legacy_checksum_path, paths, n_bytes, jobs)
+            engine = _run("engine", digest.checksum_path, paths, n_bytes, jobs)
+            assert legacy == engine
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+#!/usr/bin/python3
+"""bench-pipeline - Benchmark the snapshot pipeline
+
+A benchmark suite for the `pull`, `index`, and `push` commands of `ctl`. It
+generates a synthetic RPM repository of configurable shape, serves it from a
+local HTTP server, and pushes to a local stand-in for S3. Each command is run
+in a separate process, and the wall-time, CPU-time, throughput, peak RSS and
+I/O syscall counts of each phase are reported. No network access is needed.
+"""
+
+# pylint: disable=duplicate-code,invalid-name,too-few-public-methods
+
+import argparse
+import contextlib
+import gzip
+import hashlib
+import http.server
+import json
+import math
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+import xml.sax.saxutils
+
+PATH_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        add_help=True,
+        allow_abbrev=False,
+        argument_default=None,
+        description="Snapshot Pipeline Benchmark",
+        prog="bench-pipeline.py",
+    )
+    parser.add_argument(
+        "--depth",
+        default=2,
+        help="Directory depth of packages in the repository",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--duplicates",
+        default=0.1,
+        help="Ratio of packages that duplicate the content of another package",
+        metavar="RATIO",
+        type=float,
+    )
+    parser.add_argument(
+        "--files",
+        default=1000,
+        help="Number of packages in the repository",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--json",
+        help="Write the results as JSON to the given path",
+        metavar="PATH",
+        type=os.path.abspath,
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        help="Seed of the repository generator",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--size-max",
+        default=256 * 1024 * 1024,
+        help="Maximum size of a package in bytes",
+        metavar="BYTES",
+        type=int,
+    )
+    parser.add_argument(
+        "--size-median",
+        default=256 * 1024,
+        help="Median size of a package in bytes",
+        metavar="BYTES",
+        type=int,
+    )
+    parser.add_argument(
+        "--size-sigma",
+        default=1.5,
+        help="Shape of the log-normal package size distribution",
+        metavar="SIGMA",
+        type=float,
+    )
+    parser.add_argument(
+        "--workdir",
+        help="Directory to run the benchmark in (defaults to a temporary directory)",
+        metavar="PATH",
+        type=os.path.abspath,
+    )
+
+    return parser.parse_args()
+
+
+class Repository:
+    """Synthetic RPM Repository
+
+    Generate a repository with random package content, and valid `repomd.xml`
+    and `primary.xml.gz` metadata. The content of a package is not a valid
+    RPM, but none of the benchmarked operations parse packages.
+    """
+
+    def __init__(self, path, args):
+        self.path = path
+        self.n_files = 0
+        self.n_bytes = 0
+        self._args = args
+        self._random = random.Random(args.seed)
+
+    def _size(self):
+        size = self._random.lognormvariate(math.log(self._args.size_median), self._args.size_sigma)
+        return max(1, min(int(size), self._args.size_max))
+
+    def _location(self, i):
+        levels = ["Packages"]
+        for k in range(1, self._args.depth):
+            levels.append(f"d{k}-{self._random.randrange(16):x}")
+        return "/".join(levels + [f"package-{i}.rpm"])
+
+    def _write(self, href, content):
+        path = os.path.join(self.path, href)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as filp:
+            filp.write(content)
+
+        self.n_files += 1
+        self.n_bytes += len(content)
+
+        return hashlib.sha256(content).hexdigest()
+
+    def generate(self):
+        """Generate the repository"""
+
+        packages = []
+        previous = []
+        for i in range(self._args.files):
+            if previous and self._random.random() < self._args.duplicates:
+                content = self._random.choice(previous)
+            else:
+                content = self._random.randbytes(self._size())
+                if len(content) <= 16 * 1024 * 1024:
+                    previous = (previous + [content])[-64:]
+
+            href = self._location(i)
+            checksum = self._write(href, content)
+            packages.append(
+                f'<package type="rpm"><name>package-{i}</name><arch>noarch</arch>'
+                f'<checksum type="sha256" pkgid="YES">{checksum}</checksum>'
+                f'<size package="{len(content)}" installed="0" archive="0"/>'
+                f'<location href="{xml.sax.saxutils.escape(href)}"/></package>'
+            )
+
+        primary = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+            f'xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="{len(packages)}">'
+            + "".join(packages)
+            + "</metadata>\n"
+        ).encode()
+        compressed = gzip.compress(primary, mtime=0)
+        checksum = hashlib.sha256(compressed).hexdigest()
+        href = f"repodata/{checksum}-primary.xml.gz"
+        self._write(href, compressed)
+
+        repomd = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<repomd xmlns="http://linux.duke.edu/metadata/repo" '
+            'xmlns:rpm="http://linux.duke.edu/metadata/rpm">'
+            f"<revision>{self._args.seed}</revision>"
+            '<data type="primary">'
+            f'<checksum type="sha256">{checksum}</checksum>'
+            f'<open-checksum type="sha256">{hashlib.sha256(primary).hexdigest()}</open-checksum>'
+            f'<location href="{href}"/>'
+            f"<timestamp>0</timestamp><size>{len(compressed)}</size><open-size>{len(primary)}</open-size>"
+            "</data></repomd>\n"
+        ).encode()
+        self._write("repodata/repomd.xml", repomd)
+
+
+class _QuietFileHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+class _S3Handler(http.server.BaseHTTPRequestHandler):
+    """Minimal S3 API
+
+    Implements the subset of the S3 REST API used by `ctl` with path-style
+    addressing: object uploads including multipart and server-side copies,
+    object metadata queries, deletion, and listing. Object content is only
+    retained for small objects, since benchmarks never read back data.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+    def _request(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        path = urllib.parse.unquote(url.path).lstrip("/")
+        bucket, _, key = path.partition("/")
+        return bucket, key, query
+
+    def _reply(self, code, body=b"", headers=None):
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length", "0"))
+        content = self.rfile.read(n)
+
+        if "aws-chunked" not in self.headers.get("Content-Encoding", ""):
+            return content
+
+        decoded = []
+        while content:
+            line, _, content = content.partition(b"\r\n")
+            n = int(line.split(b";")[0], 16)
+            if n == 0:
+                break
+            decoded.append(content[:n])
+            content = content[n + 2:]
+        return b"".join(decoded)
+
+    def _copy_source(self):
+        source = urllib.parse.unquote(self.headers["x-amz-copy-source"]).lstrip("/")
+        return self.server.objects.get(source.partition("/")[2].partition("?")[0])
+
+    def _store(self, key, size, content, metadata):
+        etag = f'"{uuid.uuid4().hex}"'
+        self.server.objects[key] = {
+            "content": content if size <= 1024 * 1024 else None,
+            "etag": etag,
+            "metadata": metadata,
+            "size": size,
+        }
+        self.server.n_stored += 1
+        self.server.n_bytes += size
+        return etag
+
+    def do_PUT(self): # pylint: disable=invalid-name
+        """Handle object uploads, part uploads and copies"""
+
+        _, key, query = self._request()
+        content = self._body()
+
+        if "x-amz-copy-source" in self.headers:
+            source = self._copy_source()
+            if source is None:
+                self._reply(404)
+                return
+            if "uploadId" in query:
+                self.server.uploads[query["uploadId"]][int(query["partNumber"])] = source["size"]
+                etag = f'"{uuid.uuid4().hex}"'
+                tag = "CopyPartResult"
+            else:
+                metadata = source["metadata"]
+                if self.headers.get("x-amz-metadata-directive") == "REPLACE":
+                    metadata = self._metadata()
+                etag = self._store(key, source["size"], source["content"], metadata)
+                tag = "CopyObjectResult"
+            self._reply(200, f"<{tag}><ETag>{etag}</ETag></{tag}>".encode())
+        elif "uploadId" in query:
+            self.server.uploads[query["uploadId"]][int(query["partNumber"])] = len(content)
+            self._reply(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+        else:
+            etag = self._store(key, len(content), content, self._metadata())
+            self._reply(200, headers={"ETag": etag})
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """Handle multipart upload creation and completion"""
+
+        bucket, key, query = self._request()
+        self._body()
+
+        if "uploads" in query:
+            upload = uuid.uuid4().hex
+            self.server.uploads[upload] = {}
+            self.server.metadata[upload] = self._metadata()
+            body = (
+                "<InitiateMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{xml.sax.saxutils.escape(key)}</Key>"
+                f"<UploadId>{upload}</UploadId>"
+                "</InitiateMultipartUploadResult>"
+            )
+            self._reply(200, body.encode())
+        elif "uploadId" in query:
+            parts = self.server.uploads.pop(query["uploadId"])
+            etag = self._store(key, sum(parts.values()), None, self.server.metadata.pop(query["uploadId"]))
+            body = (
+                "<CompleteMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{xml.sax.saxutils.escape(key)}</Key><ETag>{etag}</ETag>"
+                "</CompleteMultipartUploadResult>"
+            )
+            self._reply(200, body.encode())
+        else:
+            self._reply(501)
+
+    def do_DELETE(self): # pylint: disable=invalid-name
+        """Handle object deletion and multipart upload abortion"""
+
+        _, key, query = self._request()
+        if "uploadId" in query:
+            self.server.uploads.pop(query["uploadId"], None)
+        else:
+            self.server.objects.pop(key, None)
+        self._reply(204)
+
+    def do_HEAD(self): # pylint: disable=invalid-name
+        """Handle object metadata queries"""
+
+        self.do_GET()
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """Handle object downloads and listings"""
+
+        _, key, query = self._request()
+
+        if not key:
+            self._list(query)
+            return
+
+        entry = self.server.objects.get(key)
+        if entry is None:
+            self._reply(404, b"<Error><Code>NoSuchKey</Code></Error>")
+            return
+
+        headers = {"ETag": entry["etag"]}
+        for k, v in entry["metadata"].items():
+            headers[f"x-amz-meta-{k}"] = v
+
+        if self.command == "HEAD":
+            self.send_response(200)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(entry["size"]))
+            self.end_headers()
+        elif entry["content"] is None:
+            self._reply(501)
+        else:
+            self._reply(200, entry["content"], headers)
+
+    def _metadata(self):
+        return {k[len("x-amz-meta-"):]: v for k, v in self.headers.items() if k.lower().startswith("x-amz-meta-")}
+
+    def _list(self, query):
+        prefix = query.get("prefix", "")
+        start = query.get("continuation-token") or query.get("start-after") or ""
+        limit = min(int(query.get("max-keys", "1000")), 1000)
+
+        keys = sorted(k for k in self.server.objects if k.startswith(prefix) and k > start)
+        truncated = len(keys) > limit
+        keys = keys[:limit]
+
+        contents = "".join(
+            f"<Contents><Key>{xml.sax.saxutils.escape(k)}</Key>"
+            f"<Size>{self.server.objects[k]['size']}</Size>"
+            f"<ETag>{self.server.objects[k]['etag']}</ETag></Contents>"
+            for k in keys
+        )
+        token = ""
+        if truncated:
+            token = f"<NextContinuationToken>{xml.sax.saxutils.escape(keys[-1])}</NextContinuationToken>"
+        body = (
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Prefix>{xml.sax.saxutils.escape(prefix)}</Prefix><KeyCount>{len(keys)}</KeyCount>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{token}{contents}"
+            "</ListBucketResult>"
+        )
+        self._reply(200, body.encode())
+
+
+@contextlib.contextmanager
+def _serve(handler, **kwargs):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    for k, v in kwargs.items():
+        setattr(server, k, v)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _run_ctl():
+    # Entrypoint of the child process of each phase. It runs the `ctl` CLI
+    # in-process and then records its own resource usage.
+    path_result = sys.argv[2]
+    sys.path.insert(0, PATH_SRC)
+
+    # pylint: disable=import-outside-toplevel
+    from ctl import cli
+
+    with contextlib.redirect_stdout(sys.stderr):
+        with cli.Cli(["rpmrepoctl"] + sys.argv[3:]) as ctx:
+            ret = ctx.run()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    result = {
+        "cpu": usage.ru_utime + usage.ru_stime,
+        "rss": usage.ru_maxrss * 1024,
+        "io": {},
+    }
+    with contextlib.suppress(OSError):
+        with open("/proc/self/io", "r", encoding="utf-8") as filp:
+            for line in filp:
+                k, _, v = line.partition(":")
+                result["io"][k] = int(v)
+
+    with open(path_result, "w", encoding="utf-8") as filp:
+        json.dump(result, filp)
+
+    sys.exit(ret)
+
+
+def _phase(name, argv, env, workdir, repo):
+    path_result = os.path.join(workdir, f"phase-{name}.json")
+    path_log = os.path.join(workdir, f"phase-{name}.log")
+
+    t_start = time.monotonic()
+    with open(path_log, "wb") as log:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-ctl", path_result] + argv,
+            check=True,
+            env=env,
+            stderr=log,
+            stdout=log,
+        )
+    t_total = max(time.monotonic() - t_start, 1e-6)
+
+    with open(path_result, "r", encoding="utf-8") as filp:
+        result = json.load(filp)
+
+    return {
+        "phase": name,
+        "wall": t_total,
+        "cpu": result["cpu"],
+        "files": repo.n_files,
+        "bytes": repo.n_bytes,
+        "files-per-second": repo.n_files / t_total,
+        "mb-per-second": repo.n_bytes / 2**20 / t_total,
+        "peak-rss": result["rss"],
+        "syscalls-read": result["io"].get("syscr"),
+        "syscalls-write": result["io"].get("syscw"),
+    }
+
+
+def _report(results):
+    print(
+        f"{'phase':<8} {'wall':>9} {'cpu':>9} {'files/s':>10} {'MB/s':>9} "
+        f"{'rss MiB':>8} {'read(2)':>9} {'write(2)':>9}"
+    )
+    for r in results:
+        print(
+            f"{r['phase']:<8} {r['wall']:8.2f}s {r['cpu']:8.2f}s {r['files-per-second']:10.1f} "
+            f"{r['mb-per-second']:9.1f} {r['peak-rss'] / 2**20:8.1f} "
+            f"{r['syscalls-read'] or 0:9d} {r['syscalls-write'] or 0:9d}"
+        )
+
+
+def _run(args, workdir):
+    repo = Repository(os.path.join(workdir, "upstream"), args)
+    repo.generate()
+    print(f"Repository: {repo.n_files} files, {repo.n_bytes / 2**20:.1f} MiB", file=sys.stderr)
+
+    path_config = os.path.join(workdir, "aws-config")
+    with open(path_config, "w", encoding="utf-8") as filp:
+        filp.write("[default]\nregion = us-east-1\ns3 =\n    addressing_style = path\n")
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        web = stack.enter_context(_serve(lambda *a: _QuietFileHandler(*a, directory=repo.path)))
+        s3 = stack.enter_context(_serve(_S3Handler, objects={}, uploads={}, metadata={}, n_stored=0, n_bytes=0))
+
+        env = dict(os.environ)
+        env.update({
+            "AWS_ACCESS_KEY_ID": "rpmrepo-bench",
+            "AWS_CONFIG_FILE": path_config,
+            "AWS_ENDPOINT_URL": f"http://127.0.0.1:{s3.server_address[1]}",
+            "AWS_SECRET_ACCESS_KEY": "rpmrepo-bench",
+            "AWS_SHARED_CREDENTIALS_FILE": os.devnull,
+        })
+        cache = ["--cache", os.path.join(workdir, "cache"), "--local", "bench"]
+        base_url = f"http://127.0.0.1:{web.server_address[1]}/"
+
+        results.append(_phase(
+            "pull",
+            cache + ["pull", "--base-url", base_url, "--platform-id", "bench"],
+            env, workdir, repo,
+        ))
+
+        results.append(_phase("index", cache + ["index"], env, workdir, repo))
+        results.append(_phase(
+            "push",
+            cache + ["push", "--to", "data", "public", "bench", "--to", "snapshot", "bench", "-0"],
+            env, workdir, repo,
+        ))
+
+        print(f"S3: {s3.n_stored} objects stored, {s3.n_bytes / 2**20:.1f} MiB", file=sys.stderr)
+
+    return results
+
+
+def main():
+    """Script Entrypoint"""
+
+    if len(sys.argv) > 2 and sys.argv[1] == "--run-ctl":
+        _run_ctl()
+        return
+
+    args = _parse_args()
+
+    if args.workdir:
+        os.makedirs(args.workdir)
+        results = _run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as workdir:
+            results = _run(args, workdir)
+
+    _report(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as filp:
+            json.dump({"arguments": vars(args), "phases": results}, filp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
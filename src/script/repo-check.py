@@ -79,6 +79,26 @@ class Repo:
         # and we want path operations to work without hard-coding this.
         assert url.path and url.path[-1] == "/"
 
+    def _verify_mirrors(self):
+        # optional
+        if "mirrors" not in self._data:
+            return
+
+        assert isinstance(self._data["mirrors"], list)
+        assert self._data["mirrors"]
+
+        for mirror in self._data["mirrors"]:
+            assert isinstance(mirror, str)
+
+            # must be a valid URL with a trailing slash, like `base-url`
+            url = urllib.parse.urlparse(mirror)
+            assert url.scheme in ["http", "https"]
+            assert url.path and url.path[-1] == "/"
+
+        # must not repeat the base URL or any other mirror
+        assert self._data["base-url"] not in self._data["mirrors"]
+        assert len(set(self._data["mirrors"])) == len(self._data["mirrors"])
+
     def _verify_platform_id(self):
         # mandatory
         assert "platform-id" in self._data
@@ -120,26 +140,39 @@ class Repo:
 
         for e in self._data:
             assert isinstance(e, str)
-            assert e in ["base-url", "platform-id", "singleton", "snapshot-id", "storage"]
+            assert e in ["base-url", "mirrors", "platform-id", "singleton", "snapshot-id", "storage"]
 
         self._verify_base_url()
+        self._verify_mirrors()
         self._verify_platform_id()
         self._verify_singleton()
         self._verify_snapshot_id()
         self._verify_storage()
 
-    def _verify_base_url_reference(self):
-        url = urllib.parse.urlparse(self._data["base-url"])
+    @staticmethod
+    def _verify_repomd_reference(base_url):
+        url = urllib.parse.urlparse(base_url)
         url = url._replace(path=urllib.parse.urljoin(url.path, "repodata/repomd.xml"))
 
         h = requests.head(urllib.parse.urlunparse(url), timeout=60)
         if h.status_code != 200:
             raise ValueError(f"Cannot fetch repomd.xml: {urllib.parse.urlunparse(url)} {h}")
 
+    def _verify_base_url_reference(self):
+        self._verify_repomd_reference(self._data["base-url"])
+
+    def _verify_mirrors_reference(self):
+        # Mirrors only serve packages, and those are verified against the
+        # metadata of the base URL, so they might lag behind slightly. They
+        # must still serve a repository, though.
+        for mirror in self._data.get("mirrors", []):
+            self._verify_repomd_reference(mirror)
+
     def verify_references(self):
         """Verify references to external resources"""
 
         self._verify_base_url_reference()
+        self._verify_mirrors_reference()
 
 
 def main():